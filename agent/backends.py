@@ -0,0 +1,275 @@
+import asyncio
+import json
+import time
+
+from typing import Any
+from typing import AsyncIterator
+from typing import Protocol
+
+from google.genai import types
+
+from agent.config import MODEL_NAME
+
+ResponseStream = AsyncIterator[types.GenerateContentResponse]
+
+
+class ModelBackend(Protocol):
+    """
+    Anything that can answer one turn of an agent conversation.
+    """
+
+    async def generate(
+                       self,
+                       contents: list[types.Content],
+                       config: types.GenerateContentConfig
+                       ) -> types.GenerateContentResponse:
+        ...
+
+    def generate_stream(
+                        self,
+                        contents: list[types.Content],
+                        config: types.GenerateContentConfig
+                        ) -> ResponseStream:
+        """
+        Yields the response in chunks as the model produces it.
+        """
+        ...
+
+
+def session_key(contents: list[types.Content]) -> tuple[str, int]:
+    """
+    Identifies a request by the prompt that started its conversation and
+    the number of model turns taken so far.
+    """
+    parts = contents[0].parts if contents else None
+    prompt = (parts[0].text if parts else None) or ""
+    turn = sum(1 for c in contents if c.role == "model")
+    return prompt, turn
+
+
+def merge_chunks(
+                 chunks: list[types.GenerateContentResponse]
+                 ) -> types.GenerateContentResponse:
+    """
+    Joins the chunks of a streamed response into the response a non-streamed
+    call would have returned: adjacent text parts are concatenated, other
+    parts are kept in order and the usage of the last chunk is used.
+    """
+    parts: list[types.Part] = []
+    usage_metadata = None
+    for chunk in chunks:
+        usage_metadata = chunk.usage_metadata or usage_metadata
+        for candidate in (chunk.candidates or [])[:1]:
+            for part in (candidate.content.parts or []
+                         if candidate.content else []):
+                if (
+                    part.text is not None
+                    and parts
+                    and parts[-1].text is not None
+                ):
+                    parts[-1] = types.Part(text=parts[-1].text + part.text)
+                else:
+                    parts.append(part)
+    return types.GenerateContentResponse(
+        candidates=[types.Candidate(content=types.Content(role="model",
+                                                          parts=parts))],
+        usage_metadata=usage_metadata,
+    )
+
+
+class GeminiBackend:
+    """
+    Sends requests to the Gemini API through a shared `genai.Client`, and
+    caches context for agent.prefix_cache.PrefixCachingBackend.
+
+    Args:
+        client(genai.Client): The client to send requests through.
+        model(str): Name of the Gemini model to use.
+    """
+
+    def __init__(self, client: Any, model: str = MODEL_NAME) -> None:
+        self.client = client
+        self.model = model
+
+    async def generate(
+                       self,
+                       contents: list[types.Content],
+                       config: types.GenerateContentConfig
+                       ) -> types.GenerateContentResponse:
+        return await self.client.aio.models.generate_content(
+                                                        model=self.model,
+                                                        contents=contents,
+                                                        config=config
+                                                        )
+
+    async def generate_stream(
+                              self,
+                              contents: list[types.Content],
+                              config: types.GenerateContentConfig
+                              ) -> ResponseStream:
+        stream = await self.client.aio.models.generate_content_stream(
+                                                        model=self.model,
+                                                        contents=contents,
+                                                        config=config
+                                                        )
+        async for chunk in stream:
+            yield chunk
+
+    async def create_cache(
+                           self,
+                           contents: list[types.Content],
+                           config: types.GenerateContentConfig,
+                           ttl: float
+                           ) -> tuple[str, int]:
+        cache = await self.client.aio.caches.create(
+            model=self.model,
+            config=types.CreateCachedContentConfig(
+                contents=contents,
+                system_instruction=config.system_instruction,
+                tools=config.tools,
+                tool_config=config.tool_config,
+                ttl=f"{ttl:.0f}s",
+            ),
+        )
+        usage = cache.usage_metadata
+        return cache.name, (usage.total_token_count or 0) if usage else 0
+
+    async def refresh_cache(self, name: str, ttl: float) -> None:
+        await self.client.aio.caches.update(
+            name=name,
+            config=types.UpdateCachedContentConfig(ttl=f"{ttl:.0f}s"),
+        )
+
+
+class RecordingBackend:
+    """
+    Forwards requests to another backend and appends every exchange to a
+    JSONL file that ReplayBackend can serve later.
+
+    Each line holds the session's prompt, the turn, the request contents,
+    the response and how long the wrapped backend took to answer.
+
+    Args:
+        backend(ModelBackend): The backend to forward requests to.
+        path(str): File to append the recorded exchanges to.
+    """
+
+    def __init__(self, backend: ModelBackend, path: str) -> None:
+        self.backend = backend
+        self.path = path
+
+    async def generate(
+                       self,
+                       contents: list[types.Content],
+                       config: types.GenerateContentConfig
+                       ) -> types.GenerateContentResponse:
+        start = time.perf_counter()
+        response = await self.backend.generate(contents, config)
+        self._record(contents, response, time.perf_counter() - start)
+        return response
+
+    async def generate_stream(
+                              self,
+                              contents: list[types.Content],
+                              config: types.GenerateContentConfig
+                              ) -> ResponseStream:
+        start = time.perf_counter()
+        chunks = []
+        async for chunk in self.backend.generate_stream(contents, config):
+            chunks.append(chunk)
+            yield chunk
+        self._record(contents,
+                     merge_chunks(chunks),
+                     time.perf_counter() - start,
+                     chunks)
+
+    def _record(
+                self,
+                contents: list[types.Content],
+                response: types.GenerateContentResponse,
+                latency: float,
+                chunks: list[types.GenerateContentResponse] | None = None
+                ) -> None:
+        prompt, turn = session_key(contents)
+        exchange = {
+            "prompt": prompt,
+            "turn": turn,
+            "latency": round(latency, 6),
+            "request": [
+                c.model_dump(mode="json", exclude_none=True)
+                for c in contents
+            ],
+            "response": response.model_dump(mode="json", exclude_none=True),
+        }
+        if chunks is not None:
+            exchange["chunks"] = [
+                chunk.model_dump(mode="json", exclude_none=True)
+                for chunk in chunks
+            ]
+        with open(self.path, "a") as f:
+            f.write(json.dumps(exchange) + "\n")
+
+
+class ReplayBackend:
+    """
+    Serves responses recorded by RecordingBackend without any network
+    access. A request is matched to a recording by its session's prompt and
+    turn, so replay is deterministic however sessions interleave.
+
+    Args:
+        path(str): JSONL file written by RecordingBackend.
+        latency(float | None): Seconds to wait before every answer, or None
+                               to wait as long as the recorded call took.
+    """
+
+    def __init__(self, path: str, latency: float | None = 0.0) -> None:
+        self.latency = latency
+        self._exchanges: dict[tuple[str, int], dict[str, Any]] = {}
+        with open(path, "r") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                exchange = json.loads(line)
+                key = (exchange["prompt"], exchange["turn"])
+                self._exchanges.setdefault(key, exchange)
+
+    def _exchange(self, contents: list[types.Content]) -> dict[str, Any]:
+        prompt, turn = session_key(contents)
+        exchange = self._exchanges.get((prompt, turn))
+        if exchange is None:
+            raise LookupError(f"No recorded response for turn {turn} of "
+                              f"prompt {prompt!r}")
+        return exchange
+
+    def _latency(self, exchange: dict[str, Any]) -> float:
+        return exchange["latency"] if self.latency is None else self.latency
+
+    async def generate(
+                       self,
+                       contents: list[types.Content],
+                       config: types.GenerateContentConfig
+                       ) -> types.GenerateContentResponse:
+        exchange = self._exchange(contents)
+        latency = self._latency(exchange)
+        if latency > 0:
+            await asyncio.sleep(latency)
+        return types.GenerateContentResponse.model_validate(
+                                                        exchange["response"]
+                                                        )
+
+    async def generate_stream(
+                              self,
+                              contents: list[types.Content],
+                              config: types.GenerateContentConfig
+                              ) -> ResponseStream:
+        """
+        Replays the recorded chunks, spreading the latency evenly between
+        them. Exchanges recorded without streaming come back as one chunk.
+        """
+        exchange = self._exchange(contents)
+        chunks = exchange.get("chunks", [exchange["response"]])
+        latency = self._latency(exchange) / len(chunks)
+        for chunk in chunks:
+            if latency > 0:
+                await asyncio.sleep(latency)
+            yield types.GenerateContentResponse.model_validate(chunk)
@@ -0,0 +1,163 @@
+import dataclasses
+import json
+import os
+import threading
+
+from typing import Any
+from typing import Callable
+
+from google.genai import types
+
+from agent.dispatcher import _paths_overlap
+from agent.dispatcher import _touched_path
+from agent.dispatcher import READ_ONLY_TOOLS
+
+# Tools whose results only depend on the arguments and the state of the
+# path they read. Other read-only tools, e.g. search_code, whose results
+# depend on the whole tree, go uncached.
+CACHEABLE_TOOLS = frozenset({"get_files_info", "get_file_content"})
+# Tools that only change the path they are given. Any other uncached tool,
+# e.g. run_python_file, may change anything and clears the whole cache.
+PATH_WRITING_TOOLS = frozenset({"write_file", "edit_file"})
+
+FileState = tuple[int, int]
+
+
+@dataclasses.dataclass
+class _Entry:
+    path: str
+    state: FileState
+    turn: int
+
+
+def _file_state(working_directory: str, path: str) -> FileState | None:
+    try:
+        st = os.stat(os.path.join(working_directory, path))
+    except OSError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+
+class ToolCache:
+    """
+    Per-session cache in front of the read-only tools in functions/.
+
+    Results are keyed by tool, arguments and the mtime and size of the path
+    the tool reads. A repeated read of an unchanged path does not go back to
+    disk and answers with a short "unchanged since turn N" note instead of
+    sending the full output to the model again. write_file and edit_file
+    drop entries for every path overlapping the one they wrote, and
+    run_python_file drops them all.
+
+    Args:
+        working_directory(str): Path of the session's working directory.
+        is_visible(Callable | None): Tells whether the output of a call
+                                     from a given turn is still in the
+                                     conversation in full, e.g.
+                                     History.has_full_output. Entries whose
+                                     output was compacted away are re-read.
+    """
+
+    def __init__(
+                 self,
+                 working_directory: str,
+                 is_visible: Callable[[int, types.FunctionCall], bool]
+                 | None = None
+                 ) -> None:
+        self.working_directory = working_directory
+        self.is_visible = is_visible
+        self.turn = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries: dict[tuple[str, str], _Entry] = {}
+        self._lock = threading.Lock()
+
+    def call(
+             self,
+             function_call_part: types.FunctionCall,
+             call: Callable[[types.FunctionCall], types.Content]
+             ) -> types.Content:
+        """
+        Runs `function_call_part` through `call` unless an unchanged result
+        is already cached.
+
+        Args:
+            function_call_part(types.FunctionCall): The call to run.
+            call(Callable): Runs the call for real, e.g. call_function.
+
+        Returns:
+            types.Content: The tool result, or a short note pointing at the
+                           turn that returned the same result.
+        """
+        name = function_call_part.name or ""
+        if name in READ_ONLY_TOOLS and name not in CACHEABLE_TOOLS:
+            return call(function_call_part)
+        if name not in CACHEABLE_TOOLS:
+            result = call(function_call_part)
+            self._invalidate(function_call_part)
+            return result
+
+        path = _touched_path(function_call_part)
+        key = (name, json.dumps(function_call_part.args or {},
+                                sort_keys=True, default=str))
+        state = _file_state(self.working_directory, path)
+        depth = (function_call_part.args or {}).get("depth")
+        if depth is not None and not (isinstance(depth, int) and depth <= 1):
+            # A directory's mtime says nothing about its subdirectories. A
+            # depth that is no number, e.g. null, is left for the tool to
+            # reject.
+            state = None
+        with self._lock:
+            entry = self._entries.get(key)
+        if (
+            entry is not None
+            and state is not None
+            and entry.state == state
+            and (
+                self.is_visible is None
+                or self.is_visible(entry.turn, function_call_part)
+            )
+        ):
+            with self._lock:
+                self.hits += 1
+            return _unchanged(name, path, entry.turn)
+
+        with self._lock:
+            self.misses += 1
+        result = call(function_call_part)
+        if state is not None:
+            with self._lock:
+                self._entries[key] = _Entry(path, state, self.turn)
+        return result
+
+    def _invalidate(self, function_call_part: types.FunctionCall) -> None:
+        with self._lock:
+            if function_call_part.name not in PATH_WRITING_TOOLS:
+                self._entries.clear()
+                return
+            written = _touched_path(function_call_part)
+            for key, entry in list(self._entries.items()):
+                if _paths_overlap(entry.path, written):
+                    del self._entries[key]
+
+    def stats(self) -> dict[str, Any]:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "entries": len(self._entries),
+            }
+
+
+def _unchanged(name: str, path: str, turn: int) -> types.Content:
+    kind = "Directory" if name == "get_files_info" else "File"
+    return types.Content(
+        role="tool",
+        parts=[
+            types.Part.from_function_response(
+                name=name,
+                response={"result": f"{kind} '{path}' unchanged since turn "
+                                    f"{turn}, see the result from then"},
+            )
+        ],
+    )
@@ -0,0 +1,62 @@
+"""
+Thin client for agent.daemon.
+
+Kept free of the Gemini SDK and the rest of the agent so that sending a
+prompt to a running daemon starts as fast as Python itself.
+"""
+import json
+import os
+import socket
+
+from typing import Any
+from typing import TextIO
+
+
+def send_prompt(
+                socket_path: str,
+                prompt: str,
+                out: TextIO,
+                working_directory: str | None = None,
+                session: str | None = None,
+                stream: bool = False,
+                verbose: bool = False
+                ) -> dict[str, Any]:
+    """
+    Sends `prompt` to the daemon listening on `socket_path` and writes the
+    session's output to `out` as it arrives.
+
+    Args:
+        socket_path(str): Path of the daemon's Unix socket.
+        prompt(str): The user prompt to pass to the model.
+        out(TextIO): Where to write the output, e.g. sys.stdout.
+        working_directory(str | None): Directory to work in, relative to
+                                       the current one; the daemon's
+                                       default if not given.
+        session(str | None): Name of a conversation to start or continue.
+        stream(bool): Stream the model's responses.
+        verbose(bool): Print verbose output.
+
+    Returns:
+        dict: The final event, {"event": "result", "result": {...}} with
+              the SessionResult fields, or {"event": "error", ...}.
+    """
+    request = {
+        "prompt": prompt,
+        "working_directory": (os.path.abspath(working_directory)
+                              if working_directory is not None else None),
+        "session": session,
+        "stream": stream,
+        "verbose": verbose,
+    }
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(socket_path)
+        sock.sendall(json.dumps(request).encode() + b"\n")
+        with sock.makefile("r", encoding="utf-8") as events:
+            for line in events:
+                event = json.loads(line)
+                if event["event"] == "output":
+                    out.write(event["text"])
+                    out.flush()
+                else:
+                    return event
+    return {"event": "error", "error": "Error: daemon closed the connection"}
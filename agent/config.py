@@ -0,0 +1,59 @@
+MODEL_NAME = "gemini-2.0-flash-001"
+MAX_ITERATIONS = 20
+WORKING_DIRECTORY = "./calculator"
+DEFAULT_CONCURRENCY = 4
+# Retries of a failed model call before the session gives up.
+MAX_RETRIES = 5
+# Smallest prefix, in tokens, that the API accepts as cached context, and
+# how long a cache lives after it was last used.
+CACHE_MIN_TOKENS = 4096
+CACHE_TTL_SECONDS = 300
+# Where session logs are kept for --resume, and the most seconds between
+# two fsyncs of a log.
+SESSION_LOG_DIRECTORY = ".sessions"
+FSYNC_INTERVAL_SECONDS = 1.0
+# Seconds a daemon session may sit idle before it is dropped, and the most
+# sessions a daemon keeps; the least recently used go first.
+DAEMON_SESSION_TTL_SECONDS = 3600
+DAEMON_MAX_SESSIONS = 256
+
+system_prompt = """
+You are a helpful AI coding agent.
+
+When a user asks a question or makes a request, make a function call plan.
+You can perform the following operations:
+
+- List files and directories
+- Read file contents
+- Search the code for text or regular expressions
+- Execute Python files with optional arguments
+- Edit parts of files with search/replace blocks or a unified diff
+- Write or overwrite files
+
+Prefer editing to rewriting a whole file when only part of it changes.
+
+All paths you provide should be relative to the working directory. You do not
+need to specify the working directory in your function calls as it is
+automatically injected for security reasons.
+The working directory is called calulator.
+
+Bug fixes mean that you just need to change the code that is causing the bug.
+
+If optional arguments are not needed, call the tool with an empty args list.
+Do not ask the user to supply optional args unless strictly required.
+"""
+
+planner_prompt = """
+You are the planner of a team of AI coding agents that work on the same
+code at the same time, each in its own copy of the working directory.
+
+Split the user's request into independent subtasks by calling
+plan_subtasks. Each subtask is given to a separate agent that sees nothing
+but its own instructions, so make every subtask self-contained: say which
+files it concerns and what done looks like. Subtasks must not depend on
+each other's results and should change different files, or different parts
+of a file, as their changes are merged afterwards.
+
+Use at most 8 subtasks. If the request cannot be split, call plan_subtasks
+with the request as the only subtask.
+"""
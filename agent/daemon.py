@@ -0,0 +1,267 @@
+"""
+Long-running agent daemon.
+
+One process keeps the model backend, and with it the Gemini client and
+its connection pool, warm and serves prompts over a Unix socket. Clients
+(agent.client) send one JSON request per connection and get the session's
+output streamed back as JSON lines:
+
+    {"prompt": "...", "working_directory": "/abs/path", "session": "name",
+     "stream": false, "verbose": false}
+
+    {"event": "output", "text": "..."}        any number of these
+    {"event": "result", "result": {...}}      SessionResult, last line
+    {"event": "error", "error": "..."}        instead of a result
+
+Requests without a session are one-off conversations. Requests naming a
+session continue that session's conversation in its working directory;
+requests to one session run one at a time, different sessions run
+concurrently, up to `concurrency` at once. A request that fails leaves
+its session's conversation as it was before the request. Sessions idle for
+longer than `session_ttl` are dropped, as are the least recently used ones
+beyond `max_sessions`.
+
+Output is sent as the engine prints it; before every model call, and after
+every streamed chunk, the daemon waits for the client to take it, so that a
+slow client holds its session back instead of filling the daemon's memory.
+"""
+import asyncio
+import dataclasses
+import io
+import json
+import os
+import time
+
+from collections import OrderedDict
+from typing import Any
+
+from google.genai import types
+
+from agent.backends import ModelBackend
+from agent.backends import ResponseStream
+from agent.config import DAEMON_MAX_SESSIONS
+from agent.config import DAEMON_SESSION_TTL_SECONDS
+from agent.config import DEFAULT_CONCURRENCY
+from agent.config import WORKING_DIRECTORY
+from agent.engine import AgentEngine
+from agent.history import History
+
+
+@dataclasses.dataclass
+class DaemonSession:
+    """
+    A conversation kept by the daemon between requests.
+    """
+    working_directory: str
+    history: History | None = None
+    lock: asyncio.Lock = dataclasses.field(default_factory=asyncio.Lock)
+    last_used: float = dataclasses.field(default_factory=time.monotonic)
+
+
+class _EventWriter(io.TextIOBase):
+    """
+    Text stream that forwards everything the engine prints to the client
+    as output events.
+    """
+
+    def __init__(self, writer: asyncio.StreamWriter) -> None:
+        self._writer = writer
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, text: str) -> int:
+        if text and not self._writer.is_closing():
+            _send(self._writer, {"event": "output", "text": text})
+        return len(text)
+
+    async def drain(self) -> None:
+        await self._writer.drain()
+
+
+class _DrainingBackend:
+    """
+    Forwards requests to another backend, first waiting until the client
+    has taken the output printed so far.
+    """
+
+    def __init__(self, backend: ModelBackend, out: _EventWriter) -> None:
+        self.backend = backend
+        self.out = out
+
+    async def generate(
+                       self,
+                       contents: list[types.Content],
+                       config: types.GenerateContentConfig
+                       ) -> types.GenerateContentResponse:
+        await self.out.drain()
+        return await self.backend.generate(contents, config)
+
+    async def generate_stream(
+                              self,
+                              contents: list[types.Content],
+                              config: types.GenerateContentConfig
+                              ) -> ResponseStream:
+        await self.out.drain()
+        async for chunk in self.backend.generate_stream(contents, config):
+            yield chunk
+            # The engine has printed the chunk by the time it asks for the
+            # next one.
+            await self.out.drain()
+
+
+def _send(writer: asyncio.StreamWriter, event: dict[str, Any]) -> None:
+    writer.write(json.dumps(event).encode() + b"\n")
+
+
+class AgentDaemon:
+    """
+    Serves agent sessions on a Unix socket with one shared backend.
+
+    Args:
+        backend(ModelBackend): Model backend shared by all sessions.
+        socket_path(str): Path of the Unix socket to listen on.
+        working_directory(str): Working directory of requests that do not
+                                name one.
+        concurrency(int): Maximum number of sessions running at once.
+        session_ttl(float): Seconds a named session may be idle before it
+                            is dropped.
+        max_sessions(int): Maximum number of named sessions kept.
+        engine_options(Any): Further AgentEngine arguments, e.g.
+                             max_iterations, used for every session.
+    """
+
+    def __init__(
+                 self,
+                 backend: ModelBackend,
+                 socket_path: str,
+                 working_directory: str = WORKING_DIRECTORY,
+                 concurrency: int = DEFAULT_CONCURRENCY,
+                 session_ttl: float = DAEMON_SESSION_TTL_SECONDS,
+                 max_sessions: int = DAEMON_MAX_SESSIONS,
+                 **engine_options: Any
+                 ) -> None:
+        self.backend = backend
+        self.socket_path = socket_path
+        self.working_directory = os.path.abspath(working_directory)
+        self.engine_options = engine_options
+        self.session_ttl = session_ttl
+        self.max_sessions = max_sessions
+        # In order of last use, least recent first.
+        self.sessions: OrderedDict[str, DaemonSession] = OrderedDict()
+        self._semaphore = asyncio.Semaphore(max(1, concurrency))
+        self._server: asyncio.AbstractServer | None = None
+
+    async def start(self) -> None:
+        """
+        Starts listening; the socket is only accessible to its owner.
+        """
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        old_umask = os.umask(0o177)
+        try:
+            self._server = await asyncio.start_unix_server(self._handle,
+                                                           self.socket_path)
+        finally:
+            os.umask(old_umask)
+
+    async def serve_forever(self) -> None:
+        if self._server is None:
+            await self.start()
+        assert self._server is not None
+        try:
+            await self._server.serve_forever()
+        finally:
+            await self.close()
+
+    async def close(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+            if os.path.exists(self.socket_path):
+                os.unlink(self.socket_path)
+
+    def _evict(self, keep: str | None = None) -> None:
+        """
+        Drops idle sessions and the least recently used ones beyond
+        max_sessions, except `keep` and those with a request running or
+        waiting.
+        """
+        now = time.monotonic()
+        for name, session in list(self.sessions.items()):
+            if name == keep or session.lock.locked():
+                continue
+            if (now - session.last_used > self.session_ttl
+                    or len(self.sessions) > self.max_sessions):
+                del self.sessions[name]
+
+    async def _handle(
+                      self,
+                      reader: asyncio.StreamReader,
+                      writer: asyncio.StreamWriter
+                      ) -> None:
+        try:
+            line = await reader.readline()
+            try:
+                request = json.loads(line)
+                prompt = request["prompt"]
+            except (ValueError, KeyError, TypeError):
+                _send(writer, {"event": "error",
+                               "error": "Error: invalid request"})
+                return
+            result = await self._run(request, prompt, _EventWriter(writer))
+            _send(writer, result)
+        except Exception as e:
+            _send(writer, {"event": "error", "error": f"Error: {e}"})
+        finally:
+            try:
+                await writer.drain()
+            except ConnectionError:
+                pass
+            writer.close()
+
+    async def _run(
+                   self,
+                   request: dict[str, Any],
+                   prompt: str,
+                   out: _EventWriter
+                   ) -> dict[str, Any]:
+        working_directory = request.get("working_directory")
+        name = request.get("session")
+        if name is None:
+            session = DaemonSession(working_directory
+                                    or self.working_directory)
+        else:
+            session = self.sessions.setdefault(
+                name,
+                DaemonSession(working_directory or self.working_directory)
+            )
+            self.sessions.move_to_end(name)
+            session.last_used = time.monotonic()
+        self._evict(keep=name)
+        if working_directory not in (None, session.working_directory):
+            return {"event": "error",
+                    "error": f"Error: session '{name}' works in "
+                             f"{session.working_directory}"}
+        engine = AgentEngine(_DrainingBackend(self.backend, out),
+                             working_directory=session.working_directory,
+                             verbose=bool(request.get("verbose")),
+                             stdout=out,
+                             stream=bool(request.get("stream")),
+                             **self.engine_options)
+        async with session.lock, self._semaphore:
+            if session.history is None:
+                session.history = History(None,
+                                          token_budget=engine.token_budget)
+            before = session.history.copy()
+            try:
+                result = await engine.run(prompt, history=session.history)
+            except BaseException:
+                # Leave no half-finished turn, e.g. a prompt without an
+                # answer, for the next request to continue from.
+                session.history = before
+                raise
+            finally:
+                session.last_used = time.monotonic()
+        return {"event": "result", "result": dataclasses.asdict(result)}
@@ -0,0 +1,163 @@
+import os
+
+from concurrent.futures import Future
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import wait
+from typing import Callable
+from typing import Generic
+from typing import Iterable
+from typing import TypeVar
+
+from google.genai import types
+
+R = TypeVar("R")
+
+DEFAULT_MAX_WORKERS = 8
+
+# Tools that never modify the working directory and can safely run
+# alongside each other.
+READ_ONLY_TOOLS = frozenset({"get_files_info",
+                             "get_file_content",
+                             "search_code"})
+
+# The argument holding the path a tool touches. Tools missing from this
+# mapping (e.g. run_python_file, whose script may touch anything) are
+# treated as touching the whole working directory.
+TOOL_PATH_ARGS: dict[str, str] = {
+    "get_files_info": "directory",
+    "get_file_content": "file_path",
+    "write_file": "file_path",
+    "edit_file": "file_path",
+    "search_code": "path",
+}
+
+
+def _touched_path(function_call_part: types.FunctionCall) -> str:
+    """
+    Returns the normalised path, relative to the working directory, that
+    the function call reads or writes. '.' stands for the whole tree.
+    """
+    arg_name = TOOL_PATH_ARGS.get(function_call_part.name or "")
+    if arg_name is None:
+        return "."
+    path = (function_call_part.args or {}).get(arg_name) or "."
+    return os.path.normpath(str(path))
+
+
+def _paths_overlap(a: str, b: str) -> bool:
+    if a == "." or b == ".":
+        return True
+    return (
+            a == b
+            or b.startswith(a.rstrip(os.sep) + os.sep)
+            or a.startswith(b.rstrip(os.sep) + os.sep)
+            )
+
+
+def _conflicts(
+               first: types.FunctionCall,
+               second: types.FunctionCall
+               ) -> bool:
+    if first.name in READ_ONLY_TOOLS and second.name in READ_ONLY_TOOLS:
+        return False
+    return _paths_overlap(_touched_path(first), _touched_path(second))
+
+
+def _run_after(
+               dependencies: list[Future],
+               call: Callable[[types.FunctionCall], R],
+               function_call_part: types.FunctionCall
+               ) -> R:
+    wait(dependencies)
+    return call(function_call_part)
+
+
+class CallScheduler(Generic[R]):
+    """
+    Starts function calls on a thread pool as they are submitted, ordering
+    each one behind the earlier calls it conflicts with.
+
+    Read-only tools run in parallel with each other. A call to any other
+    tool waits for every earlier call touching an overlapping path, and
+    every later call touching an overlapping path waits for it, so writes
+    and script runs keep the order the model asked for. Calls can be
+    submitted one at a time, e.g. while a streamed response is arriving.
+
+    Args:
+        call(Callable): Runs a single function call, e.g. call_function.
+        max_workers(int): Maximum number of calls running at once.
+    """
+
+    def __init__(
+                 self,
+                 call: Callable[[types.FunctionCall], R],
+                 max_workers: int = DEFAULT_MAX_WORKERS
+                 ) -> None:
+        self.call = call
+        self._calls: list[types.FunctionCall] = []
+        self._futures: list[Future[R]] = []
+        self._pool = ThreadPoolExecutor(max_workers=max(1, max_workers))
+
+    def submit(self, function_call_part: types.FunctionCall) -> Future[R]:
+        """
+        Starts `function_call_part` as soon as the calls it conflicts with
+        are done.
+        """
+        # Dependencies always point at earlier submissions, so the FIFO
+        # pool can never block on a call that has not been picked up yet.
+        dependencies = [
+            future for earlier, future in zip(self._calls, self._futures)
+            if _conflicts(earlier, function_call_part)
+        ]
+        future = self._pool.submit(_run_after,
+                                   dependencies,
+                                   self.call,
+                                   function_call_part)
+        self._calls.append(function_call_part)
+        self._futures.append(future)
+        return future
+
+    def results(self) -> list[R]:
+        """
+        Waits for every submitted call and returns the results in
+        submission order.
+        """
+        return [future.result() for future in self._futures]
+
+    def close(self) -> None:
+        self._pool.shutdown(wait=True)
+
+    def __enter__(self) -> "CallScheduler[R]":
+        return self
+
+    def __exit__(self, *exc_info: object) -> None:
+        self.close()
+
+
+def dispatch_function_calls(
+                            function_calls: Iterable[types.FunctionCall],
+                            call: Callable[[types.FunctionCall], R],
+                            max_workers: int = DEFAULT_MAX_WORKERS
+                            ) -> list[R]:
+    """
+    Runs the function calls from one model turn concurrently, following the
+    ordering rules of CallScheduler, and returns their results in the order
+    the calls were made.
+
+    Args:
+        function_calls(Iterable[types.FunctionCall]): Calls from the model
+                                                      response.
+        call(Callable): Runs a single function call, e.g. call_function.
+        max_workers(int): Maximum number of calls running at once.
+
+    Returns:
+        list: The result of `call` for every function call, in call order.
+    """
+    calls = list(function_calls)
+    if len(calls) <= 1 or max_workers <= 1:
+        return [call(function_call_part) for function_call_part in calls]
+
+    with CallScheduler(call, min(max_workers, len(calls))) as scheduler:
+        for function_call_part in calls:
+            scheduler.submit(function_call_part)
+        return scheduler.results()
@@ -0,0 +1,598 @@
+import asyncio
+import contextlib
+import dataclasses
+import json
+import threading
+import time
+
+from collections import Counter
+from functools import partial
+from typing import AsyncIterator
+from typing import Callable
+from typing import ContextManager
+from typing import Iterable
+from typing import Iterator
+from typing import TextIO
+
+from google.genai import types
+
+from agent.backends import merge_chunks
+from agent.backends import ModelBackend
+from agent.cache import ToolCache
+from agent.config import DEFAULT_CONCURRENCY
+from agent.config import MAX_ITERATIONS
+from agent.config import system_prompt
+from agent.config import WORKING_DIRECTORY
+from agent.dispatcher import CallScheduler
+from agent.dispatcher import dispatch_function_calls
+from agent.history import DEFAULT_TOKEN_BUDGET
+from agent.history import History
+from agent.session_log import call_key
+from agent.session_log import checkpointed
+from agent.session_log import SavedSession
+from agent.session_log import SessionLog
+from agent.tools import available_functions
+from agent.tools import call_function
+from agent.tracing import Span
+from agent.tracing import Tracer
+
+
+@dataclasses.dataclass
+class SessionResult:
+    """
+    Outcome of a single agent session, one line of the batch JSONL output.
+    """
+    prompt: str
+    index: int | None = None
+    text: str | None = None
+    iterations: int = 0
+    function_calls: int = 0
+    prompt_tokens: int = 0
+    response_tokens: int = 0
+    # Prompt tokens served from a context cache instead of sent again.
+    cached_tokens: int = 0
+    tokens_saved: int = 0
+    cache_hits: int = 0
+    cache_misses: int = 0
+    error: str | None = None
+
+    def to_json(self) -> str:
+        return json.dumps(dataclasses.asdict(self))
+
+
+@dataclasses.dataclass
+class IterationStats:
+    """
+    Where the time of one agent loop iteration went.
+
+    `tool_seconds` sums the duration of every call per function, so calls
+    that ran in parallel can add up to more than `tools_seconds`, the wall
+    time of the whole dispatch.
+    """
+    iteration: int
+    model_seconds: float = 0.0
+    tools_seconds: float = 0.0
+    history_seconds: float = 0.0
+    tool_seconds: dict[str, float] = dataclasses.field(default_factory=dict)
+    tool_calls: dict[str, int] = dataclasses.field(default_factory=dict)
+    prompt_tokens: int = 0
+    response_tokens: int = 0
+    cached_tokens: int = 0
+
+
+class _ToolTimer:
+    def __init__(self, stats: IterationStats) -> None:
+        self.stats = stats
+        self._lock = threading.Lock()
+
+    def wrap(
+             self,
+             call: Callable[[types.FunctionCall], types.Content]
+             ) -> Callable[[types.FunctionCall], types.Content]:
+        def timed(function_call_part: types.FunctionCall) -> types.Content:
+            start = time.perf_counter()
+            try:
+                return call(function_call_part)
+            finally:
+                elapsed = time.perf_counter() - start
+                name = function_call_part.name or "None"
+                with self._lock:
+                    stats = self.stats
+                    stats.tool_seconds[name] = (
+                        stats.tool_seconds.get(name, 0.0) + elapsed
+                    )
+                    stats.tool_calls[name] = stats.tool_calls.get(name, 0) + 1
+        return timed
+
+
+class AgentEngine:
+    """
+    Runs agent sessions on asyncio, sharing one model backend between them.
+
+    The backend is any agent.backends.ModelBackend: the Gemini API, a
+    recording or replay of it, or agent.fake_model.ScriptedModel. At most
+    `concurrency` sessions talk to the model at the same time; tool
+    calls run on worker threads through the dispatcher so they never block
+    the event loop.
+
+    With `stream` set, responses are streamed: text is printed as it
+    arrives and every function call starts running as soon as its part has
+    arrived, overlapping tool execution with the rest of the generation.
+
+    `on_iteration`, if given, is called with the session's result so far
+    and an IterationStats after every iteration of the loop. `tracer`, if
+    given, records a span for every session, model call, tool call and
+    process run.
+    """
+
+    def __init__(
+                 self,
+                 backend: ModelBackend,
+                 working_directory: str = WORKING_DIRECTORY,
+                 max_iterations: int = MAX_ITERATIONS,
+                 concurrency: int = DEFAULT_CONCURRENCY,
+                 verbose: bool = False,
+                 stdout: TextIO | None = None,
+                 token_budget: int = DEFAULT_TOKEN_BUDGET,
+                 on_iteration: Callable[[SessionResult, IterationStats], None]
+                 | None = None,
+                 stream: bool = False,
+                 tracer: Tracer | None = None
+                 ) -> None:
+        self.backend = backend
+        self.working_directory = working_directory
+        self.max_iterations = max_iterations
+        self.concurrency = max(1, concurrency)
+        self.verbose = verbose
+        self.stdout = stdout
+        self.token_budget = token_budget
+        self.on_iteration = on_iteration
+        self.stream = stream
+        self.tracer = tracer
+        self.config = types.GenerateContentConfig(
+                                        tools=[available_functions()],
+                                        system_instruction=system_prompt
+                                        )
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+
+    def _echo(self, msg: str, end: str = "\n") -> None:
+        if self.stdout is not None:
+            print(msg, file=self.stdout, end=end, flush=end == "")
+
+    def _echo_call(self, function_call_part: types.FunctionCall) -> None:
+        if self.verbose:
+            self._echo(f"Calling function: {function_call_part.name}"
+                       f"({function_call_part.args})")
+        else:
+            self._echo(f" - Calling function: {function_call_part.name}")
+
+    async def run(
+                  self,
+                  prompt: str,
+                  history: History | None = None,
+                  log: SessionLog | None = None
+                  ) -> SessionResult:
+        """
+        Runs one session to completion.
+
+        Args:
+            prompt(str): The user prompt to pass to the model.
+            history(History | None): Conversation to add `prompt` to and
+                                     continue, e.g. the history of an
+                                     earlier run; a new one if not given.
+            log(SessionLog | None): Log to record a new session in, so that
+                                    it can be resumed.
+
+        Returns:
+            SessionResult: The final text, iteration count and token usage.
+        """
+        async with self._semaphore:
+            return await self._run_session(prompt, history, log)
+
+    async def resume(
+                     self,
+                     saved: SavedSession,
+                     log: SessionLog | None = None
+                     ) -> SessionResult:
+        """
+        Carries on a logged session from its last completed step. The
+        history is rebuilt from the log and tool calls that finished
+        before the session stopped are not run again.
+
+        Args:
+            saved(SavedSession): The session, from load_session.
+            log(SessionLog | None): Log to record the rest of the session
+                                    in, usually the one it was loaded from.
+
+        Returns:
+            SessionResult: The result of the whole session, counting the
+                           iterations and tokens from before the resume.
+        """
+        async with self._semaphore:
+            return await self._run_session(saved.prompt, log=log,
+                                           saved=saved)
+
+    def _span(
+              self,
+              name: str,
+              category: str,
+              session: int | None,
+              iteration: int | None = None,
+              **attrs: object
+              ) -> ContextManager[Span]:
+        if self.tracer is None:
+            return contextlib.nullcontext(Span(name, category))
+        return self.tracer.span(name, category, session, iteration, **attrs)
+
+    async def _run_session(
+                           self,
+                           prompt: str,
+                           history: History | None = None,
+                           log: SessionLog | None = None,
+                           saved: SavedSession | None = None
+                           ) -> SessionResult:
+        session = None
+        if self.tracer is not None:
+            session = self.tracer.start_session(prompt)
+        with self._span("session", "session", session) as span:
+            result = await self._run_loop(prompt, history, session, log,
+                                          saved)
+            span.error = result.error
+            span.attrs.update(iterations=result.iterations,
+                              function_calls=result.function_calls,
+                              prompt_tokens=result.prompt_tokens,
+                              response_tokens=result.response_tokens,
+                              cached_tokens=result.cached_tokens,
+                              tokens_saved=result.tokens_saved)
+        return result
+
+    async def _run_loop(
+                        self,
+                        prompt: str,
+                        history: History | None,
+                        session: int | None,
+                        log: SessionLog | None = None,
+                        saved: SavedSession | None = None
+                        ) -> SessionResult:
+        result = SessionResult(prompt=prompt)
+        # A logged response whose tool calls had not all finished, and the
+        # logged results of the calls that had.
+        pending = None
+        finished: dict[tuple[int, str], list[types.Content]] = {}
+        if saved is not None:
+            if saved.final is not None:
+                result.text = saved.final
+                return result
+            history, pending, finished = self._restore(saved, result)
+        elif history is None:
+            history = History(prompt, token_budget=self.token_budget)
+            if log is not None:
+                log.start(prompt, self.working_directory)
+        else:
+            history.add_prompt(prompt)
+        cache = ToolCache(self.working_directory,
+                          is_visible=history.has_full_output)
+        while result.iterations < self.max_iterations:
+            result.iterations += 1
+            stats = IterationStats(iteration=result.iterations)
+            # Tool results belong to the turn the response is about to add.
+            cache.turn = history.turn + 1
+            function_call_results = None
+            if pending is not None:
+                content_resp, pending = pending, None
+                model_span = Span("generate", "model")
+            else:
+                with self._span("generate", "model", session,
+                                stats.iteration,
+                                history_tokens=history.token_count,
+                                stream=self.stream) as model_span:
+                    if self.stream:
+                        content_resp, function_call_results = (
+                            await self._stream_turn(history.messages, cache,
+                                                    stats, session, log,
+                                                    finished)
+                        )
+                    else:
+                        start = time.perf_counter()
+                        content_resp = await self.backend.generate(
+                                                    history.messages,
+                                                    self.config
+                                                    )
+                        stats.model_seconds = time.perf_counter() - start
+                if log is not None:
+                    log.model(cache.turn, content_resp)
+
+            start = time.perf_counter()
+            for c in content_resp.candidates or []:
+                if c.content is not None:
+                    history.add_model_content(c.content)
+            stats.history_seconds += time.perf_counter() - start
+
+            meta = content_resp.usage_metadata
+            if meta is not None:
+                stats.prompt_tokens = meta.prompt_token_count or 0
+                stats.response_tokens = meta.candidates_token_count or 0
+                stats.cached_tokens = meta.cached_content_token_count or 0
+                result.prompt_tokens += stats.prompt_tokens
+                result.response_tokens += stats.response_tokens
+                result.cached_tokens += stats.cached_tokens
+            model_span.attrs.update(
+                prompt_tokens=stats.prompt_tokens,
+                response_tokens=stats.response_tokens,
+                cached_tokens=stats.cached_tokens,
+                function_calls=len(content_resp.function_calls or []),
+            )
+            if self.verbose:
+                self._echo(f"User prompt: {prompt}")
+                if meta is None:
+                    self._echo("Error getting usage data")
+                else:
+                    self._echo(f"Prompt tokens: {meta.prompt_token_count}")
+                    self._echo("Response tokens: "
+                               f"{meta.candidates_token_count}")
+                    if meta.cached_content_token_count:
+                        self._echo("Cached prompt tokens: "
+                                   f"{meta.cached_content_token_count}")
+
+            if content_resp.function_calls:
+                function_calls = content_resp.function_calls
+                if function_call_results is None:
+                    for function_call_part in function_calls:
+                        self._echo_call(function_call_part)
+                    start = time.perf_counter()
+                    function_call_results = await asyncio.to_thread(
+                        dispatch_function_calls,
+                        function_calls,
+                        self._tool_call(cache, stats, session, log, finished)
+                    )
+                    stats.tools_seconds = time.perf_counter() - start
+                self._echo_results(function_call_results)
+                result.function_calls += len(function_calls)
+                result.cache_hits = cache.hits
+                result.cache_misses = cache.misses
+
+                start = time.perf_counter()
+                history.add_tool_results(function_calls,
+                                         function_call_results)
+                report = history.compact()
+                stats.history_seconds += time.perf_counter() - start
+                result.tokens_saved += report.tokens_saved
+                if self.verbose and report.tokens_saved > 0:
+                    self._echo(f"Compacted history: saved "
+                               f"{report.tokens_saved} prompt tokens")
+                self._report(result, stats)
+            elif content_resp.text is not None:
+                if not self.stream:
+                    self._echo(content_resp.text)
+                result.text = content_resp.text
+                if log is not None:
+                    log.final(content_resp.text)
+                self._report(result, stats)
+                return result
+            else:
+                self._report(result, stats)
+
+        result.error = (f"Error: no final response after "
+                        f"{self.max_iterations} iterations")
+        return result
+
+    def _restore(
+                 self,
+                 saved: SavedSession,
+                 result: SessionResult
+                 ) -> tuple[History,
+                            types.GenerateContentResponse | None,
+                            dict[tuple[int, str], list[types.Content]]]:
+        """
+        Rebuilds the history of `saved` and counts its completed
+        iterations into `result`.
+
+        Returns:
+            tuple: The history, the last response if its tool calls did not
+                   all finish, and the logged results not used up yet.
+        """
+        history = History(saved.prompt, token_budget=self.token_budget)
+        finished = {key: list(results)
+                    for key, results in saved.tool_results.items()}
+        for response in saved.responses:
+            calls = [part.function_call
+                     for content in response.contents
+                     for part in content.parts or []
+                     if part.function_call is not None]
+            needed = Counter(call_key(call) for call in calls)
+            if any(len(finished.get((response.turn, key), [])) < count
+                   for key, count in needed.items()):
+                return history, types.GenerateContentResponse(
+                    candidates=[types.Candidate(content=content)
+                                for content in response.contents],
+                    usage_metadata=types.GenerateContentResponseUsageMetadata(
+                        prompt_token_count=response.prompt_tokens,
+                        candidates_token_count=response.response_tokens,
+                    ),
+                ), finished
+            result.iterations += 1
+            result.prompt_tokens += response.prompt_tokens
+            result.response_tokens += response.response_tokens
+            for content in response.contents:
+                history.add_model_content(content)
+            if calls:
+                results = [finished[(response.turn, call_key(call))].pop(0)
+                           for call in calls]
+                history.add_tool_results(calls, results)
+                result.tokens_saved += history.compact().tokens_saved
+                result.function_calls += len(calls)
+        return history, None, finished
+
+    def _report(self, result: SessionResult, stats: IterationStats) -> None:
+        if self.on_iteration is not None:
+            self.on_iteration(result, stats)
+
+    def _tool_call(
+                   self,
+                   cache: ToolCache,
+                   stats: IterationStats,
+                   session: int | None = None,
+                   log: SessionLog | None = None,
+                   finished: dict[tuple[int, str], list[types.Content]]
+                   | None = None
+                   ) -> Callable[[types.FunctionCall], types.Content]:
+        call: Callable[[types.FunctionCall], types.Content] = partial(
+            call_function, working_directory=self.working_directory
+        )
+        if self.tracer is not None:
+            call = self.tracer.executing(call)
+        call = partial(cache.call, call=call)
+        if log is not None or finished:
+            call = checkpointed(call, cache.turn, log, finished or {})
+        if self.tracer is not None:
+            call = self.tracer.trace_tool(call, session, stats.iteration)
+        return _ToolTimer(stats).wrap(call)
+
+    async def _stream_turn(
+                           self,
+                           messages: list[types.Content],
+                           cache: ToolCache,
+                           stats: IterationStats,
+                           session: int | None = None,
+                           log: SessionLog | None = None,
+                           finished: dict[tuple[int, str],
+                                          list[types.Content]] | None = None
+                           ) -> tuple[types.GenerateContentResponse,
+                                      list[types.Content]]:
+        """
+        Streams one response, printing its text as it arrives and handing
+        each function call to the scheduler as soon as its part is
+        complete. `stats.tools_seconds` is the time spent waiting for tools
+        after the stream ended, i.e. the part that did not overlap.
+        """
+        chunks = []
+        ends_in_text = False
+        with CallScheduler(self._tool_call(cache, stats, session, log,
+                                           finished)) as scheduler:
+            start = time.perf_counter()
+            stream = self.backend.generate_stream(messages, self.config)
+            async for chunk in stream:
+                chunks.append(chunk)
+                for candidate in (chunk.candidates or [])[:1]:
+                    content = candidate.content
+                    for part in (content.parts or [] if content else []):
+                        if part.text:
+                            self._echo(part.text, end="")
+                            ends_in_text = True
+                        if part.function_call is not None:
+                            if ends_in_text:
+                                self._echo("")
+                                ends_in_text = False
+                            self._echo_call(part.function_call)
+                            scheduler.submit(part.function_call)
+            if ends_in_text:
+                self._echo("")
+            stats.model_seconds = time.perf_counter() - start
+
+            start = time.perf_counter()
+            function_call_results = await asyncio.to_thread(
+                                                        scheduler.results
+                                                        )
+            stats.tools_seconds = time.perf_counter() - start
+        return merge_chunks(chunks), function_call_results
+
+    def _echo_results(
+                      self,
+                      function_call_results: list[types.Content]
+                      ) -> None:
+        for function_call_result in function_call_results:
+            if (
+                function_call_result.parts is None
+                or function_call_result.parts[0].function_response is None
+            ):
+                raise RuntimeError("Function call returned no response")
+            function_response = function_call_result.parts[0].function_response
+            self._echo(f"-> {function_response.response}")
+
+    async def _run_batch_item(self, index: int, prompt: str) -> SessionResult:
+        try:
+            result = await self.run(prompt)
+        except Exception as e:
+            result = SessionResult(prompt=prompt, error=f"Error: {e}")
+        result.index = index
+        return result
+
+    async def run_batch(
+                        self,
+                        prompts: Iterable[str]
+                        ) -> AsyncIterator[SessionResult]:
+        """
+        Runs a session per prompt and yields each result as soon as its
+        session finishes. Prompts are pulled lazily, on a thread so that a
+        slow source does not hold up the running sessions, and no more
+        than `concurrency` sessions are ever pending. A failing session
+        yields a result with `error` set instead of stopping the batch.
+
+        Args:
+            prompts(Iterable[str]): Prompts to run, e.g. from read_prompts.
+
+        Returns:
+            AsyncIterator[SessionResult]: Results in completion order, each
+                                          tagged with its prompt's index.
+        """
+        pending: set[asyncio.Task[SessionResult]] = set()
+        it = iter(prompts)
+        # The next prompt, fetched on a thread: reading it, e.g. from
+        # stdin, may block until the producer writes another line.
+        fetch: asyncio.Future[str | None] | None = None
+        index = 0
+        exhausted = False
+        while not exhausted or pending:
+            if (fetch is None and not exhausted
+                    and len(pending) < self.concurrency):
+                fetch = asyncio.ensure_future(
+                    asyncio.to_thread(next, it, None)
+                )
+            waiting: set[asyncio.Future] = set(pending)
+            if fetch is not None:
+                waiting.add(fetch)
+            done, _ = await asyncio.wait(waiting,
+                                         return_when=asyncio.FIRST_COMPLETED)
+            if fetch is not None and fetch in done:
+                prompt = fetch.result()
+                fetch = None
+                if prompt is None:
+                    exhausted = True
+                else:
+                    pending.add(asyncio.create_task(
+                        self._run_batch_item(index, prompt),
+                        name=str(index),
+                    ))
+                    index += 1
+            finished = done & pending
+            pending -= finished
+            for task in sorted(finished, key=_task_index):
+                yield task.result()
+
+
+def _task_index(task: asyncio.Task) -> int:
+    return int(task.get_name())
+
+
+def read_prompts(stream: TextIO) -> Iterator[str]:
+    """
+    Yields one prompt per non-blank line of `stream`.
+    """
+    for line in stream:
+        prompt = line.strip()
+        if prompt:
+            yield prompt
+
+
+async def write_batch_results(
+                              engine: AgentEngine,
+                              prompts: Iterable[str],
+                              out: TextIO
+                              ) -> None:
+    """
+    Runs `prompts` through `engine` and streams each result to `out` as a
+    JSON line as soon as it is available.
+    """
+    async for result in engine.run_batch(prompts):
+        out.write(result.to_json() + "\n")
+        out.flush()
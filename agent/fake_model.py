@@ -0,0 +1,362 @@
+import asyncio
+import dataclasses
+import random
+import time
+
+from typing import Any
+from typing import Callable
+from typing import Mapping
+from typing import Sequence
+
+from google.genai import errors
+from google.genai import types
+
+from agent.backends import ModelBackend
+from agent.backends import ResponseStream
+from agent.backends import session_key
+from agent.history import estimate_tokens
+
+# A scripted reply is either the model's final text or the function calls
+# it makes on that turn, given as (name, args) pairs.
+Reply = str | list[tuple[str, dict[str, Any]]]
+Script = Mapping[str, Sequence[Reply]] | Callable[[str], Sequence[Reply]]
+
+FINAL_TEXT = "Done."
+
+
+class ScriptedModel:
+    """
+    Local stand-in model backend that answers from a script instead of
+    calling the Gemini API.
+
+    The script maps a prompt to the replies given on the successive turns
+    of that prompt's session; once they run out the model answers with
+    FINAL_TEXT. The turn is worked out from the conversation passed in, so
+    any number of concurrent sessions can share one ScriptedModel.
+
+    Streamed replies come in chunks of a few words of text or one function
+    call each, `chunk_latency` seconds apart.
+
+    Args:
+        script(Script): Mapping or callable from prompt to replies.
+        latency(float): Seconds every call waits before answering.
+        chunk_latency(float): Seconds between the chunks of a stream.
+    """
+
+    def __init__(
+                 self,
+                 script: Script,
+                 latency: float = 0.0,
+                 chunk_latency: float = 0.0
+                 ) -> None:
+        self.script = script
+        self.latency = latency
+        self.chunk_latency = chunk_latency
+        self.requests = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    def _replies(self, prompt: str) -> Sequence[Reply]:
+        if callable(self.script):
+            return self.script(prompt)
+        return self.script.get(prompt, ())
+
+    async def generate(
+                       self,
+                       contents: list[types.Content],
+                       config: types.GenerateContentConfig
+                       ) -> types.GenerateContentResponse:
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(self.latency)
+            return self.reply(contents)
+        finally:
+            self.in_flight -= 1
+
+    async def generate_stream(
+                              self,
+                              contents: list[types.Content],
+                              config: types.GenerateContentConfig
+                              ) -> ResponseStream:
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(self.latency)
+            response = self.reply(contents)
+            content = response.candidates[0].content
+            chunks: list[types.Part] = []
+            for part in content.parts or []:
+                if part.text is None:
+                    chunks.append(part)
+                    continue
+                words = part.text.split(" ")
+                for i in range(0, len(words), 3):
+                    text = " ".join(words[i:i + 3])
+                    if i + 3 < len(words):
+                        text += " "
+                    chunks.append(types.Part(text=text))
+            for i, part in enumerate(chunks):
+                if i > 0:
+                    await asyncio.sleep(self.chunk_latency)
+                yield types.GenerateContentResponse(
+                    candidates=[types.Candidate(
+                        content=types.Content(role="model", parts=[part])
+                    )],
+                    usage_metadata=(response.usage_metadata
+                                    if i == len(chunks) - 1 else None),
+                )
+        finally:
+            self.in_flight -= 1
+
+    def reply(
+              self,
+              contents: list[types.Content]
+              ) -> types.GenerateContentResponse:
+        """
+        Builds the scripted response for the conversation in `contents`.
+        """
+        self.requests += 1
+        prompt, turn = session_key(contents)
+        replies = self._replies(prompt)
+        reply = replies[turn] if turn < len(replies) else FINAL_TEXT
+
+        if isinstance(reply, str):
+            parts = [types.Part(text=reply)]
+        else:
+            parts = [
+                types.Part(function_call=types.FunctionCall(name=name,
+                                                            args=args))
+                for name, args in reply
+            ]
+        content = types.Content(role="model", parts=parts)
+        return types.GenerateContentResponse(
+            candidates=[types.Candidate(content=content)],
+            usage_metadata=types.GenerateContentResponseUsageMetadata(
+                prompt_token_count=estimate_tokens(contents),
+                candidates_token_count=estimate_tokens([content]),
+            ),
+        )
+
+
+_STATUSES = {408: "DEADLINE_EXCEEDED", 429: "RESOURCE_EXHAUSTED",
+             500: "INTERNAL", 503: "UNAVAILABLE"}
+
+
+class FlakyBackend:
+    """
+    Local stand-in for an unreliable Gemini endpoint. Forwards requests to
+    another backend, e.g. a ScriptedModel, after `latency` seconds, but
+    fails some of them with the errors the Gemini SDK raises.
+
+    Args:
+        backend(ModelBackend): The backend answering the calls let through.
+        failures(Sequence[int]): HTTP status to fail each of the first
+                                 calls with, 0 to let that call through,
+                                 e.g. [429, 503, 0].
+        failure_rate(float): Share of later calls failed with a 429.
+        retry_after(float | None): Delay 429s ask for in a RetryInfo
+                                   detail, as the Gemini API does.
+        latency(float): Seconds every call waits before answering or
+                        failing.
+        seed(int | None): Seed of the random failures.
+    """
+
+    def __init__(
+                 self,
+                 backend: ModelBackend,
+                 failures: Sequence[int] = (),
+                 failure_rate: float = 0.0,
+                 retry_after: float | None = None,
+                 latency: float = 0.0,
+                 seed: int | None = None
+                 ) -> None:
+        self.backend = backend
+        self.failures = list(failures)
+        self.failure_rate = failure_rate
+        self.retry_after = retry_after
+        self.latency = latency
+        self.calls = 0
+        self.failed = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._random = random.Random(seed)
+
+    def _error(self) -> errors.APIError | None:
+        call = self.calls
+        self.calls += 1
+        if call < len(self.failures):
+            code = self.failures[call]
+        elif self._random.random() < self.failure_rate:
+            code = 429
+        else:
+            code = 0
+        if not code:
+            return None
+        self.failed += 1
+        error: dict[str, Any] = {
+            "code": code,
+            "message": f"injected failure of call {call}",
+            "status": _STATUSES.get(code, "UNKNOWN"),
+        }
+        if code == 429 and self.retry_after is not None:
+            error["details"] = [{
+                "@type": "type.googleapis.com/google.rpc.RetryInfo",
+                "retryDelay": f"{self.retry_after}s",
+            }]
+        if code >= 500:
+            return errors.ServerError(code, {"error": error})
+        return errors.ClientError(code, {"error": error})
+
+    async def generate(
+                       self,
+                       contents: list[types.Content],
+                       config: types.GenerateContentConfig
+                       ) -> types.GenerateContentResponse:
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(self.latency)
+            error = self._error()
+            if error is not None:
+                raise error
+            return await self.backend.generate(contents, config)
+        finally:
+            self.in_flight -= 1
+
+    async def generate_stream(
+                              self,
+                              contents: list[types.Content],
+                              config: types.GenerateContentConfig
+                              ) -> ResponseStream:
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(self.latency)
+            error = self._error()
+            if error is not None:
+                raise error
+            async for chunk in self.backend.generate_stream(contents,
+                                                            config):
+                yield chunk
+        finally:
+            self.in_flight -= 1
+
+
+@dataclasses.dataclass
+class _Cache:
+    contents: list[types.Content]
+    config: types.GenerateContentConfig
+    tokens: int
+    expires_at: float
+
+
+class CachingModel:
+    """
+    Local stand-in for a backend with a context cache, in front of another
+    backend such as a ScriptedModel. It follows the API's rules: caches
+    below `min_tokens` are refused, requests naming a cache may not repeat
+    its system instruction or tools, and expired caches are gone. Answers
+    report the cached part of the prompt as cached_content_token_count.
+
+    Args:
+        backend(ModelBackend): The backend answering the full requests.
+        min_tokens(int): Smallest cache accepted.
+    """
+
+    def __init__(self, backend: ModelBackend, min_tokens: int = 0) -> None:
+        self.backend = backend
+        self.min_tokens = min_tokens
+        self.caches: dict[str, _Cache] = {}
+        self.created = 0
+        self.refreshed = 0
+        # Estimated tokens of the messages sent with every request.
+        self.tokens_sent: list[int] = []
+
+    async def create_cache(
+                           self,
+                           contents: list[types.Content],
+                           config: types.GenerateContentConfig,
+                           ttl: float
+                           ) -> tuple[str, int]:
+        tokens = estimate_tokens(contents) + len(config.model_dump_json(
+            include={"system_instruction", "tools"}, exclude_none=True
+        )) // 4
+        if tokens < self.min_tokens:
+            raise errors.ClientError(400, {"error": {
+                "code": 400,
+                "message": f"Cached content is too small: {tokens} tokens",
+                "status": "INVALID_ARGUMENT",
+            }})
+        self.created += 1
+        name = f"cachedContents/{self.created}"
+        self.caches[name] = _Cache(list(contents),
+                                   config,
+                                   tokens,
+                                   time.monotonic() + ttl)
+        return name, tokens
+
+    def _cache(self, name: str) -> _Cache:
+        cache = self.caches.get(name)
+        if cache is None or cache.expires_at <= time.monotonic():
+            self.caches.pop(name, None)
+            raise errors.ClientError(404, {"error": {
+                "code": 404,
+                "message": f"{name} not found",
+                "status": "NOT_FOUND",
+            }})
+        return cache
+
+    async def refresh_cache(self, name: str, ttl: float) -> None:
+        self._cache(name).expires_at = time.monotonic() + ttl
+        self.refreshed += 1
+
+    def _request(
+                 self,
+                 contents: list[types.Content],
+                 config: types.GenerateContentConfig
+                 ) -> tuple[list[types.Content],
+                            types.GenerateContentConfig,
+                            _Cache | None]:
+        self.tokens_sent.append(estimate_tokens(contents))
+        if config.cached_content is None:
+            return contents, config, None
+        if config.system_instruction is not None or config.tools:
+            raise errors.ClientError(400, {"error": {
+                "code": 400,
+                "message": "CachedContent can not be used with "
+                           "system_instruction or tools set",
+                "status": "INVALID_ARGUMENT",
+            }})
+        cache = self._cache(config.cached_content)
+        return cache.contents + contents, cache.config, cache
+
+    @staticmethod
+    def _with_usage(
+                    response: types.GenerateContentResponse,
+                    cache: _Cache | None
+                    ) -> types.GenerateContentResponse:
+        if cache is None or response.usage_metadata is None:
+            return response
+        usage = response.usage_metadata.model_copy(
+            update={"cached_content_token_count": cache.tokens}
+        )
+        return response.model_copy(update={"usage_metadata": usage})
+
+    async def generate(
+                       self,
+                       contents: list[types.Content],
+                       config: types.GenerateContentConfig
+                       ) -> types.GenerateContentResponse:
+        contents, config, cache = self._request(contents, config)
+        response = await self.backend.generate(contents, config)
+        return self._with_usage(response, cache)
+
+    async def generate_stream(
+                              self,
+                              contents: list[types.Content],
+                              config: types.GenerateContentConfig
+                              ) -> ResponseStream:
+        contents, config, cache = self._request(contents, config)
+        async for chunk in self.backend.generate_stream(contents, config):
+            yield self._with_usage(chunk, cache)
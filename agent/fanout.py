@@ -0,0 +1,336 @@
+"""
+Planner mode: a prompt fanned out over concurrent sub-agents.
+
+The planner asks the model to split the prompt into independent
+subtasks. Every subtask runs as its own agent session, all of them at
+once up to `workers`, each in a snapshot of the working directory
+(agent.workspace), so that they neither see nor overwrite each other's
+half-done work. Once they have all finished, the files every sub-agent
+changed are merged back into the working directory in subtask order.
+Changes to the same file are combined line by line; where they clash, or
+the working directory itself changed the file meanwhile, the later
+subtask's change is left out and reported as a conflict, and its copy of
+the working directory is kept for a look.
+
+A prompt the planner does not split runs as one ordinary session in the
+working directory itself.
+"""
+import asyncio
+import dataclasses
+import os
+import shutil
+import tempfile
+
+from typing import Any
+from typing import TextIO
+
+from google.genai import types
+
+from agent.backends import ModelBackend
+from agent.config import DEFAULT_CONCURRENCY
+from agent.config import planner_prompt
+from agent.config import WORKING_DIRECTORY
+from agent.engine import AgentEngine
+from agent.engine import SessionResult
+from agent.schemas import function_declaration
+from agent.tracing import Tracer
+from agent.workspace import changed_files
+from agent.workspace import merge3
+from agent.workspace import snapshot
+from functions._filepath_helpers import get_sandbox
+from functions._filepath_helpers import write_atomically
+from functions._trigram_index import notify_write
+
+
+def plan_subtasks(subtasks: list[str]) -> None:
+    """
+    Split the task into subtasks that separate agents work on at the same
+    time.
+
+    Args:
+        subtasks(list[str]): Self-contained instructions for each agent.
+    """
+
+
+@dataclasses.dataclass
+class Conflict:
+    """
+    A change of subtask number `subtask` to `path` that was not merged.
+    """
+    path: str
+    subtask: int
+    reason: str
+    # The subtask's copy of the working directory, kept for a look.
+    workspace: str
+
+
+@dataclasses.dataclass
+class FanOutResult:
+    """
+    Outcome of a fanned out prompt. `results[n]` is the session of
+    `subtasks[n]`; `merged` lists the paths changed in the working
+    directory, relative to it.
+    """
+    prompt: str
+    subtasks: list[str]
+    results: list[SessionResult]
+    snapshot: str | None = None
+    merged: list[str] = dataclasses.field(default_factory=list)
+    conflicts: list[Conflict] = dataclasses.field(default_factory=list)
+
+    @property
+    def fanned_out(self) -> bool:
+        # Otherwise the prompt ran as one session in the working directory.
+        return self.snapshot is not None
+
+    def format(self) -> str:
+        lines = []
+        for number, (subtask, result) in enumerate(
+            zip(self.subtasks, self.results), start=1
+        ):
+            lines.append(f"Subtask {number}: {subtask}")
+            lines.append(result.error or result.text or "")
+            lines.append("")
+        lines.append(f"Merged {len(self.merged)} file(s)"
+                     + (f": {', '.join(self.merged)}" if self.merged else ""))
+        for conflict in self.conflicts:
+            lines.append(f"Conflict in {conflict.path}: subtask "
+                         f"{conflict.subtask} {conflict.reason}; its copy is "
+                         f"kept in {conflict.workspace}")
+        return "\n".join(lines)
+
+
+def _merge(
+           base: str,
+           changes: list[dict[str, bytes | None]]
+           ) -> tuple[dict[str, bytes | None],
+                      list[tuple[str, int, str]]]:
+    """
+    Combines the changes every subtask made to the snapshot `base`.
+
+    Returns:
+        tuple: The merged content of every changed path, None where it was
+               removed, and (path, subtask index, reason) of every change
+               that could not be merged.
+    """
+    merged: dict[str, bytes | None] = {}
+    owners: dict[str, list[int]] = {}
+    conflicts = []
+    for index, subtask_changes in enumerate(changes):
+        for path, content in sorted(subtask_changes.items()):
+            if path not in merged:
+                merged[path] = content
+                owners[path] = [index]
+                continue
+            current = merged[path]
+            combined = current if current == content else None
+            if (combined is None and current is not None
+                    and content is not None):
+                try:
+                    with open(os.path.join(base, path), "rb") as f:
+                        text = merge3(f.read().decode(), current.decode(),
+                                      content.decode())
+                except (OSError, UnicodeDecodeError):
+                    # Added by both, or not text.
+                    text = None
+                combined = text.encode() if text is not None else None
+            if combined is None:
+                others = ", ".join(str(i + 1) for i in owners[path])
+                conflicts.append((path, index,
+                                  f"clashes with subtask {others}"))
+                continue
+            merged[path] = combined
+            owners[path].append(index)
+    return merged, conflicts
+
+
+class FanOut:
+    """
+    Runs prompts as concurrent sub-agents over copies of the working
+    directory, sharing one model backend.
+
+    Args:
+        backend(ModelBackend): Model backend of the planner and every
+                               sub-agent.
+        working_directory(str): The directory to work on.
+        workers(int): Maximum number of sub-agents running at once.
+        stdout(TextIO | None): Where to print progress.
+        tracer(Tracer | None): Records the spans of every sub-agent.
+        engine_options(Any): Further AgentEngine arguments, e.g. stream,
+                             used for every sub-agent.
+    """
+
+    def __init__(
+                 self,
+                 backend: ModelBackend,
+                 working_directory: str = WORKING_DIRECTORY,
+                 workers: int = DEFAULT_CONCURRENCY,
+                 stdout: TextIO | None = None,
+                 tracer: Tracer | None = None,
+                 **engine_options: Any
+                 ) -> None:
+        self.backend = backend
+        self.working_directory = os.path.abspath(working_directory)
+        self.workers = max(1, workers)
+        self.stdout = stdout
+        self.tracer = tracer
+        self.engine_options = engine_options
+        self.config = types.GenerateContentConfig(
+            tools=[types.Tool(function_declarations=[
+                function_declaration(plan_subtasks)
+            ])],
+            tool_config=types.ToolConfig(
+                function_calling_config=types.FunctionCallingConfig(
+                    mode=types.FunctionCallingConfigMode.ANY
+                )
+            ),
+            system_instruction=planner_prompt,
+        )
+
+    def _echo(self, msg: str) -> None:
+        if self.stdout is not None:
+            print(msg, file=self.stdout, flush=True)
+
+    def _engine(
+                self,
+                working_directory: str,
+                stdout: TextIO | None = None
+                ) -> AgentEngine:
+        return AgentEngine(self.backend,
+                           working_directory=working_directory,
+                           stdout=stdout,
+                           tracer=self.tracer,
+                           **self.engine_options)
+
+    async def plan(self, prompt: str) -> list[str]:
+        """
+        Asks the model to split `prompt` into independent subtasks.
+
+        Args:
+            prompt(str): The user prompt.
+
+        Returns:
+            list[str]: The subtasks, none if the model did not make a plan.
+        """
+        response = await self.backend.generate(
+            [types.Content(role="user", parts=[types.Part(text=prompt)])],
+            self.config
+        )
+        for call in response.function_calls or []:
+            if call.name == plan_subtasks.__name__ and call.args:
+                subtasks = call.args.get("subtasks") or []
+                return [str(s).strip() for s in subtasks if str(s).strip()]
+        return []
+
+    async def run(self, prompt: str) -> FanOutResult:
+        """
+        Plans `prompt`, runs its subtasks and merges their changes into the
+        working directory.
+
+        Args:
+            prompt(str): The user prompt.
+
+        Returns:
+            FanOutResult: Every subtask's session, the merged paths and the
+                          conflicts.
+        """
+        subtasks = await self.plan(prompt)
+        if len(subtasks) < 2:
+            engine = self._engine(self.working_directory, self.stdout)
+            return FanOutResult(prompt=prompt,
+                                subtasks=[prompt],
+                                results=[await engine.run(prompt)])
+
+        # Next to the working directory, so that reflinks can reach it.
+        root = tempfile.mkdtemp(
+            prefix=f".{os.path.basename(self.working_directory)}-fanout-",
+            dir=os.path.dirname(self.working_directory)
+        )
+        keep: set[str] = set()
+        try:
+            base = os.path.join(root, "base")
+            method = await asyncio.to_thread(snapshot, self.working_directory,
+                                             base)
+            workspaces = [os.path.join(root, str(number))
+                          for number in range(1, len(subtasks) + 1)]
+            for workspace in workspaces:
+                await asyncio.to_thread(snapshot, base, workspace)
+            self._echo(f"Running {len(subtasks)} subtasks in copies of "
+                       f"{self.working_directory} ({method})")
+
+            semaphore = asyncio.Semaphore(self.workers)
+
+            async def run_subtask(number: int) -> SessionResult:
+                async with semaphore:
+                    self._echo(f"Subtask {number}: {subtasks[number - 1]}")
+                    try:
+                        result = await self._engine(
+                            workspaces[number - 1]
+                        ).run(subtasks[number - 1])
+                    except Exception as e:
+                        result = SessionResult(prompt=subtasks[number - 1],
+                                               error=f"Error: {e}")
+                    self._echo(f"Subtask {number} finished")
+                    return result
+
+            results = await asyncio.gather(*(
+                run_subtask(number)
+                for number in range(1, len(subtasks) + 1)
+            ))
+            result = FanOutResult(prompt=prompt,
+                                  subtasks=subtasks,
+                                  results=list(results),
+                                  snapshot=method)
+            keep = await asyncio.to_thread(self._apply, base, workspaces,
+                                           result)
+        finally:
+            for name in os.listdir(root):
+                path = os.path.join(root, name)
+                if path not in keep:
+                    shutil.rmtree(path, ignore_errors=True)
+            if not keep:
+                os.rmdir(root)
+        return result
+
+    def _apply(
+               self,
+               base: str,
+               workspaces: list[str],
+               result: FanOutResult
+               ) -> set[str]:
+        """
+        Merges the changes of every workspace into the working directory,
+        recording them in `result`, and returns the workspaces to keep.
+        """
+        changes = [changed_files(base, workspace)
+                   for workspace in workspaces]
+        merged, conflicts = _merge(base, changes)
+        # Files changed in the working directory while the subtasks ran.
+        meanwhile = changed_files(base, self.working_directory)
+        for path, content in sorted(merged.items()):
+            if path in meanwhile and meanwhile[path] != content:
+                conflicts.extend(
+                    (path, index, "changed a file that changed in the "
+                                  "working directory meanwhile")
+                    for index, subtask_changes in enumerate(changes)
+                    if path in subtask_changes
+                )
+                continue
+            full_path = os.path.join(self.working_directory, path)
+            if content is None:
+                if os.path.lexists(full_path):
+                    os.remove(full_path)
+            else:
+                os.makedirs(os.path.dirname(full_path), exist_ok=True)
+                write_atomically(full_path, content)
+            notify_write(self.working_directory, path)
+            result.merged.append(path)
+        get_sandbox(self.working_directory).invalidate()
+        result.conflicts = [
+            Conflict(path=path,
+                     subtask=index + 1,
+                     reason=reason,
+                     workspace=workspaces[index])
+            for path, index, reason in sorted(conflicts)
+        ]
+        return {conflict.workspace for conflict in result.conflicts}
@@ -0,0 +1,308 @@
+import dataclasses
+import os
+
+from typing import Sequence
+
+from google.genai import types
+
+from agent.dispatcher import READ_ONLY_TOOLS
+
+DEFAULT_TOKEN_BUDGET = 24_000
+# Tool outputs shorter than this are cheaper to keep than to stub out.
+MIN_COMPACT_CHARS = 400
+# How much of a large output survives when it is truncated for the budget.
+TRUNCATED_HEAD_CHARS = 400
+
+
+def estimate_tokens(contents: Sequence[types.Content]) -> int:
+    """
+    Rough token count of `contents`, at about four characters per token.
+    """
+    chars = sum(len(c.model_dump_json(exclude_none=True)) for c in contents)
+    return max(1, chars // 4)
+
+
+@dataclasses.dataclass
+class CompactionReport:
+    """
+    Prompt size before and after one History.compact call.
+    """
+    turn: int
+    tokens_before: int
+    tokens_after: int
+    outputs_stubbed: int = 0
+    outputs_truncated: int = 0
+
+    @property
+    def tokens_saved(self) -> int:
+        return self.tokens_before - self.tokens_after
+
+
+@dataclasses.dataclass
+class _ToolOutput:
+    message: int
+    part: int
+    turn: int
+    key: tuple[str, str]
+    # The part of the path covered, e.g. a line range; empty for all of it.
+    window: str
+    chars: int
+    # Whether this output replaces earlier outputs with the same key and
+    # window, or, for writes, with the same key and any window.
+    supersedes: bool
+    writes: bool
+    # "full", "truncated" or "stubbed"
+    state: str = "full"
+
+
+def _output_key(function_call_part: types.FunctionCall) -> tuple[str, str]:
+    """
+    Returns what a tool output describes. A later output with the same key
+    supersedes it, e.g. a second read of a file or a write to it.
+    """
+    args = function_call_part.args or {}
+    name = function_call_part.name or ""
+    if name in ("get_file_content", "write_file", "edit_file"):
+        return "file", os.path.normpath(str(args.get("file_path", "")))
+    if name == "get_files_info":
+        return "dir", os.path.normpath(str(args.get("directory") or "."))
+    return name, os.path.normpath(str(args.get("file_path", "")))
+
+
+def _output_window(function_call_part: types.FunctionCall) -> str:
+    """
+    Returns the arguments that pick which part of the path an output
+    covers, e.g. a line range of a file or a page of a listing.
+    """
+    args = function_call_part.args or {}
+    return ",".join(f"{arg}={value}" for arg, value in sorted(args.items())
+                    if arg not in ("file_path", "directory", "content",
+                                   "blocks", "diff")
+                    and value is not None)
+
+
+class History:
+    """
+    The conversation sent to the model, kept within a token budget.
+
+    Each tool result is stored once, as the function response part that
+    answers the model's function call. After every turn compact() stubs
+    out large outputs that a later call superseded (an older read of a
+    file that has since been re-read or rewritten, an older run of the
+    same script) and, while the history is still over budget, truncates
+    and then stubs the oldest large outputs. Outputs from the latest turn,
+    which the model has not seen yet, are never touched.
+
+    Args:
+        prompt(str | None): The user prompt starting the conversation, or
+                            None to start empty and add it with add_prompt.
+        token_budget(int): Prompt size, in estimated tokens, to stay under.
+    """
+
+    def __init__(
+                 self,
+                 prompt: str | None,
+                 token_budget: int = DEFAULT_TOKEN_BUDGET
+                 ) -> None:
+        self.token_budget = token_budget
+        self.turn = 0
+        self.messages: list[types.Content] = []
+        self.reports: list[CompactionReport] = []
+        self._tokens: list[int] = []
+        self._outputs: list[_ToolOutput] = []
+        if prompt is not None:
+            self.add_prompt(prompt)
+
+    def _append(self, content: types.Content) -> None:
+        self.messages.append(content)
+        self._tokens.append(estimate_tokens([content]))
+
+    def copy(self) -> "History":
+        """
+        Returns a copy that later changes to this history leave alone, e.g.
+        to roll back to if a turn fails. Messages are shared, as compaction
+        replaces them rather than changing them.
+        """
+        other = History(None, token_budget=self.token_budget)
+        other.turn = self.turn
+        other.messages = list(self.messages)
+        other.reports = list(self.reports)
+        other._tokens = list(self._tokens)
+        other._outputs = [dataclasses.replace(o) for o in self._outputs]
+        return other
+
+    @property
+    def token_count(self) -> int:
+        return sum(self._tokens)
+
+    @property
+    def tokens_saved(self) -> int:
+        return sum(report.tokens_saved for report in self.reports)
+
+    def add_prompt(self, prompt: str) -> None:
+        """
+        Appends a user prompt, e.g. a follow-up continuing the conversation.
+        """
+        self._append(types.Content(role="user",
+                                   parts=[types.Part(text=prompt)]))
+
+    def add_model_content(self, content: types.Content) -> None:
+        """
+        Appends a model response and starts a new turn.
+        """
+        self.turn += 1
+        self._append(content)
+
+    def add_tool_results(
+                         self,
+                         function_calls: Sequence[types.FunctionCall],
+                         results: Sequence[types.Content]
+                         ) -> None:
+        """
+        Appends the results of one turn's function calls as a single
+        message of function responses, in call order.
+
+        Args:
+            function_calls(Sequence[types.FunctionCall]): The calls made.
+            results(Sequence[types.Content]): call_function's result for
+                                              each call.
+        """
+        parts: list[types.Part] = []
+        for function_call_part, result in zip(function_calls, results):
+            for part in result.parts or []:
+                if part.function_response is None:
+                    continue
+                chars = len(str(part.function_response.response))
+                self._outputs.append(_ToolOutput(
+                    message=len(self.messages),
+                    part=len(parts),
+                    turn=self.turn,
+                    key=_output_key(function_call_part),
+                    window=_output_window(function_call_part),
+                    chars=chars,
+                    # A short read, e.g. a cached "unchanged" note, does
+                    # not replace the full output it refers to.
+                    supersedes=(function_call_part.name not in READ_ONLY_TOOLS
+                                or chars >= MIN_COMPACT_CHARS),
+                    writes=function_call_part.name not in READ_ONLY_TOOLS,
+                ))
+                parts.append(part)
+        if parts:
+            self._append(types.Content(role="tool", parts=parts))
+
+    def has_full_output(
+                        self,
+                        turn: int,
+                        function_call_part: types.FunctionCall
+                        ) -> bool:
+        """
+        Tells whether the output of `function_call_part` made on `turn` is
+        still in the conversation uncompacted.
+        """
+        key = _output_key(function_call_part)
+        window = _output_window(function_call_part)
+        return any(
+            o.turn == turn
+            and o.key == key
+            and o.window == window
+            and o.state == "full"
+            for o in self._outputs
+        )
+
+    def _replace_output(
+                        self,
+                        output: _ToolOutput,
+                        text: str,
+                        state: str
+                        ) -> None:
+        content = self.messages[output.message]
+        parts = list(content.parts or [])
+        old = parts[output.part].function_response
+        assert old is not None
+        parts[output.part] = types.Part(
+            function_response=types.FunctionResponse(
+                id=old.id,
+                name=old.name,
+                response={"result": text},
+            )
+        )
+        new_content = types.Content(role=content.role, parts=parts)
+        self.messages[output.message] = new_content
+        self._tokens[output.message] = estimate_tokens([new_content])
+        output.state = state
+
+    def _stub(self, output: _ToolOutput, reason: str) -> None:
+        self._replace_output(
+            output,
+            f"[Output of {output.key[0]} '{output.key[1]}' from turn "
+            f"{output.turn} omitted: {reason}]",
+            "stubbed"
+        )
+
+    def _output_text(self, output: _ToolOutput) -> str:
+        parts = self.messages[output.message].parts or []
+        response = parts[output.part].function_response
+        if response is None or response.response is None:
+            return ""
+        return str(response.response.get("result",
+                                         response.response.get("error", "")))
+
+    def compact(self) -> CompactionReport:
+        """
+        Stubs superseded outputs, then truncates and finally stubs the
+        oldest remaining ones while the history is over budget.
+
+        Returns:
+            CompactionReport: Token counts before and after compaction.
+        """
+        report = CompactionReport(turn=self.turn,
+                                  tokens_before=self.token_count,
+                                  tokens_after=0)
+        candidates = [
+            o for o in self._outputs
+            if o.state != "stubbed"
+            and o.turn < self.turn
+            and o.chars >= MIN_COMPACT_CHARS
+        ]
+
+        latest_turn: dict[tuple[str, str, str], int] = {}
+        latest_write: dict[tuple[str, str], int] = {}
+        for output in self._outputs:
+            if output.supersedes:
+                latest_turn[(*output.key, output.window)] = output.turn
+            if output.writes:
+                latest_write[output.key] = output.turn
+        for output in candidates:
+            superseded_by = max(
+                latest_turn.get((*output.key, output.window), 0),
+                latest_write.get(output.key, 0),
+            )
+            if superseded_by > output.turn:
+                self._stub(output, f"superseded by turn {superseded_by}")
+                report.outputs_stubbed += 1
+
+        for output in candidates:
+            if self.token_count <= self.token_budget:
+                break
+            if output.state != "full":
+                continue
+            text = self._output_text(output)
+            self._replace_output(
+                output,
+                f"{text[:TRUNCATED_HEAD_CHARS]}\n[... {output.key[0]} "
+                f"'{output.key[1]}' from turn {output.turn} truncated, "
+                f"{len(text) - TRUNCATED_HEAD_CHARS} characters omitted]",
+                "truncated"
+            )
+            report.outputs_truncated += 1
+
+        for output in candidates:
+            if self.token_count <= self.token_budget:
+                break
+            if output.state == "truncated":
+                self._stub(output, "over the token budget")
+                report.outputs_stubbed += 1
+
+        report.tokens_after = self.token_count
+        self.reports.append(report)
+        return report
@@ -0,0 +1,290 @@
+"""
+Context caching of the unchanging start of model requests.
+
+Every request of a session repeats the system prompt, the tool
+declarations and the conversation so far, of which only the end is new.
+PrefixCachingBackend registers that stable prefix once with the backend's
+context cache and sends later requests as a reference to it plus the new
+messages, so the prefix is neither uploaded nor billed in full again.
+
+A prefix is cached once it reaches `min_tokens`, the smallest cache the
+API accepts, and cached again whenever the conversation has grown to twice
+its size. Prefixes are matched by content, so one that History compaction
+has since rewritten is simply no longer used, and the system prompt and
+tools are shared by every session with the same configuration. Caches
+live for `ttl` seconds and are extended while they are in use.
+
+Backends without a context cache, e.g. ReplayBackend, and requests whose
+cache cannot be created or has gone are sent in full.
+"""
+import asyncio
+import dataclasses
+import hashlib
+import time
+
+from typing import Protocol
+from typing import runtime_checkable
+
+from google.genai import errors
+from google.genai import types
+
+from agent.backends import ModelBackend
+from agent.backends import ResponseStream
+from agent.config import CACHE_MIN_TOKENS
+from agent.config import CACHE_TTL_SECONDS
+from agent.history import estimate_tokens
+
+# Caches this close to expiring, or a quarter of the TTL if that is less,
+# are not used any more.
+EXPIRY_MARGIN_SECONDS = 5.0
+
+
+@runtime_checkable
+class ContextCache(Protocol):
+    """
+    A backend that can cache the start of a request, like GeminiBackend.
+    """
+
+    async def create_cache(
+                           self,
+                           contents: list[types.Content],
+                           config: types.GenerateContentConfig,
+                           ttl: float
+                           ) -> tuple[str, int]:
+        """
+        Caches `contents` with the system instruction and tools of
+        `config` and returns the cache's name and size in tokens.
+        """
+        ...
+
+    async def refresh_cache(self, name: str, ttl: float) -> None:
+        """
+        Makes the cache `name` live for another `ttl` seconds.
+        """
+        ...
+
+
+@dataclasses.dataclass
+class _Prefix:
+    name: str
+    # Digest of the configuration and of the first `depth` messages.
+    digest: str
+    depth: int
+    tokens: int
+    expires_at: float
+    refreshing: bool = False
+
+
+def _chain(config_digest: str, contents: list[types.Content]) -> list[str]:
+    """
+    Returns the digest of the configuration followed by the digest of
+    every prefix of `contents`, so digests[n] covers the first n messages.
+    """
+    digests = [config_digest]
+    for content in contents:
+        digest = hashlib.sha256(digests[-1].encode())
+        digest.update(content.model_dump_json(exclude_none=True).encode())
+        digests.append(digest.hexdigest())
+    return digests
+
+
+class PrefixCachingBackend:
+    """
+    Forwards requests to another backend, sending their stable prefix as a
+    reference to a context cache where possible.
+
+    Args:
+        backend(ModelBackend): The backend to forward requests to; caching
+                               is only used if it is a ContextCache.
+        ttl(float): Seconds a cache lives after it was last extended.
+        min_tokens(int): Smallest prefix worth caching.
+    """
+
+    def __init__(
+                 self,
+                 backend: ModelBackend,
+                 ttl: float = CACHE_TTL_SECONDS,
+                 min_tokens: int = CACHE_MIN_TOKENS
+                 ) -> None:
+        self.backend = backend
+        self.ttl = ttl
+        self.min_tokens = min_tokens
+        self.enabled = isinstance(backend, ContextCache)
+        self.created = 0
+        self.refreshed = 0
+        self.hits = 0
+        self.fallbacks = 0
+        # Only changed between awaits, so sessions on the event loop see
+        # them consistently without a lock.
+        self._prefixes: list[_Prefix] = []
+        # Caches being created, by digest, for concurrent requests with the
+        # same prefix to wait for instead of creating their own.
+        self._creating: dict[str, asyncio.Task[_Prefix | None]] = {}
+        self._configs: dict[int, tuple[types.GenerateContentConfig,
+                                       str, int]] = {}
+
+    def _config_key(
+                    self,
+                    config: types.GenerateContentConfig
+                    ) -> tuple[str, int]:
+        # Engines reuse one config for every request.
+        known = self._configs.get(id(config))
+        if known is None or known[0] is not config:
+            dump = config.model_dump_json(
+                include={"system_instruction", "tools", "tool_config"},
+                exclude_none=True,
+            )
+            known = (config, hashlib.sha256(dump.encode()).hexdigest(),
+                     len(dump) // 4)
+            self._configs[id(config)] = known
+        return known[1], known[2]
+
+    def _best(self, digests: list[str]) -> _Prefix | None:
+        now = time.monotonic()
+        margin = min(EXPIRY_MARGIN_SECONDS, self.ttl / 4)
+        self._prefixes = [p for p in self._prefixes
+                          if p.expires_at - margin > now]
+        # A request must still send at least one message of its own.
+        matches = [p for p in self._prefixes
+                   if p.depth < len(digests) - 1
+                   and digests[p.depth] == p.digest]
+        return max(matches, key=lambda p: p.depth, default=None)
+
+    async def _prefix(
+                      self,
+                      contents: list[types.Content],
+                      config: types.GenerateContentConfig
+                      ) -> _Prefix | None:
+        """
+        Returns the cache to send `contents` against, creating or
+        extending one if needed, or None to send them in full.
+        """
+        if not self.enabled or not contents:
+            return None
+        config_digest, config_tokens = self._config_key(config)
+        digests = _chain(config_digest, contents)
+        best = self._best(digests)
+        depth = len(contents) - 1
+        tokens = config_tokens + estimate_tokens(contents[:depth])
+        if tokens >= self.min_tokens and (
+            best is None or tokens >= 2 * best.tokens
+        ):
+            creating = self._creating.get(digests[depth])
+            if creating is None:
+                creating = asyncio.ensure_future(
+                    self._create(contents[:depth], config, digests[depth])
+                )
+                self._creating[digests[depth]] = creating
+            # A cancelled request must not cancel the others' cache.
+            best = await asyncio.shield(creating) or best
+        if best is not None and not best.refreshing and (
+            best.expires_at - time.monotonic() < self.ttl / 2
+        ):
+            # Others keep using the cache while one request extends it.
+            best.refreshing = True
+            try:
+                await self._refresh(best)
+            finally:
+                best.refreshing = False
+        return best
+
+    async def _create(
+                      self,
+                      contents: list[types.Content],
+                      config: types.GenerateContentConfig,
+                      digest: str
+                      ) -> _Prefix | None:
+        assert isinstance(self.backend, ContextCache)
+        try:
+            name, tokens = await self.backend.create_cache(contents, config,
+                                                           self.ttl)
+        except errors.APIError as e:
+            if e.code == 400:
+                # Most likely under the model's minimum; ask for more.
+                self.min_tokens *= 2
+            elif e.code in (403, 404):
+                self.enabled = False
+            return None
+        finally:
+            del self._creating[digest]
+        self.created += 1
+        prefix = _Prefix(name=name,
+                         digest=digest,
+                         depth=len(contents),
+                         tokens=tokens,
+                         expires_at=time.monotonic() + self.ttl)
+        self._prefixes.append(prefix)
+        return prefix
+
+    async def _refresh(self, prefix: _Prefix) -> None:
+        assert isinstance(self.backend, ContextCache)
+        try:
+            await self.backend.refresh_cache(prefix.name, self.ttl)
+        except errors.APIError:
+            return
+        prefix.expires_at = time.monotonic() + self.ttl
+        self.refreshed += 1
+
+    def _forget(self, prefix: _Prefix) -> None:
+        if prefix in self._prefixes:
+            self._prefixes.remove(prefix)
+        self.fallbacks += 1
+
+    @staticmethod
+    def _cached_config(
+                       config: types.GenerateContentConfig,
+                       prefix: _Prefix
+                       ) -> types.GenerateContentConfig:
+        # The API rejects requests that repeat what the cache holds.
+        return config.model_copy(update={"cached_content": prefix.name,
+                                         "system_instruction": None,
+                                         "tools": None,
+                                         "tool_config": None})
+
+    async def generate(
+                       self,
+                       contents: list[types.Content],
+                       config: types.GenerateContentConfig
+                       ) -> types.GenerateContentResponse:
+        prefix = await self._prefix(contents, config)
+        if prefix is not None:
+            try:
+                response = await self.backend.generate(
+                    contents[prefix.depth:],
+                    self._cached_config(config, prefix)
+                )
+            except errors.APIError as e:
+                if e.code not in (400, 403, 404):
+                    raise
+                # The cache expired early or was deleted.
+                self._forget(prefix)
+            else:
+                self.hits += 1
+                return response
+        return await self.backend.generate(contents, config)
+
+    async def generate_stream(
+                              self,
+                              contents: list[types.Content],
+                              config: types.GenerateContentConfig
+                              ) -> ResponseStream:
+        prefix = await self._prefix(contents, config)
+        if prefix is not None:
+            started = False
+            try:
+                stream = self.backend.generate_stream(
+                    contents[prefix.depth:],
+                    self._cached_config(config, prefix)
+                )
+                async for chunk in stream:
+                    started = True
+                    yield chunk
+            except errors.APIError as e:
+                if started or e.code not in (400, 403, 404):
+                    raise
+                self._forget(prefix)
+            else:
+                self.hits += 1
+                return
+        async for chunk in self.backend.generate_stream(contents, config):
+            yield chunk
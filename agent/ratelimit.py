@@ -0,0 +1,325 @@
+"""
+Retries and client-side rate limiting for model calls.
+
+RetryingBackend wraps another backend, usually the shared GeminiBackend,
+so that every session of a process goes through one set of limits:
+
+- transient failures (429, 5xx, timeouts, dropped connections) are retried
+  with full-jitter exponential backoff, or after the delay the server asks
+  for in a Retry-After header or a RetryInfo detail;
+- a throttled call pauses every other call until its delay is over, so
+  concurrent sessions do not keep hammering an exhausted quota;
+- optional token buckets keep requests and tokens per minute under quota;
+- the number of calls in flight shrinks by half on every throttled or
+  failed call and grows back by one per `limit` successes (AIMD).
+"""
+import asyncio
+import dataclasses
+import email.utils
+import random
+import re
+import time
+
+from typing import Any
+
+import httpx
+from google.genai import errors
+from google.genai import types
+
+from agent.backends import ModelBackend
+from agent.backends import ResponseStream
+from agent.config import MAX_RETRIES
+from agent.history import estimate_tokens
+
+RETRYABLE_STATUS_CODES = frozenset({408, 429, 500, 502, 503, 504})
+# Statuses that mean the quota or the service is overloaded.
+THROTTLE_STATUS_CODES = frozenset({429, 503})
+
+
+@dataclasses.dataclass
+class RetryPolicy:
+    """
+    How often and how long to wait before retrying a failed call. The
+    n-th retry waits a random time up to base_delay * 2**n, capped at
+    max_delay, unless the server says how long to wait.
+    """
+    max_retries: int = MAX_RETRIES
+    base_delay: float = 1.0
+    max_delay: float = 60.0
+
+    def delay(self, retry: int, retry_after: float | None = None) -> float:
+        if retry_after is not None:
+            return min(retry_after, self.max_delay)
+        return random.uniform(0, min(self.max_delay,
+                                     self.base_delay * 2 ** retry))
+
+
+def _header_retry_after(response: Any) -> float | None:
+    headers = getattr(response, "headers", None)
+    value = headers.get("retry-after") if headers is not None else None
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, when.timestamp() - time.time())
+
+
+def _detail_retry_after(details: Any) -> float | None:
+    # e.g. {"error": {"details": [{"@type": "...RetryInfo",
+    #                              "retryDelay": "37s"}]}}
+    error = details.get("error", details) if isinstance(details, dict) else {}
+    for detail in error.get("details", []) if isinstance(error, dict) else []:
+        if not isinstance(detail, dict):
+            continue
+        match = re.fullmatch(r"([\d.]+)s", str(detail.get("retryDelay", "")))
+        if match:
+            return float(match.group(1))
+    return None
+
+
+def classify(error: BaseException) -> tuple[bool, bool, float | None]:
+    """
+    Tells whether a failed call is worth retrying.
+
+    Returns:
+        tuple[bool, bool, float | None]: Whether to retry, whether the
+                                         server was throttling and the
+                                         delay the server asked for.
+    """
+    if isinstance(error, errors.APIError):
+        if error.code not in RETRYABLE_STATUS_CODES:
+            return False, False, None
+        retry_after = _header_retry_after(error.response)
+        if retry_after is None:
+            retry_after = _detail_retry_after(error.details)
+        return True, error.code in THROTTLE_STATUS_CODES, retry_after
+    if isinstance(error, (httpx.TransportError, ConnectionError,
+                          TimeoutError)):
+        return True, False, None
+    return False, False, None
+
+
+class TokenBucket:
+    """
+    Allows `per_minute` units a minute, e.g. requests or tokens, in bursts
+    of up to `burst` units (a whole minute's worth if not given). Waiting
+    callers are served in order.
+    """
+
+    def __init__(self, per_minute: float, burst: float | None = None) -> None:
+        self.rate = per_minute / 60
+        self.capacity = burst if burst is not None else per_minute
+        self.tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity,
+                          self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self, amount: float = 1) -> None:
+        amount = min(amount, self.capacity)
+        async with self._lock:
+            self._refill()
+            while self.tokens < amount:
+                await asyncio.sleep((amount - self.tokens) / self.rate)
+                self._refill()
+            self.tokens -= amount
+
+    def adjust(self, amount: float) -> None:
+        """
+        Takes `amount` more units, or gives them back if negative, once the
+        real cost of a call is known. The bucket may go into debt.
+        """
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens - amount)
+
+
+class AdaptiveConcurrency:
+    """
+    Limits the number of calls in flight to `limit`, which halves on every
+    overloaded call and grows by one after `limit` successful ones, between
+    1 and `max_limit`.
+    """
+
+    def __init__(self, max_limit: int) -> None:
+        self.max_limit = max(1, max_limit)
+        self.limit = self.max_limit
+        self.in_flight = 0
+        self._successes = 0
+        self._condition = asyncio.Condition()
+
+    async def acquire(self) -> None:
+        async with self._condition:
+            await self._condition.wait_for(
+                lambda: self.in_flight < self.limit
+            )
+            self.in_flight += 1
+
+    async def release(self, success: bool | None) -> None:
+        """
+        Frees a slot. `success` is None for failures that say nothing about
+        load, e.g. a bad request.
+        """
+        async with self._condition:
+            self.in_flight -= 1
+            if success:
+                self._successes += 1
+                if self._successes >= self.limit:
+                    self.limit = min(self.max_limit, self.limit + 1)
+                    self._successes = 0
+            elif success is not None:
+                self.limit = max(1, self.limit // 2)
+                self._successes = 0
+            self._condition.notify_all()
+
+
+class RetryingBackend:
+    """
+    Forwards requests to another backend, retrying transient failures and
+    keeping every call made through it within the given limits.
+
+    Args:
+        backend(ModelBackend): The backend to forward requests to.
+        policy(RetryPolicy | None): When to retry; the defaults if not
+                                    given.
+        requests_per_minute(float | None): Request quota, unlimited if not
+                                           given.
+        tokens_per_minute(float | None): Prompt plus response token quota,
+                                         unlimited if not given.
+        max_concurrency(int): Most calls in flight when nothing fails.
+    """
+
+    def __init__(
+                 self,
+                 backend: ModelBackend,
+                 policy: RetryPolicy | None = None,
+                 requests_per_minute: float | None = None,
+                 tokens_per_minute: float | None = None,
+                 max_concurrency: int = 8
+                 ) -> None:
+        self.backend = backend
+        self.policy = policy or RetryPolicy()
+        self.requests = (TokenBucket(requests_per_minute)
+                         if requests_per_minute else None)
+        self.tokens = (TokenBucket(tokens_per_minute)
+                       if tokens_per_minute else None)
+        self.concurrency = AdaptiveConcurrency(max_concurrency)
+        self.retries = 0
+        self.throttled = 0
+        self._resume_at = 0.0
+
+    async def _acquire(self, estimate: int) -> None:
+        while (pause := self._resume_at - time.monotonic()) > 0:
+            await asyncio.sleep(pause)
+        await self.concurrency.acquire()
+        try:
+            if self.requests is not None:
+                await self.requests.acquire()
+            if self.tokens is not None:
+                await self.tokens.acquire(estimate)
+        except BaseException:
+            await self.concurrency.release(None)
+            raise
+
+    def _settle(
+                self,
+                estimate: int,
+                usage: types.GenerateContentResponseUsageMetadata | None
+                ) -> None:
+        if self.tokens is None or usage is None:
+            return
+        used = ((usage.prompt_token_count or 0)
+                + (usage.candidates_token_count or 0))
+        self.tokens.adjust(used - estimate)
+
+    def _backoff(self, error: Exception, retry: int) -> float | None:
+        """
+        Returns how long to wait before retrying after `error`, or None if
+        it should be raised.
+        """
+        retryable, throttled, retry_after = classify(error)
+        if not retryable or retry >= self.policy.max_retries:
+            return None
+        delay = self.policy.delay(retry, retry_after)
+        self.retries += 1
+        if throttled:
+            self.throttled += 1
+            self._resume_at = max(self._resume_at, time.monotonic() + delay)
+        return delay
+
+    async def generate(
+                       self,
+                       contents: list[types.Content],
+                       config: types.GenerateContentConfig
+                       ) -> types.GenerateContentResponse:
+        estimate = estimate_tokens(contents)
+        retry = 0
+        while True:
+            await self._acquire(estimate)
+            try:
+                response = await self.backend.generate(contents, config)
+            except Exception as e:
+                delay = self._backoff(e, retry)
+                await self.concurrency.release(
+                    False if classify(e)[0] else None
+                )
+                if delay is None:
+                    raise
+                retry += 1
+                await asyncio.sleep(delay)
+                continue
+            except BaseException:
+                await self.concurrency.release(None)
+                raise
+            await self.concurrency.release(True)
+            self._settle(estimate, response.usage_metadata)
+            return response
+
+    async def generate_stream(
+                              self,
+                              contents: list[types.Content],
+                              config: types.GenerateContentConfig
+                              ) -> ResponseStream:
+        """
+        Retries a stream that fails before its first chunk. Once chunks
+        have been passed on a failure is raised, as they cannot be taken
+        back.
+        """
+        estimate = estimate_tokens(contents)
+        retry = 0
+        while True:
+            await self._acquire(estimate)
+            success: bool | None = None
+            delay = 0.0
+            usage = None
+            started = False
+            try:
+                stream = self.backend.generate_stream(contents, config)
+                async for chunk in stream:
+                    started = True
+                    usage = chunk.usage_metadata or usage
+                    yield chunk
+                success = True
+            except Exception as e:
+                if classify(e)[0]:
+                    success = False
+                backoff = None if started else self._backoff(e, retry)
+                if backoff is None:
+                    raise
+                delay = backoff
+            finally:
+                await self.concurrency.release(success)
+            if success:
+                self._settle(estimate, usage)
+                return
+            retry += 1
+            await asyncio.sleep(delay)
@@ -0,0 +1,115 @@
+import inspect
+import re
+import types as pytypes
+import typing
+
+from typing import Any
+from typing import Callable
+
+from google.genai import types
+
+# Arguments the agent injects itself and the model must never see.
+INJECTED_ARGS = frozenset({"working_directory"})
+
+_SCHEMA_TYPES: dict[Any, types.Type] = {
+    str: types.Type.STRING,
+    int: types.Type.INTEGER,
+    float: types.Type.NUMBER,
+    bool: types.Type.BOOLEAN,
+}
+
+_ARG_LINE = re.compile(r"^\s*(\w+)\s*\([^)]*\)\s*:\s*(.*)$")
+_SECTION = re.compile(r"^\s*(Args|Returns|Raises|Example|Examples):\s*$")
+
+
+def _docstring_parts(func: Callable[..., Any]) -> tuple[str, dict[str, str]]:
+    """
+    Splits a Google style docstring into its summary paragraph and the
+    description of every argument in its Args section.
+    """
+    doc = inspect.getdoc(func) or ""
+    summary_lines: list[str] = []
+    args: dict[str, str] = {}
+    section = None
+    current = None
+    for line in doc.splitlines():
+        header = _SECTION.match(line)
+        if header:
+            section = header.group(1)
+            current = None
+            continue
+        if section is None:
+            if not line.strip() and summary_lines:
+                section = "Description"
+            elif line.strip():
+                summary_lines.append(line.strip())
+        elif section == "Args":
+            match = _ARG_LINE.match(line)
+            if match:
+                current = match.group(1)
+                args[current] = match.group(2).strip()
+            elif current is not None and line.strip():
+                args[current] += " " + line.strip()
+            else:
+                current = None
+    return " ".join(summary_lines), args
+
+
+def _schema(annotation: Any, description: str | None = None) -> types.Schema:
+    if isinstance(annotation, pytypes.UnionType) or (
+        typing.get_origin(annotation) is typing.Union
+    ):
+        members = [a for a in typing.get_args(annotation)
+                   if a is not type(None)]
+        if len(members) != 1:
+            raise TypeError(f"Unsupported union type: {annotation}")
+        annotation = members[0]
+
+    if typing.get_origin(annotation) is list:
+        (item,) = typing.get_args(annotation) or (str,)
+        return types.Schema(type=types.Type.ARRAY,
+                            description=description,
+                            items=_schema(item))
+    if annotation not in _SCHEMA_TYPES:
+        raise TypeError(f"Unsupported argument type: {annotation}")
+    return types.Schema(type=_SCHEMA_TYPES[annotation],
+                        description=description)
+
+
+def function_declaration(
+                         func: Callable[..., Any],
+                         name: str | None = None
+                         ) -> types.FunctionDeclaration:
+    """
+    Builds the declaration the model sees for a tool from its signature
+    and docstring.
+
+    The summary paragraph of the docstring becomes the tool description and
+    the Args section describes each parameter. Parameters without a default
+    are required; injected ones such as working_directory are left out.
+
+    Args:
+        func(Callable): A tool function from functions/.
+        name(str | None): Tool name, defaults to the function's name.
+
+    Returns:
+        types.FunctionDeclaration: The generated declaration.
+    """
+    summary, arg_docs = _docstring_parts(func)
+    hints = typing.get_type_hints(func)
+    properties = {}
+    required = []
+    for param in inspect.signature(func).parameters.values():
+        if param.name in INJECTED_ARGS:
+            continue
+        properties[param.name] = _schema(hints.get(param.name, str),
+                                         arg_docs.get(param.name))
+        if param.default is inspect.Parameter.empty:
+            required.append(param.name)
+    return types.FunctionDeclaration(
+        name=name or func.__name__,
+        description=summary,
+        parameters=types.Schema(type=types.Type.OBJECT,
+                                properties=properties,
+                                required=required),
+    )
@@ -0,0 +1,268 @@
+"""
+Crash-safe log of agent sessions, for resuming them.
+
+A session's prompt, every model response and every tool result are
+appended to a JSONL file as soon as they exist, one record per line:
+
+    {"type": "start", "prompt": "...", "working_directory": "..."}
+    {"type": "model", "turn": 1, "contents": [...], "prompt_tokens": 312,
+     "response_tokens": 24}
+    {"type": "tool", "turn": 1, "call": {"name": ..., "args": ...},
+     "result": {...}}
+    {"type": "final", "text": "..."}
+
+Each line is flushed to the OS as it is written, so it survives the
+process dying; fsync, which also covers the machine going down, runs at
+most every `fsync_interval` seconds and when the log is closed. A last
+line torn by a crash is ignored when the log is loaded.
+"""
+import dataclasses
+import json
+import os
+import secrets
+import threading
+import time
+
+from typing import Any
+from typing import Callable
+
+from google.genai import types
+
+from agent.config import FSYNC_INTERVAL_SECONDS
+from agent.config import SESSION_LOG_DIRECTORY
+
+
+def new_session_path(directory: str = SESSION_LOG_DIRECTORY) -> str:
+    """
+    Returns the path of a new log in `directory`, named after the time.
+    """
+    session_id = (time.strftime("%Y%m%d-%H%M%S")
+                  + f"-{secrets.token_hex(2)}")
+    return os.path.join(directory, f"{session_id}.jsonl")
+
+
+def find_session(
+                 session: str,
+                 directory: str = SESSION_LOG_DIRECTORY
+                 ) -> str | None:
+    """
+    Finds the log of `session`: a path, a session id from `directory` or
+    'last' for the most recently written log there.
+    """
+    if os.path.isfile(session):
+        return session
+    if session == "last":
+        try:
+            logs = [entry for entry in os.scandir(directory)
+                    if entry.name.endswith(".jsonl")]
+        except FileNotFoundError:
+            return None
+        if not logs:
+            return None
+        return max(logs, key=lambda e: e.stat().st_mtime).path
+    path = os.path.join(directory, f"{session}.jsonl")
+    return path if os.path.isfile(path) else None
+
+
+def call_key(function_call_part: types.FunctionCall) -> str:
+    return json.dumps([function_call_part.name, function_call_part.args],
+                      sort_keys=True, default=str)
+
+
+def _drop_torn_line(path: str) -> None:
+    """
+    Cuts a last line that a crash left unfinished off the log at `path`,
+    so that appending to it starts on a line of its own.
+    """
+    try:
+        f = open(path, "rb+")
+    except FileNotFoundError:
+        return
+    with f:
+        end = f.seek(0, os.SEEK_END)
+        position = end
+        while position > 0:
+            start = max(0, position - 4096)
+            f.seek(start)
+            chunk = f.read(position - start)
+            newline = chunk.rfind(b"\n")
+            if newline != -1:
+                position = start + newline + 1
+                break
+            position = start
+        if position != end:
+            f.truncate(position)
+
+
+class SessionLog:
+    """
+    Appends the records of one session to `path`, from any thread.
+
+    Args:
+        path(str): JSONL file to append to; created with its directory.
+        fsync_interval(float): Most seconds between two fsyncs.
+    """
+
+    def __init__(
+                 self,
+                 path: str,
+                 fsync_interval: float = FSYNC_INTERVAL_SECONDS
+                 ) -> None:
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.fsync_interval = fsync_interval
+        _drop_torn_line(path)
+        self._file = open(path, "a", encoding="utf-8")
+        self._lock = threading.Lock()
+        self._synced = time.monotonic()
+
+    def _append(self, record: dict[str, Any]) -> None:
+        line = json.dumps(record, separators=(",", ":")) + "\n"
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+            now = time.monotonic()
+            if now - self._synced >= self.fsync_interval:
+                os.fsync(self._file.fileno())
+                self._synced = now
+
+    def start(self, prompt: str, working_directory: str) -> None:
+        self._append({"type": "start",
+                      "prompt": prompt,
+                      "working_directory": working_directory})
+
+    def model(
+              self,
+              turn: int,
+              response: types.GenerateContentResponse
+              ) -> None:
+        meta = response.usage_metadata
+        self._append({
+            "type": "model",
+            "turn": turn,
+            "contents": [
+                c.content.model_dump(mode="json", exclude_none=True)
+                for c in response.candidates or []
+                if c.content is not None
+            ],
+            "prompt_tokens": meta.prompt_token_count or 0 if meta else 0,
+            "response_tokens": (meta.candidates_token_count or 0
+                                if meta else 0),
+        })
+
+    def tool(
+             self,
+             turn: int,
+             function_call_part: types.FunctionCall,
+             result: types.Content
+             ) -> None:
+        self._append({
+            "type": "tool",
+            "turn": turn,
+            "call": {"name": function_call_part.name,
+                     "args": function_call_part.args},
+            "result": result.model_dump(mode="json", exclude_none=True),
+        })
+
+    def final(self, text: str) -> None:
+        self._append({"type": "final", "text": text})
+
+    def close(self) -> None:
+        with self._lock:
+            if self._file.closed:
+                return
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+
+
+@dataclasses.dataclass
+class SavedResponse:
+    turn: int
+    contents: list[types.Content]
+    prompt_tokens: int = 0
+    response_tokens: int = 0
+
+
+@dataclasses.dataclass
+class SavedSession:
+    """
+    What a session log holds. `tool_results` maps a turn and call_key to
+    the results of those calls, in the order they finished.
+    """
+    path: str
+    prompt: str
+    working_directory: str
+    responses: list[SavedResponse] = dataclasses.field(default_factory=list)
+    tool_results: dict[tuple[int, str], list[types.Content]] = (
+        dataclasses.field(default_factory=dict)
+    )
+    final: str | None = None
+
+
+def load_session(path: str) -> SavedSession:
+    """
+    Reads the log at `path`, skipping a last line torn by a crash.
+
+    Raises:
+        ValueError: If the log does not start a session.
+    """
+    saved = None
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # Only the last line can be torn; nothing follows it.
+                break
+            kind = record.get("type")
+            if saved is None:
+                if kind != "start":
+                    break
+                saved = SavedSession(path=path,
+                                     prompt=record["prompt"],
+                                     working_directory=record[
+                                         "working_directory"
+                                     ])
+            elif kind == "model":
+                saved.responses.append(SavedResponse(
+                    turn=record["turn"],
+                    contents=[types.Content.model_validate(c)
+                              for c in record["contents"]],
+                    prompt_tokens=record.get("prompt_tokens", 0),
+                    response_tokens=record.get("response_tokens", 0),
+                ))
+            elif kind == "tool":
+                call = types.FunctionCall(**record["call"])
+                saved.tool_results.setdefault(
+                    (record["turn"], call_key(call)), []
+                ).append(types.Content.model_validate(record["result"]))
+            elif kind == "final":
+                saved.final = record["text"]
+    if saved is None:
+        raise ValueError(f"'{path}' is not a session log")
+    return saved
+
+
+def checkpointed(
+                 call: Callable[[types.FunctionCall], types.Content],
+                 turn: int,
+                 log: SessionLog | None,
+                 finished: dict[tuple[int, str], list[types.Content]]
+                 ) -> Callable[[types.FunctionCall], types.Content]:
+    """
+    Wraps a tool call of `turn` so that calls `finished` before a crash
+    return their logged result instead of running again, and every other
+    call's result is appended to `log`.
+    """
+    def run(function_call_part: types.FunctionCall) -> types.Content:
+        done = finished.get((turn, call_key(function_call_part)))
+        if done:
+            return done.pop(0)
+        result = call(function_call_part)
+        if log is not None:
+            log.tool(turn, function_call_part, result)
+        return result
+    return run
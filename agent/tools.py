@@ -0,0 +1,93 @@
+import functools
+
+from typing import Callable
+
+from google.genai import types
+
+from agent.config import WORKING_DIRECTORY
+from agent.schemas import function_declaration
+from functions.get_files_info import get_files_info
+from functions.get_file_content import get_file_content
+from functions.write_file import write_file
+from functions.edit_file import edit_file
+from functions.run_python_file import run_python_file
+from functions.search_code import search_code
+
+
+functions: dict[str, Callable[..., str]] = {
+    "get_files_info": get_files_info,
+    "get_file_content": get_file_content,
+    "write_file": write_file,
+    "edit_file": edit_file,
+    "run_python_file": run_python_file,
+    "search_code": search_code,
+}
+
+
+def call_function(
+                  function_call_part: types.FunctionCall,
+                  working_directory: str = WORKING_DIRECTORY
+                  ) -> types.Content:
+
+    if function_call_part.name is None:
+        return types.Content(
+                            role="tool",
+                            parts=[
+                                types.Part.from_function_response(
+                                    name="None",
+                                    response={"result": "Error: no func name"},
+                                )
+                            ],
+                        )
+
+    if function_call_part.args is None:
+        return types.Content(
+                            role="tool",
+                            parts=[
+                                types.Part.from_function_response(
+                                    name=function_call_part.name,
+                                    response={"result": "Error: no func args"},
+                                )
+                            ],
+                        )
+
+    # Injected last, so that the model cannot point a tool elsewhere.
+    args = function_call_part.args | {"working_directory": working_directory}
+    try:
+        res = functions[function_call_part.name](**args)
+        return types.Content(
+                            role="tool",
+                            parts=[
+                                types.Part.from_function_response(
+                                    name=function_call_part.name,
+                                    response={"result": res},
+                                )
+                            ],
+                        )
+    except KeyError:
+        return types.Content(
+                            role="tool",
+                            parts=[
+                                types.Part.from_function_response(
+                                    name=function_call_part.name,
+                                    response={"error":
+                                              "Unknown function: "
+                                              f"{function_call_part.name}"},
+                                )
+                            ],
+                        )
+
+
+@functools.cache
+def available_functions() -> types.Tool:
+    """
+    Returns the tool declarations for every function in `functions`,
+    generated from their signatures and docstrings on the first call and
+    reused afterwards.
+    """
+    return types.Tool(
+        function_declarations=[
+            function_declaration(func, name)
+            for name, func in functions.items()
+        ]
+    )
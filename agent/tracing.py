@@ -0,0 +1,330 @@
+"""
+Structured tracing of agent sessions.
+
+A Tracer records a span for every session, model call, tool call and
+child process run, with its duration, token usage, payload sizes, cache
+hits and errors. Spans are exported as JSON lines or as Chrome trace
+events (load the file in chrome://tracing or Perfetto), and summarised
+into token totals, tool latency percentiles and iteration counts.
+"""
+import contextlib
+import dataclasses
+import json
+import math
+import threading
+import time
+
+from typing import Any
+from typing import Callable
+from typing import Iterator
+from typing import TextIO
+
+from google.genai import types
+
+from functions import _process
+
+FORMATS = ("jsonl", "chrome")
+
+
+@dataclasses.dataclass
+class Span:
+    """
+    One timed operation. `start` is in seconds since the tracer was
+    created; `attrs` holds whatever the operation reports, e.g. tokens.
+    """
+    name: str
+    category: str
+    session: int | None = None
+    iteration: int | None = None
+    start: float = 0.0
+    duration: float = 0.0
+    thread: int = 0
+    error: str | None = None
+    attrs: dict[str, Any] = dataclasses.field(default_factory=dict)
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            "name": self.name,
+            "cat": self.category,
+            "session": self.session,
+            "iteration": self.iteration,
+            "start": round(self.start, 6),
+            "duration": round(self.duration, 6),
+            "error": self.error,
+            **self.attrs,
+        }
+
+
+def _percentile(values: list[float], fraction: float) -> float:
+    # Nearest rank, so the result is always one of the measured values.
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+
+@dataclasses.dataclass
+class TraceSummary:
+    """
+    Totals over every span of a Tracer. Latencies are in seconds.
+    """
+    sessions: int = 0
+    iterations: int = 0
+    model_calls: int = 0
+    prompt_tokens: int = 0
+    response_tokens: int = 0
+    cached_tokens: int = 0
+    tool_calls: int = 0
+    cache_hits: int = 0
+    process_runs: int = 0
+    errors: int = 0
+    model_seconds: float = 0.0
+    tool_p50: float = 0.0
+    tool_p95: float = 0.0
+
+    def format(self) -> str:
+        return (f"Trace: {self.sessions} session(s), {self.iterations} "
+                f"iteration(s), {self.model_calls} model call(s) in "
+                f"{self.model_seconds:.2f}s, {self.prompt_tokens} prompt + "
+                f"{self.response_tokens} response tokens "
+                f"({self.cached_tokens} prompt tokens cached)\n"
+                f"       {self.tool_calls} tool call(s), {self.cache_hits} "
+                f"from cache, {self.process_runs} process run(s), tool "
+                f"latency p50 {self.tool_p50 * 1000:.1f} ms, p95 "
+                f"{self.tool_p95 * 1000:.1f} ms, {self.errors} error(s)")
+
+
+# The tool span each thread is running, so that the process runs it makes
+# and whether it ran at all can be attributed to it.
+_local = threading.local()
+
+
+def _on_process(cmd: list[str], result: _process.ProcessResult) -> None:
+    current: tuple[Tracer, Span] | None = getattr(_local, "tool", None)
+    if current is None:
+        return
+    tracer, tool = current
+    end = tracer.now()
+    tracer.add(Span(
+        name=" ".join(cmd[:2]),
+        category="process",
+        session=tool.session,
+        iteration=tool.iteration,
+        start=max(tool.start, end - result.elapsed),
+        duration=result.elapsed,
+        thread=threading.get_ident(),
+        error=("timed out" if result.timed_out
+               else f"exit status {result.returncode}"
+               if result.returncode else None),
+        attrs={
+            "returncode": result.returncode,
+            "peak_rss": result.peak_rss,
+            "stdout_bytes": len(result.stdout),
+            "stderr_bytes": len(result.stderr),
+        },
+    ))
+
+
+_process.add_observer(_on_process)
+
+
+def _response_error(content: types.Content) -> str | None:
+    for part in content.parts or []:
+        response = part.function_response
+        if response is None or response.response is None:
+            continue
+        if "error" in response.response:
+            return str(response.response["error"])
+        result = response.response.get("result")
+        if isinstance(result, str) and result.lstrip().startswith("Error"):
+            return result.strip().splitlines()[0]
+    return None
+
+
+def _response_bytes(content: types.Content) -> int:
+    return sum(len(str(part.function_response.response))
+               for part in content.parts or []
+               if part.function_response is not None)
+
+
+class Tracer:
+    """
+    Collects spans from any number of concurrent sessions and threads.
+    """
+
+    def __init__(self) -> None:
+        self.spans: list[Span] = []
+        self.prompts: dict[int, str] = {}
+        self._epoch = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def now(self) -> float:
+        return time.perf_counter() - self._epoch
+
+    def add(self, span: Span) -> None:
+        with self._lock:
+            self.spans.append(span)
+
+    def start_session(self, prompt: str) -> int:
+        """
+        Returns a new session id for the spans of one run of `prompt`.
+        """
+        with self._lock:
+            session = len(self.prompts) + 1
+            self.prompts[session] = prompt
+        return session
+
+    @contextlib.contextmanager
+    def span(
+             self,
+             name: str,
+             category: str,
+             session: int | None = None,
+             iteration: int | None = None,
+             **attrs: Any
+             ) -> Iterator[Span]:
+        """
+        Times the body of the with statement as a span, which it can add
+        attributes to. An exception escaping the body is recorded as the
+        span's error and re-raised.
+        """
+        span = Span(name=name,
+                    category=category,
+                    session=session,
+                    iteration=iteration,
+                    start=self.now(),
+                    thread=threading.get_ident(),
+                    attrs=attrs)
+        try:
+            yield span
+        except BaseException as e:
+            span.error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            span.duration = self.now() - span.start
+            self.add(span)
+
+    def trace_tool(
+                   self,
+                   call: Callable[[types.FunctionCall], types.Content],
+                   session: int | None = None,
+                   iteration: int | None = None
+                   ) -> Callable[[types.FunctionCall], types.Content]:
+        """
+        Wraps a tool call, e.g. ToolCache.call, to record a span for every
+        call. Spans count as cache hits unless the tool really ran, as
+        reported by a function wrapped with `executing`.
+        """
+        def traced(function_call_part: types.FunctionCall) -> types.Content:
+            with self.span(function_call_part.name or "None", "tool",
+                           session, iteration,
+                           args_bytes=len(json.dumps(
+                               function_call_part.args or {}, default=str
+                           )),
+                           cache_hit=True) as span:
+                outer = getattr(_local, "tool", None)
+                _local.tool = (self, span)
+                try:
+                    result = call(function_call_part)
+                finally:
+                    _local.tool = outer
+                span.error = _response_error(result)
+                span.attrs["result_bytes"] = _response_bytes(result)
+                return result
+        return traced
+
+    def executing(
+                  self,
+                  call: Callable[[types.FunctionCall], types.Content]
+                  ) -> Callable[[types.FunctionCall], types.Content]:
+        """
+        Wraps the function that runs a tool for real, e.g. call_function,
+        to mark the enclosing tool span as not served from the cache.
+        """
+        def executed(function_call_part: types.FunctionCall) -> types.Content:
+            current = getattr(_local, "tool", None)
+            if current is not None:
+                current[1].attrs["cache_hit"] = False
+            return call(function_call_part)
+        return executed
+
+    def summary(self) -> TraceSummary:
+        with self._lock:
+            spans = list(self.spans)
+        summary = TraceSummary()
+        tool_seconds = []
+        for span in spans:
+            if span.error is not None:
+                summary.errors += 1
+            if span.category == "session":
+                summary.sessions += 1
+                summary.iterations += span.attrs.get("iterations", 0)
+            elif span.category == "model":
+                summary.model_calls += 1
+                summary.model_seconds += span.duration
+                summary.prompt_tokens += span.attrs.get("prompt_tokens", 0)
+                summary.response_tokens += span.attrs.get("response_tokens",
+                                                          0)
+                summary.cached_tokens += span.attrs.get("cached_tokens", 0)
+            elif span.category == "tool":
+                summary.tool_calls += 1
+                summary.cache_hits += bool(span.attrs.get("cache_hit"))
+                tool_seconds.append(span.duration)
+            elif span.category == "process":
+                summary.process_runs += 1
+        summary.tool_p50 = _percentile(tool_seconds, 0.50)
+        summary.tool_p95 = _percentile(tool_seconds, 0.95)
+        return summary
+
+    def write_jsonl(self, out: TextIO) -> None:
+        """
+        Writes one JSON object per span, in start order.
+        """
+        with self._lock:
+            spans = sorted(self.spans, key=lambda s: s.start)
+        for span in spans:
+            out.write(json.dumps(span.to_dict(), default=str) + "\n")
+
+    def write_chrome(self, out: TextIO) -> None:
+        """
+        Writes the spans as Chrome trace events, one process per session
+        and one thread per OS thread that did work for it.
+        """
+        with self._lock:
+            spans = sorted(self.spans, key=lambda s: s.start)
+            prompts = dict(self.prompts)
+        threads: dict[int, int] = {}
+        events: list[dict[str, Any]] = []
+        for session, prompt in prompts.items():
+            events.append({"name": "process_name", "ph": "M",
+                           "pid": session, "tid": 0,
+                           "args": {"name": f"session {session}: "
+                                            f"{prompt[:60]}"}})
+        for span in spans:
+            args = {key: value for key, value in span.to_dict().items()
+                    if key not in ("name", "cat", "start", "duration")
+                    and value is not None}
+            events.append({
+                "name": span.name,
+                "cat": span.category,
+                "ph": "X",
+                "ts": round(span.start * 1e6, 1),
+                "dur": round(span.duration * 1e6, 1),
+                "pid": span.session or 0,
+                "tid": threads.setdefault(span.thread, len(threads) + 1),
+                "args": args,
+            })
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, out,
+                  default=str)
+
+    def write(self, path: str, fmt: str = "jsonl") -> None:
+        """
+        Writes every span to `path` in `fmt`, one of FORMATS.
+        """
+        if fmt not in FORMATS:
+            raise ValueError(f"format must be one of {', '.join(FORMATS)}")
+        with open(path, "w") as out:
+            if fmt == "chrome":
+                self.write_chrome(out)
+            else:
+                self.write_jsonl(out)
@@ -0,0 +1,203 @@
+"""
+Cheap copies of a working directory, and merging their changes back.
+
+snapshot() copies a tree file by file as reflinks where the filesystem
+supports them (btrfs, XFS), which share blocks until either side writes,
+and otherwise as plain copies. Hard links are never used: a script run in
+a copy that opens a file for writing would change the original, and every
+other copy, through the shared file.
+
+changed_files() lists what a copy changed against the original, and
+merge3() combines two sets of changes to one text file, line by line.
+"""
+import difflib
+import errno
+import os
+import shutil
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None  # type: ignore[assignment]
+
+# Directories neither copied nor merged back: bytecode is rebuilt by every
+# run and version control state is not the agent's to change.
+IGNORED_DIRECTORIES = frozenset({"__pycache__", ".git"})
+
+# ioctl that makes a file share the blocks of another, from linux/fs.h.
+FICLONE = 0x40049409
+
+# Errors meaning a way of copying is not supported here, so the next one
+# should be tried.
+_UNSUPPORTED = frozenset({errno.EOPNOTSUPP, errno.ENOTTY, errno.EINVAL,
+                          errno.EXDEV, errno.EPERM, errno.ENOSYS,
+                          errno.EBADF})
+
+
+def _reflink(source: str, target: str) -> None:
+    if fcntl is None:
+        raise OSError(errno.ENOSYS, "reflinks are not supported")
+    with open(source, "rb") as src, open(target, "wb") as dst:
+        try:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+        except OSError:
+            dst.close()
+            os.unlink(target)
+            raise
+    shutil.copymode(source, target)
+
+
+_METHODS = {
+    "reflink": _reflink,
+    "copy": shutil.copy2,
+}
+
+
+def _walk(root: str):
+    for directory, dirnames, filenames in os.walk(root):
+        dirnames[:] = [d for d in dirnames if d not in IGNORED_DIRECTORIES]
+        rel_dir = os.path.relpath(directory, root)
+        yield rel_dir, dirnames, filenames
+
+
+def snapshot(source: str, target: str) -> str:
+    """
+    Copies the tree at `source` to the new directory `target` as cheaply
+    as the filesystem allows.
+
+    Args:
+        source(str): The directory to copy.
+        target(str): Where to create the copy; must not exist.
+
+    Returns:
+        str: How the files were copied, 'reflink' or 'copy'.
+    """
+    methods = list(_METHODS)
+    os.makedirs(target)
+    for rel_dir, dirnames, filenames in _walk(source):
+        for name in dirnames:
+            src = os.path.join(source, rel_dir, name)
+            dst = os.path.normpath(os.path.join(target, rel_dir, name))
+            if os.path.islink(src):
+                os.symlink(os.readlink(src), dst)
+            else:
+                os.mkdir(dst)
+        for name in filenames:
+            src = os.path.join(source, rel_dir, name)
+            dst = os.path.normpath(os.path.join(target, rel_dir, name))
+            if os.path.islink(src):
+                os.symlink(os.readlink(src), dst)
+                continue
+            while True:
+                try:
+                    _METHODS[methods[0]](src, dst)
+                    break
+                except OSError as e:
+                    if len(methods) == 1 or e.errno not in _UNSUPPORTED:
+                        raise
+                    # Not supported here, so not for the other files either.
+                    methods.pop(0)
+    return methods[0]
+
+
+def _files(root: str) -> dict[str, os.stat_result]:
+    files = {}
+    for rel_dir, _, filenames in _walk(root):
+        for name in filenames:
+            rel_path = os.path.normpath(os.path.join(rel_dir, name))
+            files[rel_path] = os.lstat(os.path.join(root, rel_path))
+    return files
+
+
+def _same(a: str, a_stat: os.stat_result,
+          b: str, b_stat: os.stat_result) -> bool:
+    if a_stat.st_size != b_stat.st_size:
+        return False
+    if os.path.islink(a) or os.path.islink(b):
+        return (os.path.islink(a) and os.path.islink(b)
+                and os.readlink(a) == os.readlink(b))
+    with open(a, "rb") as fa, open(b, "rb") as fb:
+        while True:
+            chunk = fa.read(1 << 16)
+            if chunk != fb.read(1 << 16):
+                return False
+            if not chunk:
+                return True
+
+
+def changed_files(original: str, copy: str) -> dict[str, bytes | None]:
+    """
+    Lists the files `copy` added, changed or removed against `original`.
+
+    Args:
+        original(str): The directory the copy was taken of.
+        copy(str): The copy, e.g. from snapshot().
+
+    Returns:
+        dict: New content of every changed path, relative to the
+              directories, or None for a removed one.
+    """
+    before = _files(original)
+    after = _files(copy)
+    changes: dict[str, bytes | None] = {}
+    for rel_path, stat in after.items():
+        path = os.path.join(copy, rel_path)
+        if rel_path in before and _same(os.path.join(original, rel_path),
+                                        before[rel_path], path, stat):
+            continue
+        if os.path.islink(path):
+            # Links are not followed out of the copy.
+            continue
+        with open(path, "rb") as f:
+            changes[rel_path] = f.read()
+    for rel_path in before.keys() - after.keys():
+        changes[rel_path] = None
+    return changes
+
+
+def _edits(
+           base: list[str],
+           other: list[str]
+           ) -> list[tuple[int, int, list[str]]]:
+    matcher = difflib.SequenceMatcher(None, base, other, autojunk=False)
+    return [(i1, i2, other[j1:j2])
+            for tag, i1, i2, j1, j2 in matcher.get_opcodes()
+            if tag != "equal"]
+
+
+def merge3(base: str, ours: str, theirs: str) -> str | None:
+    """
+    Combines the changes `ours` and `theirs` each made to `base`.
+
+    Args:
+        base(str): The text both sides started from.
+        ours(str): One changed version.
+        theirs(str): The other changed version.
+
+    Returns:
+        str | None: The text with both sides' changes, or None if they
+                    change the same or adjacent lines differently.
+    """
+    base_lines = base.splitlines(keepends=True)
+    edits = sorted(
+        [(i1, i2, lines, 0) for i1, i2, lines
+         in _edits(base_lines, ours.splitlines(keepends=True))]
+        + [(i1, i2, lines, 1) for i1, i2, lines
+           in _edits(base_lines, theirs.splitlines(keepends=True))],
+        key=lambda edit: (edit[0], edit[1], edit[3])
+    )
+    merged: list[str] = []
+    position = 0
+    last = None
+    for i1, i2, lines, side in edits:
+        if last is not None and i1 <= last[1] and side != last[3]:
+            if (i1, i2, lines) == last[:3]:
+                # Both sides made the same change.
+                continue
+            return None
+        merged.extend(base_lines[position:i1])
+        merged.extend(lines)
+        position = max(position, i2)
+        last = (i1, i2, lines, side)
+    merged.extend(base_lines[position:])
+    return "".join(merged)
@@ -0,0 +1,175 @@
+"""
+Benchmark of the agent loop against a local stand-in model.
+
+Runs scripted tasks over a scratch copy of the calculator/ workspace and
+prints a JSON report with, for every iteration, the model latency, the
+time spent in each tool, the time spent building the history and the
+token counts. Compare the reports of two commits to catch regressions.
+
+    python -m benchmarks.agent_loop --repeat 5 --output before.json
+"""
+import argparse
+import asyncio
+import dataclasses
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+from typing import Any
+
+from agent.engine import AgentEngine
+from agent.engine import IterationStats
+from agent.engine import SessionResult
+from agent.fake_model import Reply
+from agent.fake_model import ScriptedModel
+
+WORKSPACE = os.path.join(os.path.dirname(os.path.dirname(__file__)),
+                         "calculator")
+
+TASKS: dict[str, list[Reply]] = {
+    "explore": [
+        [("get_files_info", {"directory": "."}),
+         ("get_files_info", {"directory": "pkg"})],
+        [("get_file_content", {"file_path": "main.py"}),
+         ("get_file_content", {"file_path": "pkg/calculator.py"}),
+         ("get_file_content", {"file_path": "pkg/render.py"})],
+        "The calculator evaluates infix expressions and renders a box.",
+    ],
+    "fix-and-test": [
+        [("get_file_content", {"file_path": "pkg/calculator.py"})],
+        [("run_python_file", {"file_path": "tests.py", "args": []})],
+        [("get_file_content", {"file_path": "pkg/calculator.py"}),
+         ("run_python_file", {"file_path": "main.py", "args": ["3 + 5"]})],
+        "All tests pass.",
+    ],
+    "rewrite": [
+        [("get_file_content", {"file_path": "pkg/render.py"})],
+        [("write_file", {"file_path": "notes.txt",
+                         "content": "render.py draws the result box\n" * 50})],
+        [("get_file_content", {"file_path": "notes.txt"}),
+         ("get_files_info", {"directory": "."})],
+        "Notes written.",
+    ],
+}
+
+
+def _summary(values: list[float]) -> dict[str, float]:
+    return {
+        "mean": statistics.fmean(values),
+        "min": min(values),
+        "max": max(values),
+    }
+
+
+async def _run_task(
+                    name: str,
+                    model: ScriptedModel,
+                    workspace: str
+                    ) -> dict[str, Any]:
+    iterations: list[IterationStats] = []
+
+    def on_iteration(_: SessionResult, stats: IterationStats) -> None:
+        iterations.append(stats)
+
+    engine = AgentEngine(model,
+                         working_directory=workspace,
+                         on_iteration=on_iteration)
+    start = time.perf_counter()
+    result = await engine.run(name)
+    wall_seconds = time.perf_counter() - start
+
+    tool_seconds: dict[str, float] = {}
+    for stats in iterations:
+        for tool, seconds in stats.tool_seconds.items():
+            tool_seconds[tool] = tool_seconds.get(tool, 0.0) + seconds
+    return {
+        "task": name,
+        "completed": result.error is None,
+        "iterations": result.iterations,
+        "wall_seconds": wall_seconds,
+        "model_seconds": sum(s.model_seconds for s in iterations),
+        "tools_seconds": sum(s.tools_seconds for s in iterations),
+        "history_seconds": sum(s.history_seconds for s in iterations),
+        "tool_seconds": tool_seconds,
+        "prompt_tokens": result.prompt_tokens,
+        "response_tokens": result.response_tokens,
+        "per_iteration": [dataclasses.asdict(s) for s in iterations],
+    }
+
+
+def run_benchmark(
+                  tasks: dict[str, list[Reply]] = TASKS,
+                  repeat: int = 3,
+                  latency: float = 0.0
+                  ) -> dict[str, Any]:
+    """
+    Runs every task `repeat` times on a fresh copy of the workspace.
+
+    Args:
+        tasks(dict): Scripted replies of the stand-in model per task.
+        repeat(int): Number of runs per task.
+        latency(float): Simulated latency of every model call in seconds.
+
+    Returns:
+        dict: JSON-serialisable report with every run and a per-task
+              summary of wall, model, tool and history time.
+    """
+    model = ScriptedModel(tasks, latency=latency)
+    runs = []
+    for _ in range(repeat):
+        for name in tasks:
+            with tempfile.TemporaryDirectory() as tmp:
+                workspace = shutil.copytree(
+                                WORKSPACE,
+                                os.path.join(tmp, "calculator"),
+                                ignore=shutil.ignore_patterns("__pycache__")
+                                )
+                runs.append(asyncio.run(_run_task(name, model, workspace)))
+
+    summary = {}
+    for name in tasks:
+        task_runs = [r for r in runs if r["task"] == name]
+        summary[name] = {
+            "iterations": task_runs[0]["iterations"],
+            "completed": all(r["completed"] for r in task_runs),
+            **{
+                key: _summary([r[key] for r in task_runs])
+                for key in ("wall_seconds", "model_seconds",
+                            "tools_seconds", "history_seconds")
+            },
+        }
+    return {
+        "python": platform.python_version(),
+        "repeat": repeat,
+        "model_latency": latency,
+        "summary": summary,
+        "runs": runs,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="Number of runs per task")
+    parser.add_argument("--latency", type=float, default=0.0,
+                        help="Simulated model latency in seconds")
+    parser.add_argument("--output", metavar="FILE",
+                        help="Write the JSON report to FILE, not stdout")
+    args = parser.parse_args()
+
+    report = run_benchmark(repeat=args.repeat, latency=args.latency)
+    if args.output is None:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    else:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+"""
+Benchmark of the calculator.
+
+Evaluates one expression over `rows` rows of random variables, once by
+calling Calculator.evaluate per row in a Python loop and once with
+Calculator.evaluate_vectorized over NumPy arrays; without NumPy only the
+loop is timed. Then compiles one long random expression of `tokens`
+tokens, written with and without spaces, to measure the tokenizer against
+the str.split compiler it replaced. Prints a JSON report of all timings.
+
+    python -m benchmarks.calculator --rows 1000000 --tokens 200000
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+from functools import partial
+from typing import Any
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(__file__)),
+                                "calculator"))
+
+from pkg.calculator import Calculator  # noqa: E402
+
+EXPRESSION = "x * 2 + y / z - x"
+
+
+def _split_rpn(calculator: Calculator, expression: str) -> tuple:
+    """
+    The compiler before the tokenizer: str.split and a shunting-yard loop
+    that only knows binary operators, kept as the baseline to beat.
+    """
+    operators = calculator.operators
+    precedence = calculator.precedence
+    program: list = []
+    stack: list[str] = []
+    depth = 0
+    for t in expression.strip().split():
+        if t in operators:
+            while (
+                stack
+                and stack[-1] in operators
+                and precedence[stack[-1]] >= precedence[t]
+            ):
+                if depth < 2:
+                    raise ValueError(f"not enough operands for operator {t}")
+                program.append(stack.pop())
+                depth -= 1
+            stack.append(t)
+        elif t.isidentifier():
+            program.append(t)
+            depth += 1
+        else:
+            try:
+                program.append(float(t))
+            except ValueError:
+                raise ValueError(f"invalid token: {t}")
+            depth += 1
+    while stack:
+        if depth < 2:
+            raise ValueError("not enough operands")
+        program.append(stack.pop())
+        depth -= 1
+    if depth != 1:
+        raise ValueError("invalid expression")
+    return tuple(program)
+
+
+def _compile_throughput(tokens: int, repeat: int = 5) -> dict[str, float]:
+    rng = random.Random(0)
+    parts = [str(rng.randint(1, 99))]
+    while len(parts) < tokens:
+        parts += [rng.choice("+-*/"), str(rng.randint(1, 99))]
+    spaced = " ".join(parts)
+    calculator = Calculator()
+    assert _split_rpn(calculator, spaced) == calculator.compile(spaced)
+    runs = {
+        "split_baseline": (partial(_split_rpn, calculator), spaced),
+        # Uncached, so that every run compiles from scratch.
+        "spaced": (calculator._compile_uncached, spaced),
+        "unspaced": (calculator._compile_uncached, spaced.replace(" ", "")),
+    }
+    best = dict.fromkeys(runs, float("inf"))
+    # Taking turns spreads any noise on the machine over all three.
+    for _ in range(repeat):
+        for name, (compile_, expression) in runs.items():
+            start = time.perf_counter()
+            compile_(expression)
+            best[name] = min(best[name], time.perf_counter() - start)
+    throughput = {name: len(parts) / seconds
+                  for name, seconds in best.items()}
+    for name in ("spaced", "unspaced"):
+        throughput[f"{name}_vs_baseline"] = (best["split_baseline"]
+                                             / best[name])
+    return throughput
+
+
+def run_benchmark(rows: int = 100_000,
+                  expression: str = EXPRESSION,
+                  tokens: int = 100_000) -> dict[str, Any]:
+    """
+    Times evaluating `expression` over `rows` rows of x, y and z and
+    compiling an expression of `tokens` tokens.
+
+    Args:
+        rows(int): Number of rows.
+        expression(str): Expression over the variables x, y and z.
+        tokens(int): Length of the expression compiled for throughput.
+
+    Returns:
+        dict: JSON-serialisable report with the seconds per mode, with
+              NumPy installed the speedup of the vectorized mode, and the
+              tokens compiled per second.
+    """
+    rng = random.Random(0)
+    columns = {name: [rng.uniform(-100, 100) for _ in range(rows)]
+               for name in ("x", "y", "z")}
+    calculator = Calculator()
+    report: dict[str, Any] = {
+        "python": sys.version.split()[0],
+        "expression": expression,
+        "rows": rows,
+        "seconds": {},
+        "compile_tokens_per_second": _compile_throughput(tokens),
+    }
+
+    start = time.perf_counter()
+    for x, y, z in zip(columns["x"], columns["y"], columns["z"]):
+        calculator.evaluate(expression, x=x, y=y, z=z)
+    report["seconds"]["loop"] = time.perf_counter() - start
+
+    try:
+        import numpy as np
+    except ImportError:
+        report["numpy"] = None
+        return report
+    arrays = {name: np.array(values) for name, values in columns.items()}
+    start = time.perf_counter()
+    calculator.evaluate_vectorized(expression, **arrays)
+    report["seconds"]["vectorized"] = time.perf_counter() - start
+    report["numpy"] = np.__version__
+    report["speedup"] = (report["seconds"]["loop"]
+                         / report["seconds"]["vectorized"])
+    return report
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--rows", type=int, default=100_000,
+                        help="Number of rows to evaluate")
+    parser.add_argument("--expression", default=EXPRESSION,
+                        help="Expression over the variables x, y and z")
+    parser.add_argument("--tokens", type=int, default=100_000,
+                        help="Length of the expression compiled to measure "
+                             "the tokenizer")
+    args = parser.parse_args()
+    json.dump(run_benchmark(args.rows, args.expression, args.tokens),
+              sys.stdout, indent=2)
+    print()
+
+
+if __name__ == "__main__":
+    main()
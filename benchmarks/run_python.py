@@ -0,0 +1,93 @@
+"""
+Cold versus warm runs of run_python_file.
+
+Runs calculator/tests.py through run_python_file, first starting a fresh
+interpreter every time and then forking each run from the warm interpreter
+pool, and prints a JSON report of both. The warm pool is started before
+timing, as it would be by the time an agent session first runs a script.
+
+    python -m benchmarks.run_python --repeat 20
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+from typing import Any
+
+from functions import _interpreter_pool
+from functions.run_python_file import run_python_file
+from functions.run_python_file import use_warm_interpreters
+
+CALCULATOR = os.path.join(os.path.dirname(os.path.dirname(__file__)),
+                          "calculator")
+
+
+def _time_runs(file_path: str, repeat: int) -> list[float]:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        output = run_python_file(CALCULATOR, file_path)
+        timings.append(time.perf_counter() - start)
+        if output.startswith("Error"):
+            raise RuntimeError(output)
+    return timings
+
+
+def run_benchmark(file_path: str = "tests.py",
+                  repeat: int = 10) -> dict[str, Any]:
+    """
+    Times `repeat` cold and `repeat` warm runs of `file_path`.
+
+    Args:
+        file_path(str): Script to run, relative to calculator/.
+        repeat(int): Number of runs per mode.
+
+    Returns:
+        dict: JSON-serialisable report with the mean, median and minimum
+              seconds per mode and the speedup of the warm medians.
+    """
+    timings = {"cold": _time_runs(file_path, repeat)}
+    if _interpreter_pool.is_supported():
+        use_warm_interpreters()
+        try:
+            # The first run waits for the pool to finish preloading.
+            _time_runs(file_path, 1)
+            timings["warm"] = _time_runs(file_path, repeat)
+        finally:
+            use_warm_interpreters(0)
+    seconds = {
+        mode: {
+            "mean": statistics.fmean(values),
+            "median": statistics.median(values),
+            "min": min(values),
+        }
+        for mode, values in timings.items()
+    }
+    report: dict[str, Any] = {
+        "python": sys.version.split()[0],
+        "file_path": file_path,
+        "repeat": repeat,
+        "seconds": seconds,
+    }
+    if "warm" in seconds:
+        report["speedup"] = (seconds["cold"]["median"]
+                             / seconds["warm"]["median"])
+    return report
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--repeat", type=int, default=10,
+                        help="Number of runs per mode")
+    parser.add_argument("--file", default="tests.py",
+                        help="Script to run, relative to calculator/")
+    args = parser.parse_args()
+    json.dump(run_benchmark(args.file, args.repeat), sys.stdout, indent=2)
+    print()
+
+
+if __name__ == "__main__":
+    main()
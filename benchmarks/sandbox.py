@@ -0,0 +1,107 @@
+"""
+Microbenchmark of path validation on a deep tree.
+
+Builds a temporary tree `depth` directories deep with `files` files in
+each and validates every file path three ways: resolving the root and
+the path with pathlib on every call, as the tools used to, with a fresh
+Sandbox per batch and with a Sandbox that has seen the tree before.
+Prints a JSON report of the microseconds per path.
+
+    python -m benchmarks.sandbox --depth 30 --files 20
+"""
+import argparse
+import json
+import os
+import pathlib
+import sys
+import tempfile
+import time
+
+from typing import Any
+from typing import Callable
+
+from functions._filepath_helpers import Sandbox
+
+
+def _pathlib_allowed(file_path: str, work_dir: str) -> bool:
+    workdir = pathlib.Path(work_dir).resolve()
+    target = (workdir / file_path).resolve()
+    try:
+        target.relative_to(workdir)
+        return True
+    except ValueError:
+        return False
+
+
+def _build_tree(root: str, depth: int, files: int) -> list[str]:
+    paths = []
+    directory = ""
+    for level in range(depth):
+        directory = os.path.join(directory, f"d{level}")
+        os.makedirs(os.path.join(root, directory))
+        for i in range(files):
+            path = os.path.join(directory, f"f{i}.py")
+            open(os.path.join(root, path), "w").close()
+            paths.append(path)
+    return paths
+
+
+def _time(check: Callable[[list[str]], Any], paths: list[str],
+          repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        check(paths)
+        best = min(best, time.perf_counter() - start)
+    return best / len(paths) * 1e6
+
+
+def run_benchmark(depth: int = 30, files: int = 20,
+                  repeat: int = 5) -> dict[str, Any]:
+    """
+    Times validating every file of a `depth` deep tree.
+
+    Args:
+        depth(int): Number of nested directories.
+        files(int): Number of files per directory.
+        repeat(int): Runs per method; the fastest one counts.
+
+    Returns:
+        dict: JSON-serialisable report with the microseconds per path of
+              every method.
+    """
+    with tempfile.TemporaryDirectory() as root:
+        paths = _build_tree(root, depth, files)
+        warm = Sandbox(root)
+        warm.validate_many(paths)
+        methods: dict[str, Callable[[list[str]], Any]] = {
+            "pathlib": lambda ps: [_pathlib_allowed(p, root) for p in ps],
+            "sandbox_cold": lambda ps: Sandbox(root).validate_many(ps),
+            "sandbox_warm": warm.validate_many,
+        }
+        micros = {name: _time(check, paths, repeat)
+                  for name, check in methods.items()}
+    return {
+        "python": sys.version.split()[0],
+        "depth": depth,
+        "paths": depth * files,
+        "microseconds_per_path": micros,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--depth", type=int, default=30,
+                        help="Number of nested directories")
+    parser.add_argument("--files", type=int, default=20,
+                        help="Number of files per directory")
+    parser.add_argument("--repeat", type=int, default=5,
+                        help="Runs per method, the fastest one counts")
+    args = parser.parse_args()
+    json.dump(run_benchmark(args.depth, args.files, args.repeat),
+              sys.stdout, indent=2)
+    print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""
+Microbenchmark of the session log.
+
+Appends the records of a typical session, a model response and a few KB
+of tool output per turn, to a SessionLog three ways: flushing every
+record to the OS but never fsyncing, fsyncing at most once a second (the
+default) and fsyncing every record. Prints a JSON report of the
+microseconds per record.
+
+    python -m benchmarks.session_log --turns 2000
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+from typing import Any
+
+from google.genai import types
+
+from agent.session_log import SessionLog
+
+
+def _records(turns: int, output_bytes: int) -> list[tuple[Any, ...]]:
+    call = types.FunctionCall(name="get_file_content",
+                              args={"file_path": "pkg/calculator.py"})
+    response = types.GenerateContentResponse(
+        candidates=[types.Candidate(content=types.Content(
+            role="model", parts=[types.Part(function_call=call)]
+        ))],
+        usage_metadata=types.GenerateContentResponseUsageMetadata(
+            prompt_token_count=4000, candidates_token_count=30
+        ),
+    )
+    result = types.Content(role="tool", parts=[
+        types.Part.from_function_response(
+            name="get_file_content",
+            response={"result": "x" * output_bytes},
+        )
+    ])
+    return [(turn, response, call, result) for turn in range(1, turns + 1)]
+
+
+def _time(records: list[tuple[Any, ...]], directory: str,
+          fsync_interval: float) -> float:
+    path = os.path.join(directory, f"{fsync_interval}.jsonl")
+    start = time.perf_counter()
+    log = SessionLog(path, fsync_interval=fsync_interval)
+    for turn, response, call, result in records:
+        log.model(turn, response)
+        log.tool(turn, call, result)
+    log.close()
+    return (time.perf_counter() - start) / (2 * len(records)) * 1e6
+
+
+def run_benchmark(turns: int = 2000,
+                  output_bytes: int = 4096) -> dict[str, Any]:
+    """
+    Times logging `turns` turns of one call each.
+
+    Args:
+        turns(int): Number of model responses, each with one tool result.
+        output_bytes(int): Size of every tool result.
+
+    Returns:
+        dict: JSON-serialisable report with the microseconds per record of
+              every fsync policy.
+    """
+    records = _records(turns, output_bytes)
+    policies = {"flush_only": float("inf"), "fsync_batched": 1.0,
+                "fsync_every_record": 0.0}
+    with tempfile.TemporaryDirectory() as directory:
+        micros = {name: _time(records, directory, interval)
+                  for name, interval in policies.items()}
+    return {
+        "python": sys.version.split()[0],
+        "records": 2 * turns,
+        "output_bytes": output_bytes,
+        "microseconds_per_record": micros,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--turns", type=int, default=2000,
+                        help="Number of turns to log")
+    parser.add_argument("--output-bytes", type=int, default=4096,
+                        help="Size of every tool result")
+    args = parser.parse_args()
+    json.dump(run_benchmark(args.turns, args.output_bytes), sys.stdout,
+              indent=2)
+    print()
+
+
+if __name__ == "__main__":
+    main()
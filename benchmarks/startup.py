@@ -0,0 +1,80 @@
+"""
+Startup-time benchmark of the agent CLI.
+
+Times `main.py --help` and the no-prompt error path in fresh interpreters,
+next to a bare interpreter and one that only imports the Gemini SDK, so
+the time the CLI adds on top of Python itself is visible. Prints a JSON
+report.
+
+    python -m benchmarks.startup --repeat 20
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+from typing import Any
+
+MAIN = os.path.join(os.path.dirname(os.path.dirname(__file__)), "main.py")
+
+COMMANDS: dict[str, list[str]] = {
+    "interpreter": [sys.executable, "-c", "pass"],
+    "sdk_import": [sys.executable, "-c", "from google.genai import types"],
+    "help": [sys.executable, MAIN, "--help"],
+    "no_prompt": [sys.executable, MAIN],
+}
+
+
+def _time_command(cmd: list[str]) -> float:
+    start = time.perf_counter()
+    subprocess.run(cmd,
+                   stdout=subprocess.DEVNULL,
+                   stderr=subprocess.DEVNULL,
+                   cwd=os.path.dirname(MAIN))
+    return time.perf_counter() - start
+
+
+def run_benchmark(repeat: int = 10) -> dict[str, Any]:
+    """
+    Runs every command `repeat` times and summarises the wall times.
+
+    Args:
+        repeat(int): Number of runs per command.
+
+    Returns:
+        dict: JSON-serialisable report with the mean, median and minimum
+              seconds per command.
+    """
+    timings: dict[str, list[float]] = {name: [] for name in COMMANDS}
+    # Interleave the commands so drift in machine load hits them equally.
+    for _ in range(repeat):
+        for name, cmd in COMMANDS.items():
+            timings[name].append(_time_command(cmd))
+    return {
+        "python": sys.version.split()[0],
+        "repeat": repeat,
+        "seconds": {
+            name: {
+                "mean": statistics.fmean(values),
+                "median": statistics.median(values),
+                "min": min(values),
+            }
+            for name, values in timings.items()
+        },
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--repeat", type=int, default=10,
+                        help="Number of runs per command")
+    args = parser.parse_args()
+    json.dump(run_benchmark(args.repeat), sys.stdout, indent=2)
+    print()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,18 +1,33 @@
 # main.py
 
+import argparse
 import sys
+from pkg.batch import FORMATS
+from pkg.batch import evaluate_all
+from pkg.batch import read_expressions
+from pkg.batch import write_results
 from pkg.calculator import Calculator
 from pkg.render import render
 
+# Write buffer for batch results, so that a million lines are not a
+# million writes.
+OUTPUT_BUFFER_BYTES = 1 << 16
+
 
 def main():
     calculator = Calculator()
     if len(sys.argv) <= 1:
         print("Calculator App")
         print('Usage: python main.py "<expression>"')
+        print('       python main.py --batch FILE [--format plain|csv|box]'
+              ' [--workers N]')
         print('Example: python main.py "3 + 5"')
         return
 
+    if sys.argv[1] == "--batch":
+        batch_main(sys.argv[1:])
+        return
+
     expression = " ".join(sys.argv[1:])
     try:
         result = calculator.evaluate(expression)
@@ -22,5 +37,25 @@ def main():
         print(f"Error: {e}")
 
 
+def batch_main(argv):
+    # Only parsed in batch mode: single expressions such as "-3 + 4" would
+    # look like options to argparse.
+    parser = argparse.ArgumentParser(prog="main.py")
+    parser.add_argument("--batch", metavar="FILE", required=True,
+                        help="Evaluate every line of FILE ('-' for stdin)")
+    parser.add_argument("--format", choices=FORMATS, default="plain",
+                        help="Output format, one line or box per input line")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Worker processes to evaluate with")
+    args = parser.parse_args(argv)
+
+    out = open(sys.stdout.fileno(), "w", buffering=OUTPUT_BUFFER_BYTES,
+               encoding="utf-8", closefd=False)
+    source = sys.stdin if args.batch == "-" else open(args.batch)
+    with source, out:
+        results = evaluate_all(read_expressions(source), args.workers)
+        write_results(results, out, args.format)
+
+
 if __name__ == "__main__":
     main()
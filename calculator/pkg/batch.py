@@ -0,0 +1,83 @@
+# batch.py
+
+import csv
+import itertools
+
+from collections import deque
+from multiprocessing import Pool
+
+from pkg.calculator import Calculator
+from pkg.render import format_result
+from pkg.render import render
+
+FORMATS = ("plain", "csv", "box")
+# Expressions sent to a worker process at a time.
+CHUNK_SIZE = 1000
+
+
+def read_expressions(stream):
+    for line in stream:
+        expression = line.strip()
+        if expression:
+            yield expression
+
+
+def evaluate_all(expressions, workers=1, chunk_size=CHUNK_SIZE):
+    """
+    Yields (expression, result, error) for every expression, in input
+    order. With more than one worker, chunks of expressions are evaluated
+    in that many processes while the input is still being read.
+    """
+    if workers <= 1:
+        yield from _evaluate(expressions, Calculator())
+        return
+    expressions = iter(expressions)
+    chunks = iter(lambda: list(itertools.islice(expressions, chunk_size)), [])
+    # Pool.imap would read all of the input ahead; keeping a few chunks per
+    # worker in flight bounds memory and still keeps every worker busy.
+    pending = deque()
+    with Pool(workers, initializer=_start_worker) as pool:
+        for chunk in chunks:
+            pending.append(pool.apply_async(_evaluate_chunk, (chunk,)))
+            if len(pending) >= 2 * workers:
+                yield from pending.popleft().get()
+        while pending:
+            yield from pending.popleft().get()
+
+
+def write_results(results, out, fmt="plain"):
+    if fmt == "csv":
+        writer = csv.writer(out, lineterminator="\n")
+        writer.writerow(("expression", "result", "error"))
+        for expression, result, error in results:
+            writer.writerow((expression,
+                             "" if error else format_result(result),
+                             error or ""))
+        return
+    for expression, result, error in results:
+        if error:
+            out.write(f"Error: {error}\n")
+        elif fmt == "box":
+            out.write(render(expression, result) + "\n")
+        else:
+            out.write(format_result(result) + "\n")
+
+
+def _evaluate(expressions, calculator):
+    for expression in expressions:
+        try:
+            yield expression, calculator.evaluate(expression), None
+        except Exception as e:
+            yield expression, None, str(e)
+
+
+_calculator = None
+
+
+def _start_worker():
+    global _calculator
+    _calculator = Calculator()
+
+
+def _evaluate_chunk(expressions):
+    return list(_evaluate(expressions, _calculator))
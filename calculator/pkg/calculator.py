@@ -1,7 +1,34 @@
 # calculator.py
 
+import re
+
+from functools import lru_cache
+
+try:
+    import numpy as np
+except ImportError:  # only evaluate_vectorized needs it
+    np = None
+
+# A number, a name or any other single character: an operator, a
+# parenthesis or an invalid token.
+_TOKEN = re.compile(
+    r"\d+(?:\.\d*)?(?:[eE][+-]?\d+)?|\.\d+(?:[eE][+-]?\d+)?"
+    r"|[A-Za-z_]\w*"
+    r"|\S"
+)
+_NUMBER_START = "0123456789."
+# Characters that are always a token of their own.
+_SYMBOLS = "+-*/()"
+# How unary minus appears in compiled programs; it cannot clash with a name.
+NEGATE = "u-"
+
+
+class _SyntaxError(Exception):
+    pass
+
+
 class Calculator:
-    def __init__(self):
+    def __init__(self, cache_size=128):
         self.operators = {
             "+": lambda a, b: a + b,
             "-": lambda a, b: a - b,
@@ -14,48 +41,197 @@ class Calculator:
             "*": 2,
             "/": 2,
         }
+        # Operators on the stack bind by these ranks; "(" stops any pop.
+        self._ranks = {
+            **self.precedence,
+            NEGATE: max(self.precedence.values()) + 1,
+            "(": 0,
+        }
+        # Compiled programs of recently seen expressions, see cache_info().
+        self._compile = lru_cache(maxsize=cache_size)(self._compile_uncached)
 
-    def evaluate(self, expression: str):
-        if not expression or expression.isspace():
-            return None
-        tokens = expression.strip().split()
-        return self._evaluate_infix(tokens)
+    def evaluate(self, expression: str, **variables):
+        return self.run(self.compile(expression), variables)
+
+    def evaluate_vectorized(self, expression: str, **arrays):
+        """
+        Evaluates an expression over whole NumPy arrays at once, one row per
+        element: variables are looked up in `arrays` and every operator
+        runs as a single array operation. Like NumPy, division by zero
+        gives inf or nan for that element instead of raising.
+        """
+        if np is None:
+            raise ImportError("evaluate_vectorized requires NumPy")
+        # Constants become NumPy floats too, so that parts of the expression
+        # without variables, like 1/0, follow the same rules as the rest.
+        program = tuple(np.float64(item) if isinstance(item, float) else item
+                        for item in self.compile(expression))
+        arrays = {name: np.asarray(value, dtype=float)
+                  for name, value in arrays.items()}
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return self.run(program, arrays)
+
+    def evaluate_many(self, expressions):
+        # Every distinct expression is compiled and evaluated only once.
+        results = {}
+        for expression in expressions:
+            if expression not in results:
+                results[expression] = self.evaluate(expression)
+        return [results[expression] for expression in expressions]
+
+    def compile(self, expression: str):
+        """
+        Turns an infix expression into a program in reverse Polish
+        notation: a tuple of numbers, variable names and operator symbols.
+        """
+        return self._compile(expression)
 
-    def _evaluate_infix(self, tokens):
+    def cache_info(self):
+        return self._compile.cache_info()
+
+    def cache_clear(self):
+        self._compile.cache_clear()
+
+    def run(self, program, variables=None):
+        if not program:
+            return None
         values = []
+        for item in program:
+            if isinstance(item, float):
+                values.append(item)
+            elif item in self.operators:
+                b = values.pop()
+                a = values.pop()
+                values.append(self.operators[item](a, b))
+            elif item == NEGATE:
+                values.append(-values.pop())
+            else:
+                try:
+                    values.append(variables[item])
+                except (KeyError, TypeError):
+                    raise ValueError(f"unknown variable: {item}")
+        return values[0]
+
+    def _compile_uncached(self, expression):
+        if not expression or expression.isspace():
+            return ()
+        return self._to_rpn(expression)
+
+    def _to_rpn(self, expression):
+        # Well spaced input splits into whole tokens, which str.split finds
+        # much faster than any regex. So does input without spaces once
+        # every operator is padded with them, unless it has a number with
+        # a signed exponent, like 1e-5. Anything else is tokenized with
+        # _TOKEN, and errors once more to find their position.
+        try:
+            return self._shunting_yard(expression.split())
+        except _SyntaxError:
+            pass
+        padded = expression
+        for symbol in _SYMBOLS:
+            padded = padded.replace(symbol, f" {symbol} ")
+        try:
+            return self._shunting_yard(padded.split())
+        except _SyntaxError:
+            pass
+        try:
+            return self._shunting_yard(_TOKEN.findall(expression))
+        except _SyntaxError:
+            pass
+        positions = []
+        tokens = (positions.append(m.start()) or m.group()
+                  for m in _TOKEN.finditer(expression))
+        try:
+            return self._shunting_yard(tokens)
+        except _SyntaxError as e:
+            if e.args[0] == "unclosed":
+                position = _unclosed_position(expression)
+                raise ValueError(f"unclosed '(' at position {position}")
+            if e.args[0] == "end":
+                position = len(expression.rstrip())
+                raise ValueError(f"expected an operand at position {position}")
+            raise ValueError(f"{e.args[0]} at position {positions[-1]}")
+
+    def _shunting_yard(self, tokens):
+        rank_of = self.precedence.get
+        ranks = self._ranks
+        # Locals, as this loop runs once per token.
+        number_start = _NUMBER_START
+        to_float = float
+        program = []
+        emit = program.append
         operators = []
+        push = operators.append
+        # Tells a unary sign from a binary operator and catches missing
+        # operands and operators right where they happen.
+        expect_operand = True
+        open_parens = 0
 
         for t in tokens:
-            if t in self.operators:
-                while (
-                    operators
-                    and operators[-1] in self.operators
-                    and self.precedence[operators[-1]] >= self.precedence[t]
-                ):
-                    self._apply_operator(operators, values)
-                operators.append(t)
+            rank = rank_of(t)
+            if rank is not None:
+                if expect_operand:
+                    if t == "-":
+                        push(NEGATE)
+                    elif t != "+":
+                        raise _SyntaxError("expected an operand")
+                    continue
+                while operators and ranks[operators[-1]] >= rank:
+                    emit(operators.pop())
+                push(t)
+                expect_operand = True
+            elif expect_operand:
+                # Most numbers are plain digits, which isdigit() tells
+                # faster than looking up the first character.
+                if t.isdigit() or t[0] in number_start:
+                    try:
+                        emit(to_float(t))
+                    except ValueError:
+                        raise _SyntaxError(f"invalid token: {t}")
+                elif t.isidentifier():
+                    emit(t)
+                elif t == "(":
+                    push(t)
+                    open_parens += 1
+                    continue
+                else:
+                    raise _SyntaxError(_misplaced(t, "an operand"))
+                expect_operand = False
+            elif t == ")" and open_parens:
+                top = operators.pop()
+                while top != "(":
+                    emit(top)
+                    top = operators.pop()
+                open_parens -= 1
             else:
-                try:
-                    values.append(float(t))
-                except ValueError:
-                    raise ValueError(f"invalid token: {t}")
+                raise _SyntaxError(_misplaced(t, "an operator"))
 
+        if expect_operand:
+            raise _SyntaxError("end")
+        if open_parens:
+            raise _SyntaxError("unclosed")
         while operators:
-            self._apply_operator(operators, values)
-
-        if len(values) != 1:
-            raise ValueError("invalid expression")
+            emit(operators.pop())
+        return tuple(program)
 
-        return values[0]
 
-    def _apply_operator(self, operators, values):
-        if not operators:
-            return
+def _misplaced(token, expected):
+    if token == ")":
+        return "unexpected ')'"
+    if _TOKEN.fullmatch(token) is None or not (
+        token in "+-*/("
+        or token[0] in _NUMBER_START
+        or token.isidentifier()
+    ):
+        return f"invalid token: {token}"
+    return f"expected {expected}"
 
-        operator = operators.pop()
-        if len(values) < 2:
-            raise ValueError(f"not enough operands for operator {operator}")
 
-        b = values.pop()
-        a = values.pop()
-        values.append(self.operators[operator](a, b))
+def _unclosed_position(expression):
+    opened = []
+    for match in _TOKEN.finditer(expression):
+        if match.group() == "(":
+            opened.append(match.start())
+        elif match.group() == ")" and opened:
+            opened.pop()
+    return opened[-1]
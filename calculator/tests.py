@@ -1,8 +1,18 @@
 # tests.py
 
+import io
+import re
 import unittest
+from pkg.batch import evaluate_all
+from pkg.batch import read_expressions
+from pkg.batch import write_results
 from pkg.calculator import Calculator
 
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
 
 class TestCalculator(unittest.TestCase):
     def setUp(self):
@@ -42,7 +52,105 @@ class TestCalculator(unittest.TestCase):
 
     def test_not_enough_operands(self):
         with self.assertRaises(ValueError):
-            self.calculator.evaluate("+ 3")
+            self.calculator.evaluate("3 +")
+
+    def test_parentheses_and_unary_signs(self):
+        self.assertEqual(self.calculator.evaluate("3*(4+5)"), 27)
+        self.assertEqual(self.calculator.evaluate("-(2 + 3) * -2"), 10)
+        self.assertEqual(self.calculator.evaluate("+3 - -2"), 5)
+        self.assertEqual(self.calculator.evaluate("-2*3"), -6)
+        self.assertEqual(self.calculator.evaluate("((1.5e1))/-.5"), -30)
+        self.assertEqual(self.calculator.evaluate("2e-3*1000+1E+1"), 12)
+
+    def test_error_positions(self):
+        for expression, message in [
+            ("3 $ 5", "invalid token: $ at position 2"),
+            ("(3 + 4", "unclosed '(' at position 0"),
+            ("3 + 4)", "unexpected ')' at position 5"),
+            ("3 (4)", "expected an operator at position 2"),
+            ("3 * / 4", "expected an operand at position 4"),
+            ("3 * ", "expected an operand at position 3"),
+        ]:
+            with self.assertRaisesRegex(ValueError, re.escape(message)):
+                self.calculator.evaluate(expression)
+
+    def test_compile_to_rpn(self):
+        program = self.calculator.compile("2 * 3 - 8 / 2 + 5")
+        self.assertEqual(program, (2, 3, "*", 8, 2, "/", "-", 5, "+"))
+        self.assertEqual(self.calculator.run(program), 7)
+
+    def test_compiled_programs_are_cached(self):
+        calculator = Calculator(cache_size=2)
+        calculator.evaluate("1 + 2")
+        calculator.evaluate("1 + 2")
+        calculator.evaluate("2 + 3")
+        calculator.evaluate("3 + 4")
+        info = calculator.cache_info()
+        self.assertEqual((info.hits, info.misses), (1, 3))
+        self.assertEqual((info.maxsize, info.currsize), (2, 2))
+
+    def test_evaluate_many(self):
+        results = self.calculator.evaluate_many(
+            ["1 + 2", "3 * 4", "1 + 2", ""]
+        )
+        self.assertEqual(results, [3, 12, 3, None])
+        self.assertEqual(self.calculator.cache_info().misses, 3)
+
+    def test_variables(self):
+        result = self.calculator.evaluate("x * 2 + y", x=3, y=1)
+        self.assertEqual(result, 7)
+        with self.assertRaises(ValueError):
+            self.calculator.evaluate("x + 1")
+
+    @unittest.skipIf(np is None, "NumPy is not installed")
+    def test_evaluate_vectorized(self):
+        result = self.calculator.evaluate_vectorized(
+            "x * 2 + y / z", x=[1, 2, 3], y=[1, 1, 0], z=[2, 0, 0]
+        )
+        self.assertEqual(result[0], 2.5)
+        self.assertEqual(result[1], float("inf"))
+        self.assertTrue(np.isnan(result[2]))
+
+    @unittest.skipIf(np is None, "NumPy is not installed")
+    def test_evaluate_vectorized_constant_division_by_zero(self):
+        result = self.calculator.evaluate_vectorized("x + 1 / 0", x=[1, 2])
+        self.assertEqual(list(result), [float("inf")] * 2)
+        self.assertTrue(np.isnan(
+            self.calculator.evaluate_vectorized("x * 0 / 0", x=[1])[0]
+        ))
+        self.assertTrue(np.isnan(
+            self.calculator.evaluate_vectorized("0 / 0 + x", x=[1])[0]
+        ))
+
+
+class TestBatch(unittest.TestCase):
+    lines = io.StringIO("3 + 5\n\n  2*(3+4) \n1/0\n3 $ 4\n")
+
+    def results(self, fmt, workers=1):
+        self.lines.seek(0)
+        out = io.StringIO()
+        results = evaluate_all(read_expressions(self.lines), workers,
+                               chunk_size=2)
+        write_results(results, out, fmt)
+        return out.getvalue()
+
+    def test_plain(self):
+        self.assertEqual(self.results("plain"), (
+            "8\n14\nError: float division by zero\n"
+            "Error: invalid token: $ at position 2\n"
+        ))
+
+    def test_csv(self):
+        self.assertEqual(self.results("csv").splitlines()[:3], [
+            "expression,result,error", "3 + 5,8,", "2*(3+4),14,"
+        ])
+
+    def test_box(self):
+        self.assertIn("│  2*(3+4)  │", self.results("box"))
+
+    def test_workers_keep_input_order(self):
+        self.assertEqual(self.results("plain", workers=2),
+                         self.results("plain"))
 
 
 if __name__ == "__main__":
@@ -1,24 +1,119 @@
-from pathlib import Path
+import os
+import tempfile
+import threading
 
+from collections.abc import Iterable
 
-def _is_path_allowed(
-                    file_path: str,
-                    work_dir: str,
-                    ) -> bool:
+# Bound on the resolved directories a Sandbox remembers.
+MAX_CACHED_DIRECTORIES = 4096
+
+
+class Sandbox:
     """
-    Check if file_path is inside work_dir.
+    A working directory the tools are confined to, resolved once.
+
+    Checking a path resolves its parent directory the first time that
+    directory is seen and remembers the result, so the files of one
+    directory, e.g. a batch of reads or the entries of a listing, cost at
+    most one extra lstat each instead of a full realpath. Paths are still
+    resolved for real: `..`, absolute paths and symlinks pointing outside
+    the root are rejected.
+
+    Remembered directories go stale if a directory on the way is replaced,
+    e.g. by a symlink; call invalidate() after anything that may have
+    done so, as run_python_file does after every run.
 
     Args:
-        file_path (str): Absolute or relative path to check.
-        work_dir (str): The root working directory.
-    Returns:
-        bool: True if file_path is within work_dir
+        working_directory(str): The root the sandbox confines paths to.
     """
-    workdir = Path(work_dir).resolve()
-    target = (workdir / file_path).resolve()
 
+    def __init__(self, working_directory: str) -> None:
+        self.working_directory = working_directory
+        self.root = os.path.realpath(working_directory)
+        self._prefix = os.path.join(self.root, "")
+        self._directories: dict[str, str] = {}
+        self._lock = threading.Lock()
+
+    def _resolve_directory(self, directory: str) -> str:
+        real = self._directories.get(directory)
+        if real is None:
+            real = os.path.realpath(os.path.join(self.root, directory))
+            with self._lock:
+                if len(self._directories) >= MAX_CACHED_DIRECTORIES:
+                    self._directories.clear()
+                self._directories[directory] = real
+        return real
+
+    def resolve(self, path: str) -> str | None:
+        """
+        Returns the real path of `path`, relative to the root or absolute,
+        or None if it lies outside the root.
+        """
+        parent, name = os.path.split(path)
+        real = os.path.join(self._resolve_directory(parent), name)
+        if name in ("", ".", "..") or os.path.islink(real):
+            real = os.path.realpath(real)
+        if real == self.root or real.startswith(self._prefix):
+            return real
+        return None
+
+    def validate_many(self, paths: Iterable[str]) -> list[str | None]:
+        """
+        Resolves every path in `paths` like resolve(), sharing the
+        resolution of their common directories.
+        """
+        return [self.resolve(path) for path in paths]
+
+    def invalidate(self) -> None:
+        """
+        Forgets every resolved directory.
+        """
+        with self._lock:
+            self._directories.clear()
+
+
+_sandboxes: dict[str, Sandbox] = {}
+_sandboxes_lock = threading.Lock()
+
+
+def get_sandbox(working_directory: str) -> Sandbox:
+    """
+    Returns the Sandbox of `working_directory`, creating it on first use.
+    """
+    key = os.path.abspath(working_directory)
+    sandbox = _sandboxes.get(key)
+    if sandbox is None:
+        with _sandboxes_lock:
+            sandbox = _sandboxes.setdefault(key, Sandbox(working_directory))
+    return sandbox
+
+
+def write_atomically(
+                     full_path: str,
+                     data: str | bytes,
+                     newline: str | None = ""
+                     ) -> None:
+    """
+    Writes `data` to `full_path`. An existing file is replaced through a
+    temporary file, keeping its mode, so that readers never see it half
+    written.
+    """
+    binary = isinstance(data, bytes)
+    try:
+        mode = os.stat(full_path).st_mode
+    except FileNotFoundError:
+        with (open(full_path, "wb") if binary
+              else open(full_path, "w", newline=newline)) as f:
+            f.write(data)
+        return
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(full_path),
+                                    prefix=".edit-", suffix=".tmp")
     try:
-        target.relative_to(workdir)   # raises ValueError if outside
-        return True
-    except ValueError:
-        return False
+        with (os.fdopen(fd, "wb") if binary
+              else os.fdopen(fd, "w", newline=newline)) as f:
+            f.write(data)
+        os.chmod(tmp_path, mode)
+        os.replace(tmp_path, full_path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
@@ -0,0 +1,86 @@
+import fnmatch
+import os
+
+
+class GitIgnore:
+    """
+    Matches paths against .gitignore style patterns.
+
+    Supports comments, `!` negation, a trailing `/` for directory-only
+    patterns, a leading `/` or an inner `/` anchoring the pattern to the
+    directory of its .gitignore, and a leading `**/`. Later rules win over
+    earlier ones, as in git.
+    """
+
+    def __init__(self) -> None:
+        # (base directory, pattern, negated, directory only, anchored)
+        self._rules: list[tuple[str, str, bool, bool, bool]] = []
+
+    def add_patterns(self, patterns: list[str], base: str = "") -> None:
+        """
+        Adds patterns that apply to paths under `base`, a directory
+        relative to the root the matched paths are relative to.
+        """
+        for line in patterns:
+            pattern = line.rstrip("\n").rstrip()
+            if not pattern or pattern.startswith("#"):
+                continue
+            negated = pattern.startswith("!")
+            pattern = pattern.lstrip("!")
+            dir_only = pattern.endswith("/")
+            pattern = pattern.rstrip("/")
+            if pattern.startswith("**/"):
+                pattern = pattern[3:]
+            anchored = "/" in pattern
+            pattern = pattern.lstrip("/")
+            if pattern:
+                self._rules.append((base, pattern, negated, dir_only,
+                                    anchored))
+
+    def add_file(self, path: str, base: str = "") -> None:
+        """
+        Adds the patterns of the .gitignore at `path` if there is one.
+        """
+        try:
+            with open(path, "r") as f:
+                self.add_patterns(f.readlines(), base)
+        except OSError:
+            pass
+
+    def ignored(self, rel_path: str, is_dir: bool) -> bool:
+        """
+        Tells whether `rel_path`, using '/' separators, is ignored.
+        """
+        ignored = False
+        for base, pattern, negated, dir_only, anchored in self._rules:
+            if dir_only and not is_dir:
+                continue
+            if base:
+                if not rel_path.startswith(base + "/"):
+                    continue
+                target = rel_path[len(base) + 1:]
+            else:
+                target = rel_path
+            if not anchored:
+                target = target.rsplit("/", 1)[-1]
+            if fnmatch.fnmatchcase(target, pattern):
+                ignored = not negated
+        return ignored
+
+
+def load_gitignore(working_directory: str, directory: str) -> GitIgnore:
+    """
+    Collects the .gitignore files of the working directory and of every
+    directory from it down to `directory`.
+    """
+    gitignore = GitIgnore()
+    gitignore.add_patterns([".git/"])
+    base = ""
+    gitignore.add_file(os.path.join(working_directory, ".gitignore"))
+    for part in os.path.normpath(directory).split(os.sep):
+        if part in ("", "."):
+            continue
+        base = f"{base}/{part}" if base else part
+        gitignore.add_file(os.path.join(working_directory, base, ".gitignore"),
+                           base)
+    return gitignore
@@ -0,0 +1,159 @@
+"""
+Pool of warm Python interpreters for run_python_file.
+
+Starting a fresh interpreter and re-importing unittest and friends costs
+tens of milliseconds per run. Each pool keeps a few workers
+(functions/_warm_worker.py) per working directory that have already
+imported PRELOAD_MODULES; a run is forked from an idle worker, so it starts
+with those imports done while the worker itself is never modified by it.
+
+Only standard library modules are preloaded: anything from the working
+directory could be rewritten by the agent and must be imported fresh.
+"""
+import atexit
+import json
+import os
+import queue
+import subprocess
+import sys
+import threading
+
+from functions._process import ProcessResult
+
+# The worker is run as a module from the directory holding `functions`.
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_POOL_SIZE = 2
+PRELOAD_MODULES = (
+    "argparse",
+    "collections",
+    "dataclasses",
+    "json",
+    "math",
+    "re",
+    "typing",
+    "unittest",
+)
+
+
+def is_supported() -> bool:
+    """
+    Tells whether runs can be forked from warm workers on this platform.
+    """
+    return hasattr(os, "fork")
+
+
+class _Worker:
+    def __init__(self, working_directory: str) -> None:
+        self.process = subprocess.Popen(
+            [sys.executable, "-m", "functions._warm_worker",
+             os.path.abspath(working_directory), *PRELOAD_MODULES],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            cwd=ROOT,
+            text=True,
+        )
+        self._ready = False
+
+    def run(self, file_path: str, args: list[str], timeout: float,
+            keep: int) -> ProcessResult:
+        assert self.process.stdin is not None
+        assert self.process.stdout is not None
+        if not self._ready:
+            # Reading the greeting waits for the preloading to finish.
+            json.loads(self.process.stdout.readline())
+            self._ready = True
+        request = {"file_path": file_path, "args": args,
+                   "timeout": timeout, "keep": keep}
+        self.process.stdin.write(json.dumps(request) + "\n")
+        self.process.stdin.flush()
+        line = self.process.stdout.readline()
+        if not line:
+            raise RuntimeError("warm interpreter exited unexpectedly")
+        return ProcessResult(**json.loads(line))
+
+    def close(self) -> None:
+        if self.process.stdin is not None:
+            self.process.stdin.close()
+        try:
+            self.process.wait(timeout=1)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+
+
+class InterpreterPool:
+    """
+    Warm workers for one working directory, all started up front. Up to
+    `size` runs go on at once; further runs wait for a free worker.
+
+    Args:
+        working_directory(str): Directory runs are started in.
+        size(int): Number of warm workers to keep.
+    """
+
+    def __init__(
+                 self,
+                 working_directory: str,
+                 size: int = DEFAULT_POOL_SIZE
+                 ) -> None:
+        self.working_directory = working_directory
+        self._idle: queue.SimpleQueue[_Worker] = queue.SimpleQueue()
+        for _ in range(max(1, size)):
+            self._idle.put(_Worker(working_directory))
+
+    def run(self, file_path: str, args: list[str], timeout: float,
+            keep: int) -> ProcessResult:
+        """
+        Runs `file_path` relative to the working directory with `args` as
+        its arguments, like functions._process.run_process would run
+        `python file_path *args`, with the same timeout and capture limits.
+        """
+        worker = self._idle.get()
+        try:
+            result = worker.run(file_path, args, timeout, keep)
+        except BaseException:
+            # A broken worker is replaced instead of handed out again.
+            worker.close()
+            worker = _Worker(self.working_directory)
+            raise
+        finally:
+            self._idle.put(worker)
+        return result
+
+    def close(self) -> None:
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+_pools: dict[str, InterpreterPool] = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(
+             working_directory: str,
+             size: int = DEFAULT_POOL_SIZE
+             ) -> InterpreterPool:
+    """
+    Returns the pool for `working_directory`, starting it on first use.
+    """
+    key = os.path.realpath(working_directory)
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = _pools[key] = InterpreterPool(working_directory, size)
+        return pool
+
+
+@atexit.register
+def close_pools() -> None:
+    """
+    Stops every worker of every pool.
+    """
+    with _pools_lock:
+        for pool in _pools.values():
+            pool.close()
+        _pools.clear()
@@ -0,0 +1,69 @@
+import mmap
+import os
+import threading
+
+from array import array
+from collections import OrderedDict
+
+# Number of files whose line index is kept in memory.
+MAX_INDEXED_FILES = 32
+
+_lock = threading.Lock()
+_indexes: OrderedDict[str, tuple[tuple[int, int], array]] = OrderedDict()
+
+
+def line_offsets(path: str) -> array:
+    """
+    Returns the byte offset at which every line of a file starts.
+
+    The index is built once with a memory-mapped scan and cached until the
+    file's mtime or size changes, so later lookups cost a single stat.
+
+    Args:
+        path(str): Path of the file to index.
+
+    Returns:
+        array: Offsets of the start of line 1, 2, ... in bytes.
+    """
+    st = os.stat(path)
+    state = (st.st_mtime_ns, st.st_size)
+    key = os.path.realpath(path)
+    with _lock:
+        cached = _indexes.get(key)
+        if cached is not None and cached[0] == state:
+            _indexes.move_to_end(key)
+            return cached[1]
+
+    offsets = array("q", [0])
+    if st.st_size:
+        with (
+            open(path, "rb") as f,
+            mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm,
+        ):
+            pos = mm.find(b"\n")
+            while pos != -1:
+                offsets.append(pos + 1)
+                pos = mm.find(b"\n", pos + 1)
+        # A trailing newline ends the last line rather than starting one.
+        if offsets[-1] == st.st_size:
+            offsets.pop()
+
+    with _lock:
+        _indexes[key] = (state, offsets)
+        _indexes.move_to_end(key)
+        while len(_indexes) > MAX_INDEXED_FILES:
+            _indexes.popitem(last=False)
+    return offsets
+
+
+def read_bytes(path: str, start: int, end: int) -> bytes:
+    """
+    Reads bytes [start, end) of a file through a memory map, so the cost
+    does not depend on how far into the file the window is.
+    """
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if start >= size or end <= start:
+            return b""
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            return mm[start:min(end, size)]
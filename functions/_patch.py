@@ -0,0 +1,196 @@
+"""
+Applying search/replace blocks and unified diffs to text.
+
+Both raise ValueError with a message meant for the model when an edit does
+not apply cleanly, e.g. because its text is missing from the file or
+matches in more than one place.
+"""
+import re
+
+SEARCH_MARKER = "<<<<<<< SEARCH"
+DIVIDER = "======="
+REPLACE_MARKER = ">>>>>>> REPLACE"
+
+_HUNK_HEADER = re.compile(r"^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@")
+
+
+def parse_blocks(blocks: str) -> list[tuple[str, str]]:
+    """
+    Parses search/replace blocks of the form
+
+        <<<<<<< SEARCH
+        text to find
+        =======
+        text to put in its place
+        >>>>>>> REPLACE
+
+    into (search, replace) pairs. Text outside the blocks is ignored.
+    """
+    edits = []
+    lines = blocks.splitlines(keepends=True)
+    i = 0
+    while i < len(lines):
+        if lines[i].rstrip() != SEARCH_MARKER:
+            i += 1
+            continue
+        search: list[str] = []
+        replace: list[str] = []
+        target = search
+        i += 1
+        while i < len(lines) and lines[i].rstrip() != REPLACE_MARKER:
+            if target is search and lines[i].rstrip() == DIVIDER:
+                target = replace
+            else:
+                target.append(lines[i])
+            i += 1
+        if i == len(lines) or target is search:
+            raise ValueError(f"edit {len(edits) + 1} is not closed with "
+                             f"'{DIVIDER}' and '{REPLACE_MARKER}'")
+        edits.append(("".join(search), "".join(replace)))
+        i += 1
+    if not edits:
+        raise ValueError(f"no '{SEARCH_MARKER}' blocks found")
+    return edits
+
+
+def apply_blocks(text: str, edits: list[tuple[str, str]]) -> str:
+    """
+    Applies each (search, replace) edit in turn. Every search text must
+    occur exactly once in the text as left by the edits before it.
+    """
+    for number, (search, replace) in enumerate(edits, start=1):
+        if not search:
+            raise ValueError(f"edit {number} has an empty search text")
+        count = text.count(search)
+        if count == 0:
+            # The file's last line has no newline, but the block's does.
+            # Only the end of the file can match then, even if the text
+            # also occurs earlier followed by something else.
+            tail = search.removesuffix("\n")
+            if tail == search or not tail or not text.endswith(tail):
+                raise ValueError(f"edit {number}: search text not found, "
+                                 "it must match the file exactly")
+            text = text[:len(text) - len(tail)] + replace.removesuffix("\n")
+            continue
+        if count > 1:
+            raise ValueError(f"edit {number}: search text matches {count} "
+                             "places, include more surrounding lines")
+        text = text.replace(search, replace, 1)
+    return text
+
+
+def _parse_hunks(diff: str) -> list[tuple[int, list[str], list[str]]]:
+    """
+    Returns (old start line, old lines, new lines) for each hunk of a
+    unified diff. A hunk ends once it has as many old and new lines as its
+    header counts; file headers and other text between hunks are ignored.
+    """
+    hunks: list[tuple[int, list[str], list[str]]] = []
+    old: list[str] = []
+    new: list[str] = []
+    # Old and new lines the current hunk still has to have.
+    old_left = new_left = 0
+    for line in diff.splitlines(keepends=True):
+        if line.startswith("\\"):
+            # "\ No newline at end of file" applies to the line before.
+            for lines in (old, new):
+                if lines and lines[-1].endswith("\n"):
+                    lines[-1] = lines[-1][:-1]
+            continue
+        header = _HUNK_HEADER.match(line)
+        if old_left > 0 or new_left > 0:
+            if header:
+                raise ValueError(f"hunk {len(hunks)}: its header counts "
+                                 "more lines than it has")
+            # Inside a hunk, "--- x" removes the line "-- x".
+            if line.startswith("-"):
+                old.append(line[1:])
+                old_left -= 1
+            elif line.startswith("+"):
+                new.append(line[1:])
+                new_left -= 1
+            else:
+                # Editors often strip the leading space of empty context
+                # lines.
+                body = line[1:] if line.startswith(" ") else line
+                old.append(body)
+                new.append(body)
+                old_left -= 1
+                new_left -= 1
+            if old_left < 0 or new_left < 0:
+                raise ValueError(f"hunk {len(hunks)}: its header counts "
+                                 "fewer lines than it has")
+        elif header:
+            old, new = [], []
+            old_left = int(header.group(2) or "1")
+            new_left = int(header.group(4) or "1")
+            hunks.append((int(header.group(1)), old, new))
+        elif (
+            hunks
+            and line.startswith((" ", "-", "+"))
+            and not line.startswith(("--- ", "+++ "))
+        ):
+            raise ValueError(f"hunk {len(hunks)}: its header counts fewer "
+                             "lines than it has")
+    if old_left > 0 or new_left > 0:
+        raise ValueError(f"hunk {len(hunks)}: its header counts more lines "
+                         "than it has")
+    if not hunks:
+        raise ValueError("no '@@ -a,b +c,d @@' hunks found in diff")
+    return hunks
+
+
+def _find(lines: list[str], block: list[str], start: int) -> list[int]:
+    first = block[0]
+    return [
+        i for i in range(start, len(lines) - len(block) + 1)
+        if lines[i] == first and lines[i:i + len(block)] == block
+    ]
+
+
+def apply_diff(text: str, diff: str) -> str:
+    """
+    Applies the hunks of a unified diff in order. The old lines of a hunk
+    may sit elsewhere than its header says, but must either match exactly
+    once after the previous hunk or match at the stated line.
+    """
+    lines = text.splitlines(keepends=True)
+    # Lines are compared with their newline; the file's last line gets one
+    # for that and the diff decides whether it keeps it.
+    ends_in_newline = not lines or lines[-1].endswith("\n")
+    if not ends_in_newline:
+        lines[-1] += "\n"
+    result: list[str] = []
+    position = 0
+    for number, (old_start, old, new) in enumerate(_parse_hunks(diff),
+                                                   start=1):
+        old = [o if o.endswith("\n") else o + "\n" for o in old]
+        new_ends_in_newline = not new or new[-1].endswith("\n")
+        new = [n if n.endswith("\n") else n + "\n" for n in new]
+        if not old:
+            # A pure insertion goes after line `old_start`.
+            at = old_start
+            if at < position or at > len(lines):
+                raise ValueError(f"hunk {number}: line {old_start} is out "
+                                 "of range")
+        else:
+            matches = _find(lines, old, position)
+            if not matches:
+                raise ValueError(f"hunk {number}: its context and removed "
+                                 "lines do not match the file")
+            if len(matches) > 1:
+                if old_start - 1 not in matches:
+                    raise ValueError(f"hunk {number}: matches {len(matches)} "
+                                     "places, include more context lines")
+                matches = [old_start - 1]
+            at = matches[0]
+        result += lines[position:at]
+        result += new
+        position = at + len(old)
+        if position == len(lines) and new:
+            ends_in_newline = new_ends_in_newline
+    result += lines[position:]
+    patched = "".join(result)
+    if not ends_in_newline and patched.endswith("\n"):
+        patched = patched[:-1]
+    return patched
@@ -0,0 +1,192 @@
+"""
+Bounded, thread-safe execution of child processes.
+
+Output is read from non-blocking pipes as it is produced and only the
+first and last `keep` bytes of each stream are held in memory. Timeouts
+are enforced per process by polling its exit status against a deadline,
+never with signals, so runs can be started from any thread. The exit
+status is collected with wait4, which also reports the peak RSS.
+
+Only POSIX systems are supported, as before.
+"""
+import dataclasses
+import os
+import selectors
+import signal
+import subprocess
+import sys
+import time
+
+from typing import Callable
+
+READ_CHUNK_BYTES = 65_536
+
+
+@dataclasses.dataclass
+class ProcessResult:
+    """
+    Outcome of one run. `returncode` is None if the run was killed at its
+    timeout; `peak_rss` is in bytes, None where it is unknown.
+    """
+    returncode: int | None
+    stdout: str
+    stderr: str
+    elapsed: float
+    peak_rss: int | None = None
+
+    @property
+    def timed_out(self) -> bool:
+        return self.returncode is None
+
+
+# Called with the command and result of every finished run, e.g. to trace
+# them. See add_observer.
+_observers: list[Callable[[list[str], ProcessResult], None]] = []
+
+
+def add_observer(
+                 observer: Callable[[list[str], ProcessResult], None]
+                 ) -> None:
+    """
+    Has `observer` called, on the thread that made the run, with the
+    command and result of every run reported through notify.
+    """
+    if observer not in _observers:
+        _observers.append(observer)
+
+
+def notify(cmd: list[str], result: ProcessResult) -> None:
+    for observer in list(_observers):
+        observer(cmd, result)
+
+
+class Capture:
+    """
+    Keeps the first and last `keep` bytes of a stream fed to it and counts
+    the bytes in between.
+    """
+
+    def __init__(self, keep: int) -> None:
+        self.keep = keep
+        self.head = bytearray()
+        self.tail = bytearray()
+        self.total = 0
+
+    def feed(self, data: bytes) -> None:
+        self.total += len(data)
+        room = self.keep - len(self.head)
+        if room > 0:
+            self.head += data[:room]
+            data = data[room:]
+        if data:
+            self.tail += data
+            if len(self.tail) > self.keep:
+                del self.tail[:len(self.tail) - self.keep]
+
+    @property
+    def elided(self) -> int:
+        return self.total - len(self.head) - len(self.tail)
+
+    def text(self) -> str:
+        if not self.elided:
+            return (self.head + self.tail).decode(errors="replace")
+        return (f"{self.head.decode(errors='replace')}\n"
+                f"[...{self.elided} bytes elided...]\n"
+                f"{self.tail.decode(errors='replace')}")
+
+
+def _peak_rss(usage) -> int:
+    # ru_maxrss is in kilobytes on Linux but in bytes on macOS.
+    return usage.ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+
+
+def wait_process(pid: int, deadline: float) -> tuple[int | None, int]:
+    """
+    Waits for child `pid` to exit, killing it at `deadline` (a
+    time.monotonic value).
+
+    Returns:
+        tuple[int | None, int]: The exit code, or None if it was killed,
+                                and the peak RSS in bytes.
+    """
+    delay = 0.0005
+    while True:
+        done, status, usage = os.wait4(pid, os.WNOHANG)
+        if done:
+            return os.waitstatus_to_exitcode(status), _peak_rss(usage)
+        if time.monotonic() >= deadline:
+            os.kill(pid, signal.SIGKILL)
+            _, status, usage = os.wait4(pid, 0)
+            return None, _peak_rss(usage)
+        time.sleep(delay)
+        delay = min(delay * 2, 0.01)
+
+
+def capture_pipes(
+                  fds: list[int],
+                  deadline: float,
+                  keep: int
+                  ) -> list[Capture]:
+    """
+    Reads the pipes `fds` as data arrives, until every one is closed or
+    `deadline` (a time.monotonic value) passes, keeping at most `keep`
+    bytes from each end of each.
+    """
+    captures = {fd: Capture(keep) for fd in fds}
+    with selectors.DefaultSelector() as selector:
+        for fd in captures:
+            os.set_blocking(fd, False)
+            selector.register(fd, selectors.EVENT_READ)
+        while selector.get_map():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            for key, _ in selector.select(remaining):
+                try:
+                    data = os.read(key.fd, READ_CHUNK_BYTES)
+                except BlockingIOError:
+                    continue
+                if data:
+                    captures[key.fd].feed(data)
+                else:
+                    selector.unregister(key.fd)
+    return list(captures.values())
+
+
+def run_process(
+                cmd: list[str],
+                cwd: str,
+                timeout: float,
+                keep: int
+                ) -> ProcessResult:
+    """
+    Runs `cmd` in `cwd` with no stdin, capturing at most `keep` bytes from
+    each end of its stdout and stderr, and kills it after `timeout`
+    seconds.
+    """
+    start = time.monotonic()
+    deadline = start + timeout
+    process = subprocess.Popen(cmd,
+                               cwd=cwd,
+                               stdin=subprocess.DEVNULL,
+                               stdout=subprocess.PIPE,
+                               stderr=subprocess.PIPE)
+    assert process.stdout is not None and process.stderr is not None
+    try:
+        stdout, stderr = capture_pipes([process.stdout.fileno(),
+                                        process.stderr.fileno()],
+                                       deadline, keep)
+        returncode, peak_rss = wait_process(process.pid, deadline)
+        # The status was reaped above, tell Popen so it does not try again.
+        process.returncode = -9 if returncode is None else returncode
+    finally:
+        if process.returncode is None:
+            process.kill()
+            process.wait()
+        process.stdout.close()
+        process.stderr.close()
+    return ProcessResult(returncode=returncode,
+                         stdout=stdout.text(),
+                         stderr=stderr.text(),
+                         elapsed=time.monotonic() - start,
+                         peak_rss=peak_rss)
@@ -0,0 +1,276 @@
+import os
+import re
+import threading
+import time
+
+from functions._gitignore import GitIgnore
+from functions._gitignore import load_gitignore
+
+# Files larger than this are not indexed or searched.
+MAX_INDEXED_FILE_SIZE = 1_000_000
+# How often, in seconds, a query re-checks the mtimes of the whole tree.
+# Writes through write_file update the index straight away, and a query
+# after run_python_file always rescans.
+RESCAN_INTERVAL = 2.0
+_BINARY_SNIFF_BYTES = 8192
+# A {m}, {m,} or {m,n} quantifier, possibly lazy or possessive.
+_REPEAT = re.compile(r"\{\d*(?:,\d*)?\}[?+]?")
+
+
+def trigrams(text: str) -> set[str]:
+    text = text.lower()
+    # Zipping shifted copies is faster than slicing at every offset.
+    return set(map("".join, zip(text, text[1:], text[2:])))
+
+
+def required_literals(pattern: str) -> list[str]:
+    """
+    Returns substrings every match of the regular expression must contain.
+
+    Conservative: only literal runs outside groups count, a character
+    followed by a quantifier is dropped, and any alternation gives up.
+    """
+    if "|" in pattern:
+        return []
+    runs = []
+    run = ""
+    depth = 0
+    i = 0
+    while i < len(pattern):
+        c = pattern[i]
+        if c == "\\" and i + 1 < len(pattern):
+            nxt = pattern[i + 1]
+            if nxt.isalnum():
+                runs.append(run)
+                run = ""
+            elif depth == 0:
+                run += nxt
+            i += 2
+            continue
+        if c in "*?":
+            run = run[:-1]
+            runs.append(run)
+            run = ""
+        elif c == "{":
+            repeat = _REPEAT.match(pattern, i)
+            if repeat is not None:
+                # The quantified atom may repeat zero times; the counts are
+                # not part of the match.
+                run = run[:-1]
+                i = repeat.end() - 1
+            runs.append(run)
+            run = ""
+        elif c == "+":
+            runs.append(run)
+            run = ""
+        elif c == "[":
+            runs.append(run)
+            run = ""
+            # A "]" straight after "[" or "[^" is literal, as is an escaped
+            # one anywhere in the class.
+            i += 1
+            if pattern.startswith("^", i):
+                i += 1
+            if pattern.startswith("]", i):
+                i += 1
+            while i < len(pattern) and pattern[i] != "]":
+                i += 2 if pattern[i] == "\\" else 1
+        elif c == "(":
+            runs.append(run)
+            run = ""
+            depth += 1
+        elif c == ")":
+            depth = max(0, depth - 1)
+        elif c in ".^$":
+            runs.append(run)
+            run = ""
+        elif depth == 0:
+            run += c
+        i += 1
+    runs.append(run)
+    return [r for r in runs if len(r) >= 3]
+
+
+class TrigramIndex:
+    """
+    Trigram index of the text files under a working directory.
+
+    Maps every lowercased three character sequence to the files containing
+    it, so a query only has to scan the files holding all of its trigrams.
+    The index is built on first use and then kept up to date one file at a
+    time, from write_file notifications and from a throttled rescan of
+    mtimes and sizes.
+    """
+
+    def __init__(self, working_directory: str) -> None:
+        self.working_directory = working_directory
+        self._lock = threading.RLock()
+        self._ids: dict[str, int] = {}
+        self._paths: dict[int, str] = {}
+        self._states: dict[int, tuple[int, int]] = {}
+        self._file_trigrams: dict[int, set[str]] = {}
+        self._postings: dict[str, set[int]] = {}
+        self._next_id = 0
+        self._scanned_at: float | None = None
+
+    def _read_text(self, rel_path: str) -> str | None:
+        full_path = os.path.join(self.working_directory, rel_path)
+        with open(full_path, "rb") as f:
+            data = f.read(MAX_INDEXED_FILE_SIZE + 1)
+        if (
+            len(data) > MAX_INDEXED_FILE_SIZE
+            or b"\0" in data[:_BINARY_SNIFF_BYTES]
+        ):
+            return None
+        return data.decode("utf-8", errors="replace")
+
+    def _remove(self, rel_path: str) -> None:
+        file_id = self._ids.pop(rel_path, None)
+        if file_id is None:
+            return
+        del self._paths[file_id]
+        del self._states[file_id]
+        for trigram in self._file_trigrams.pop(file_id):
+            postings = self._postings[trigram]
+            postings.discard(file_id)
+            if not postings:
+                del self._postings[trigram]
+
+    def update_file(self, rel_path: str) -> None:
+        """
+        Re-indexes one file, or drops it if it is gone or not text.
+        """
+        rel_path = os.path.normpath(rel_path).replace(os.sep, "/")
+        full_path = os.path.join(self.working_directory, rel_path)
+        with self._lock:
+            self._remove(rel_path)
+            try:
+                st = os.stat(full_path)
+                text = self._read_text(rel_path)
+            except OSError:
+                return
+            if text is None:
+                return
+            file_id = self._next_id
+            self._next_id += 1
+            self._ids[rel_path] = file_id
+            self._paths[file_id] = rel_path
+            self._states[file_id] = (st.st_mtime_ns, st.st_size)
+            file_trigrams = trigrams(text)
+            self._file_trigrams[file_id] = file_trigrams
+            for trigram in file_trigrams:
+                self._postings.setdefault(trigram, set()).add(file_id)
+
+    def _scan(self) -> dict[str, tuple[int, int]]:
+        gitignore: GitIgnore = load_gitignore(self.working_directory, ".")
+        found = {}
+        stack = [""]
+        while stack:
+            rel_dir = stack.pop()
+            if rel_dir:
+                gitignore.add_file(os.path.join(self.working_directory,
+                                                rel_dir, ".gitignore"),
+                                   rel_dir)
+            with os.scandir(os.path.join(self.working_directory,
+                                         rel_dir)) as it:
+                for entry in it:
+                    rel_path = (f"{rel_dir}/{entry.name}" if rel_dir
+                                else entry.name)
+                    is_dir = entry.is_dir(follow_symlinks=False)
+                    if gitignore.ignored(rel_path, is_dir):
+                        continue
+                    if is_dir:
+                        stack.append(rel_path)
+                    elif entry.is_file(follow_symlinks=False):
+                        st = entry.stat(follow_symlinks=False)
+                        if st.st_size <= MAX_INDEXED_FILE_SIZE:
+                            found[rel_path] = (st.st_mtime_ns, st.st_size)
+        return found
+
+    def refresh(self, force: bool = False) -> None:
+        """
+        Re-indexes files whose mtime or size changed and drops deleted
+        ones, at most once every RESCAN_INTERVAL seconds unless forced.
+        """
+        with self._lock:
+            now = time.monotonic()
+            if (
+                not force
+                and self._scanned_at is not None
+                and now - self._scanned_at < RESCAN_INTERVAL
+            ):
+                return
+            found = self._scan()
+            for rel_path in list(self._ids):
+                if rel_path not in found:
+                    self._remove(rel_path)
+            for rel_path, state in found.items():
+                file_id = self._ids.get(rel_path)
+                if file_id is None or self._states[file_id] != state:
+                    self.update_file(rel_path)
+            self._scanned_at = now
+
+    def invalidate(self) -> None:
+        """
+        Makes the next refresh rescan the tree, e.g. after a script that
+        may have written anywhere in it.
+        """
+        with self._lock:
+            self._scanned_at = None
+
+    def candidates(self, literals: list[str]) -> list[str]:
+        """
+        Returns the indexed files that contain every trigram of every
+        literal, in path order. With no usable literal that is all files.
+        """
+        with self._lock:
+            needed = set().union(*(trigrams(lit) for lit in literals))
+            if not needed:
+                return sorted(self._ids)
+            # Intersect the rarest postings first to stay small.
+            postings = sorted((self._postings.get(t, set()) for t in needed),
+                              key=len)
+            file_ids = set(postings[0])
+            for other in postings[1:]:
+                if not file_ids:
+                    break
+                file_ids &= other
+            return sorted(self._paths[i] for i in file_ids)
+
+
+_indexes_lock = threading.Lock()
+_indexes: dict[str, TrigramIndex] = {}
+
+
+def get_index(working_directory: str) -> TrigramIndex:
+    """
+    Returns the shared index of `working_directory`, creating it if needed.
+    """
+    key = os.path.realpath(working_directory)
+    with _indexes_lock:
+        index = _indexes.get(key)
+        if index is None:
+            index = _indexes[key] = TrigramIndex(key)
+        return index
+
+
+def notify_write(working_directory: str, file_path: str) -> None:
+    """
+    Updates the index of `working_directory`, if one was built, after
+    `file_path` was written.
+    """
+    with _indexes_lock:
+        index = _indexes.get(os.path.realpath(working_directory))
+    if index is not None:
+        index.update_file(file_path)
+
+
+def invalidate_index(working_directory: str) -> None:
+    """
+    Makes the index of `working_directory`, if one was built, rescan the
+    tree on its next query.
+    """
+    with _indexes_lock:
+        index = _indexes.get(os.path.realpath(working_directory))
+    if index is not None:
+        index.invalidate()
@@ -0,0 +1,109 @@
+"""
+Warm interpreter worker used by functions._interpreter_pool.
+
+Started as `python -m functions._warm_worker WORKING_DIRECTORY MODULE...`,
+it imports the modules, reports that it is ready and then serves run
+requests, one JSON object per line on stdin. Every request is run in a
+child forked from this warm process, so it starts with the preloaded
+modules already imported, and the worker stays clean for the next run.
+The outcome, a functions._process.ProcessResult, is written back as one
+JSON line on stdout.
+"""
+import dataclasses
+import importlib
+import json
+import os
+import runpy
+import sys
+import time
+import traceback
+
+from functions._process import ProcessResult
+from functions._process import capture_pipes
+from functions._process import wait_process
+
+
+def _run_child(file_path: str, args: list[str], out_fd: int,
+               err_fd: int) -> None:
+    devnull = os.open(os.devnull, os.O_RDONLY)
+    os.dup2(devnull, 0)
+    os.dup2(out_fd, 1)
+    os.dup2(err_fd, 2)
+    os.close(out_fd)
+    os.close(err_fd)
+    code = 0
+    try:
+        # The worker's own modules are not the script's to see; a
+        # `functions` package in the working directory must win.
+        for name in list(sys.modules):
+            if name == "functions" or name.startswith("functions."):
+                del sys.modules[name]
+        sys.argv = [file_path, *args]
+        sys.path[0] = os.path.dirname(os.path.abspath(file_path))
+        runpy.run_path(file_path, run_name="__main__")
+    except SystemExit as e:
+        if e.code is None:
+            code = 0
+        elif isinstance(e.code, int):
+            code = e.code
+        else:
+            print(e.code, file=sys.stderr)
+            code = 1
+    except BaseException:
+        traceback.print_exc()
+        code = 1
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os._exit(code)
+
+
+def _serve(request: dict) -> ProcessResult:
+    # Pipes, read as the child writes, hold only what capture_pipes keeps,
+    # however much a runaway script prints.
+    out_read, out_write = os.pipe()
+    err_read, err_write = os.pipe()
+    start = time.monotonic()
+    deadline = start + request["timeout"]
+    try:
+        try:
+            pid = os.fork()
+            if pid == 0:
+                os.close(out_read)
+                os.close(err_read)
+                _run_child(request["file_path"], request["args"],
+                           out_write, err_write)
+        finally:
+            # _run_child never returns, so only the worker gets here.
+            os.close(out_write)
+            os.close(err_write)
+        stdout, stderr = capture_pipes([out_read, err_read], deadline,
+                                       request["keep"])
+        returncode, peak_rss = wait_process(pid, deadline)
+    finally:
+        os.close(out_read)
+        os.close(err_read)
+    return ProcessResult(returncode=returncode,
+                         stdout=stdout.text(),
+                         stderr=stderr.text(),
+                         elapsed=time.monotonic() - start,
+                         peak_rss=peak_rss)
+
+
+def main() -> None:
+    os.chdir(sys.argv[1])
+    for name in sys.argv[2:]:
+        try:
+            importlib.import_module(name)
+        except ImportError:
+            pass
+    channel = sys.stdout
+    print(json.dumps({"ready": True}), file=channel, flush=True)
+    for line in sys.stdin:
+        result = _serve(json.loads(line))
+        print(json.dumps(dataclasses.asdict(result)), file=channel,
+              flush=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -1 +1,4 @@
 FILE_CHAR_LIMIT = 10_000
+LIST_PAGE_SIZE = 200
+# Bytes kept from each end of a run's stdout and stderr.
+RUN_CAPTURE_BYTES = 4_096
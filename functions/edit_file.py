@@ -0,0 +1,102 @@
+import difflib
+import os
+import re
+
+from functions._filepath_helpers import get_sandbox
+from functions._filepath_helpers import write_atomically
+from functions._patch import apply_blocks
+from functions._patch import apply_diff
+from functions._patch import parse_blocks
+from functions._trigram_index import notify_write
+
+_HUNK = re.compile(r"^@@ ", re.MULTILINE)
+
+
+def _changed_lines(before: str, after: str) -> str:
+    """
+    Describes where `after` differs from `before`, in lines of `after`,
+    e.g. "lines 14, 50-52 changed; 2 lines removed at line 60".
+    """
+    changed = []
+    removed = []
+    matcher = difflib.SequenceMatcher(None, before.splitlines(),
+                                      after.splitlines(), autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == "equal":
+            continue
+        if j2 > j1 + 1:
+            changed.append(f"{j1 + 1}-{j2}")
+        elif j2 == j1 + 1:
+            changed.append(f"{j1 + 1}")
+        else:
+            lines = "line" if i2 - i1 == 1 else "lines"
+            removed.append(f"{i2 - i1} {lines} removed at line {j1 + 1}")
+    description = []
+    if changed:
+        single = len(changed) == 1 and "-" not in changed[0]
+        lines = "line" if single else "lines"
+        description.append(f"{lines} {', '.join(changed)} changed")
+    return "; ".join(description + removed)
+
+
+def edit_file(working_directory: str,
+              file_path: str,
+              blocks: str | None = None,
+              diff: str | None = None) -> str:
+    """
+    Edit part of an existing file instead of rewriting all of it. Pass
+    either search/replace blocks or a unified diff. Every block's search
+    text must match the file exactly once.
+
+    Args:
+        working_directory(str): Path of the current working directory.
+        file_path(str): The path to the file to edit, relative to the
+                        working directory.
+        blocks(str | None): One or more blocks, each made of a line
+                            '<<<<<<< SEARCH', the exact lines to replace, a
+                            line '=======', the new lines and a line
+                            '>>>>>>> REPLACE'.
+        diff(str | None): A unified diff of the file with '@@ -a,b +c,d @@'
+                          hunks, as an alternative to blocks. Each hunk
+                          must have the b old and d new lines its header
+                          counts.
+
+    Returns:
+        str: The changed line ranges of the file or an error message.
+    """
+    try:
+        full_path = get_sandbox(working_directory).resolve(file_path)
+        if full_path is None:
+            return (f"Error: Cannot edit '{file_path}' as it "
+                    "is outside the permitted working directory")
+        if (blocks is None) == (diff is None):
+            return "Error: pass exactly one of blocks and diff"
+        if not os.path.isfile(full_path):
+            return ("Error: File not found or is not a regular file: "
+                    f'"{file_path}"')
+        with open(full_path, "r", newline="") as f:
+            before = f.read()
+        # Edits are matched and applied with plain newlines.
+        crlf = "\r\n" in before
+        text = before.replace("\r\n", "\n")
+        if blocks is not None:
+            edits = parse_blocks(blocks.replace("\r\n", "\n"))
+            after = apply_blocks(text, edits)
+            count = len(edits)
+        else:
+            assert diff is not None
+            after = apply_diff(text, diff.replace("\r\n", "\n"))
+            count = len(_HUNK.findall(diff))
+        if after == text:
+            return f"No changes made to '{file_path}'"
+        changed = _changed_lines(text, after)
+        write_atomically(full_path,
+                         after.replace("\n", "\r\n") if crlf else after)
+        notify_write(working_directory, file_path)
+        edits_word = "edit" if count == 1 else "edits"
+        return (f"Successfully edited '{file_path}' ({count} {edits_word}): "
+                f"{changed}")
+    except ValueError as e:
+        return f"Error: cannot edit '{file_path}': {e}"
+    except Exception as e:
+        return f"Error: {e}"
@@ -1,42 +1,135 @@
+import bisect
 import os
 
-from functions._filepath_helpers import _is_path_allowed
+from functions._filepath_helpers import get_sandbox
+from functions._line_index import line_offsets
+from functions._line_index import read_bytes
 from functions.config import FILE_CHAR_LIMIT
 
 
-def get_file_content(working_directory: str, file_path: str) -> str:
+def _read_window(
+                 full_path: str,
+                 file_path: str,
+                 offset: int | None,
+                 length: int | None,
+                 start_line: int | None,
+                 end_line: int | None
+                 ) -> str:
+    size = os.path.getsize(full_path)
+    if start_line is None and end_line is None:
+        start = offset or 0
+        if start < 0 or (length is not None and length < 0):
+            return "Error: offset and length must not be negative"
+        end = start + min(length or FILE_CHAR_LIMIT, FILE_CHAR_LIMIT)
+        content = read_bytes(full_path, start, end)
+        text = content.decode("utf-8", errors="replace")
+        if start + len(content) < size:
+            text += (f"[...File '{file_path}' continues, pass "
+                     f"offset={start + len(content)} to read on "
+                     f"({size} bytes in total)]")
+        return text
+
+    offsets = line_offsets(full_path)
+    total = len(offsets)
+    first = start_line or 1
+    last = min(end_line or total, total)
+    if first > total:
+        return (f"Error: start_line {first} is past the end of "
+                f"'{file_path}' ({total} lines)")
+    if first < 1 or last < first:
+        return "Error: start_line and end_line must form a range from line 1"
+
+    start = offsets[first - 1]
+    end = offsets[last] if last < total else size
+    stop_line = last
+    if end - start > FILE_CHAR_LIMIT:
+        # Stop at the last line ending within the limit; the end of line L
+        # is the start of line L + 1, offsets[L].
+        boundary = start + FILE_CHAR_LIMIT
+        stop_line = max(first, bisect.bisect_right(offsets, boundary) - 1)
+        end = offsets[stop_line] if stop_line < total else size
+    # A single line longer than the limit is cut within the line.
+    line_end = end
+    end = min(end, start + FILE_CHAR_LIMIT)
+    text = read_bytes(full_path, start, end).decode("utf-8", errors="replace")
+    if end < line_end:
+        text += (f"[...Line {stop_line} of '{file_path}' truncated at "
+                 f"{FILE_CHAR_LIMIT} bytes, pass offset={end} to read on "
+                 f"({size} bytes in total)]")
+    elif stop_line < last:
+        text += (f"[...Lines {first}-{stop_line} of '{file_path}' shown, "
+                 f"pass start_line={stop_line + 1} to read on "
+                 f"({total} lines in total)]")
+    return text
+
+
+def get_file_content(
+                     working_directory: str,
+                     file_path: str,
+                     offset: int | None = None,
+                     length: int | None = None,
+                     start_line: int | None = None,
+                     end_line: int | None = None
+                     ) -> str:
     """
-    Returns a string ,or a error message as a string, containing the
-    contents of a regular file inside the working directory.
+    Get the content of a file specified by the file path. Large files can
+    be read in windows, either by byte offset and length or by line range.
+
+    Returns a string, or an error message as a string, containing the
+    contents of a regular file inside the working directory. Windows are
+    served from a memory map and a cached index of line offsets, so any
+    window of a large file costs about as much as the first one.
 
     Args:
         working_directory(str): Path of the current working directory
-        file_path(str): Path to the file from which to read the content
+        file_path(str): The path to the file from which to read the
+                        contents of, relative to the working directory.
+        offset(int | None): Byte offset to start reading at.
+        length(int | None): Number of bytes to read from offset, at most
+                            10000.
+        start_line(int | None): First line to read, counting from 1.
+        end_line(int | None): Last line to read, inclusive.
 
     Returns:
         str: File content from the specified file or an error message
              with a prefix 'Error:'
     """
     try:
-        full_path = os.path.join(working_directory, file_path)
-        if not os.path.exists(full_path) or not os.path.isfile(full_path):
-            return (
-                    "Error: File not found or is not a "
-                    f"regular file: '{file_path}'"
-                    )
-        if not _is_path_allowed(file_path, working_directory):
+        full_path = get_sandbox(working_directory).resolve(file_path)
+        if full_path is None:
+            if not os.path.isfile(os.path.join(working_directory, file_path)):
+                return (
+                        "Error: File not found or is not a "
+                        f"regular file: '{file_path}'"
+                        )
             return (
                     f"Error: Cannot read '{file_path}' as it is outside the"
                     " permitted working directory"
                     )
+        if not os.path.isfile(full_path):
+            return (
+                    "Error: File not found or is not a "
+                    f"regular file: '{file_path}'"
+                    )
+
+        byte_window = offset is not None or length is not None
+        line_window = start_line is not None or end_line is not None
+        if byte_window and line_window:
+            return ("Error: Use either offset/length or "
+                    "start_line/end_line, not both")
+        if byte_window or line_window:
+            return _read_window(full_path, file_path, offset, length,
+                                start_line, end_line)
 
         with open(full_path, "r") as f:
             content = f.read(FILE_CHAR_LIMIT)
+            truncated = len(content) == FILE_CHAR_LIMIT and f.read(1) != ""
 
-        truncated = len(content) == FILE_CHAR_LIMIT and f.read(1) != ""
         if truncated:
+            next_line = content.count("\n") + 1
             content += (f"[...File '{file_path}' "
-                        "truncated at 10000 characters]")
+                        "truncated at 10000 characters, pass "
+                        f"start_line={next_line} to read on]")
         return content
     except Exception as e:
         return f"Error: {e}"
@@ -1,22 +1,100 @@
+import fnmatch
 import os
+import zlib
 
-from functions._filepath_helpers import _is_path_allowed
+from typing import Iterator
+
+from functions._filepath_helpers import get_sandbox
+from functions._gitignore import GitIgnore
+from functions._gitignore import load_gitignore
+from functions.config import LIST_PAGE_SIZE
+
+SORT_ORDERS = ("name", "size")
+
+# (path relative to the listed directory, file_size, is_dir)
+_Entry = tuple[str, int, bool]
+
+
+def _walk(
+          working_directory: str,
+          directory: str,
+          depth: int,
+          gitignore: GitIgnore | None
+          ) -> Iterator[_Entry]:
+    """
+    Yields the entries of `directory` with os.scandir, descending `depth`
+    levels. Each directory is listed right before its contents.
+    """
+    root = os.path.join(working_directory, directory)
+    stack = [("", 1)]
+    while stack:
+        rel_dir, level = stack.pop()
+        if gitignore is not None and rel_dir:
+            gitignore.add_file(os.path.join(root, rel_dir, ".gitignore"),
+                               _root_rel(directory, rel_dir))
+        subdirs = []
+        with os.scandir(os.path.join(root, rel_dir)) as it:
+            for entry in it:
+                rel_path = f"{rel_dir}/{entry.name}" if rel_dir else entry.name
+                is_dir = entry.is_dir()
+                if gitignore is not None and gitignore.ignored(
+                                            _root_rel(directory, rel_path),
+                                            is_dir
+                                            ):
+                    continue
+                try:
+                    file_size = entry.stat().st_size
+                except OSError:
+                    file_size = entry.stat(follow_symlinks=False).st_size
+                yield rel_path, file_size, is_dir
+                # Never follow symlinked directories out of the tree.
+                if level < depth and entry.is_dir(follow_symlinks=False):
+                    subdirs.append((rel_path, level + 1))
+        stack.extend(reversed(subdirs))
+
+
+def _root_rel(directory: str, rel_path: str) -> str:
+    path = os.path.normpath(os.path.join(directory, rel_path))
+    return path.replace(os.sep, "/")
 
 
 def get_files_info(
                     working_directory: str,
-                    directory: str = "."
+                    directory: str = ".",
+                    depth: int = 1,
+                    pattern: str | None = None,
+                    ignore: list[str] | None = None,
+                    sort: str | None = None,
+                    page_size: int | None = None,
+                    page_token: str | None = None
                     ) -> str:
     """
-    Returns a string ,or a error message as a string, containing the
-    contents of a directory relative to the working directory.
-    Each line in the string is a file in the directory and contains info lie
-    file_size in bytes and if the file is a dir or not.
+    Lists files in the specified directory along with their sizes,
+    constrained to the working directory. Can list a whole tree at once,
+    filtered, sorted and split into pages.
+
+    Each line in the returned string is a file in the directory and contains
+    info like file_size in bytes and if the file is a dir or not. Recursive
+    listings skip anything ignored by the .gitignore files in the working
+    directory. When more entries are left than fit in a page, the last line
+    gives the page_token to pass to get the next page.
 
     Args:
         working_directory(str): Path of the current working directory
-        directory(str): The dircetory to list the content's of relative to the
-                        working directory
+        directory(str): The directory to list files from, relative to the
+                        working directory. If not provided, lists files in
+                        the working directory itself.
+        depth(int): How many levels to list; 1, the default, lists only the
+                    directory itself and 2 also lists its subdirectories.
+        pattern(str | None): Only list entries whose name matches this glob,
+                             e.g. '*.py'.
+        ignore(list[str] | None): Extra .gitignore style patterns of entries
+                                  to leave out.
+        sort(str | None): Order of the entries, 'name' or 'size' (largest
+                          first). Directory order if not provided.
+        page_size(int | None): Maximum number of entries to return.
+        page_token(str | None): Token from a previous call's last line to
+                                get the next page of the same listing.
 
     Returns:
         str: String containing the name, size and is_dir for all
@@ -31,8 +109,8 @@ def get_files_info(
          - pkg: file_size=192 bytes, is_dir=True
     """
     try:
-        full_path = os.path.join(working_directory, directory)
-        if not _is_path_allowed(directory, working_directory):
+        full_path = get_sandbox(working_directory).resolve(directory)
+        if full_path is None:
             return (
                     f"Result for '{directory}' directory:\n"
                     f"    Error: Cannot list '{directory}' as it "
@@ -40,20 +118,51 @@ def get_files_info(
                     )
         if not os.path.isdir(full_path):
             return f"    Error: '{directory}' is not a directory"
+        if sort is not None and sort not in SORT_ORDERS:
+            return f"    Error: sort must be one of {', '.join(SORT_ORDERS)}"
+
+        listing = repr((os.path.normpath(directory), depth, pattern, ignore,
+                        sort))
+        fingerprint = f"{zlib.crc32(listing.encode()):08x}"
+        start = 0
+        if page_token:
+            offset, _, token_fingerprint = page_token.partition(".")
+            if token_fingerprint != fingerprint or not offset.isdigit():
+                return ("    Error: page_token does not belong to this "
+                        "listing, repeat the call without it")
+            start = int(offset)
+        page_size = max(1, page_size or LIST_PAGE_SIZE)
+
+        gitignore = None
+        if depth > 1 or ignore:
+            gitignore = load_gitignore(working_directory, directory)
+            gitignore.add_patterns(ignore or [])
+        entries = _walk(working_directory, directory, max(1, depth), gitignore)
+        if pattern is not None:
+            entries = (
+                e for e in entries
+                if fnmatch.fnmatch(e[0].rsplit("/", 1)[-1], pattern)
+            )
+        if sort == "name":
+            entries = iter(sorted(entries))
+        elif sort == "size":
+            entries = iter(sorted(entries, key=lambda e: (-e[1], e[0])))
 
-        dir_contents = os.listdir(full_path)
         if directory == ".":
-            files_info = "Result for current directory:\n"
+            lines = ["Result for current directory:\n"]
         else:
-            files_info = f"Result for '{directory}' directory:\n"
-
-        for dir_file in dir_contents:
-            dir_file_path = os.path.join(full_path, dir_file)
-            files_info += f" - {dir_file}: "
-            file_size = os.path.getsize(dir_file_path)
-            files_info += f"file_size={file_size} bytes, "
-            is_dir = os.path.isdir(dir_file_path)
-            files_info += f"is_dir={is_dir}\n"
-        return files_info
+            lines = [f"Result for '{directory}' directory:\n"]
+        shown = 0
+        for i, (rel_path, file_size, is_dir) in enumerate(entries):
+            if i < start:
+                continue
+            if shown == page_size:
+                lines.append(f" [...more entries, pass "
+                             f"page_token='{i}.{fingerprint}' to continue]\n")
+                break
+            lines.append(f" - {rel_path}: file_size={file_size} bytes, "
+                         f"is_dir={is_dir}\n")
+            shown += 1
+        return "".join(lines)
     except Exception as e:
         return f"Error: {e}"
@@ -1,57 +1,99 @@
-import contextlib
 import os
-import signal
 import subprocess
 
-from functions._filepath_helpers import _is_path_allowed
+from functions import _interpreter_pool
+from functions import _process
+from functions._filepath_helpers import get_sandbox
+from functions._trigram_index import invalidate_index
+from functions.config import RUN_CAPTURE_BYTES
 
+RUN_TIMEOUT_SECONDS = 30
 
-class TimeoutException(Exception):
-    pass
+# Number of warm interpreters per working directory, 0 to start every run
+# in a fresh interpreter. See use_warm_interpreters.
+_warm_pool_size = 0
 
 
-def _timeout_handler(signum: int, frame):
-    raise TimeoutException("Operation timeout")
+def use_warm_interpreters(
+                          size: int = _interpreter_pool.DEFAULT_POOL_SIZE
+                          ) -> None:
+    """
+    Makes run_python_file fork runs from a pool of `size` warm
+    interpreters per working directory instead of starting a fresh one
+    each time, or turns that off again for a `size` of 0. Ignored where
+    the platform cannot fork.
+    """
+    global _warm_pool_size
+    _warm_pool_size = max(0, size) if _interpreter_pool.is_supported() else 0
 
 
-@contextlib.contextmanager
-def timeout(seconds: int):
-    old_hanlder = signal.getsignal(signalnum=signal.SIGALRM)
-    signal.signal(signal.SIGALRM, _timeout_handler)
-    signal.alarm(seconds)
+def _run(working_directory: str, cmd: list[str]) -> _process.ProcessResult:
+    if _warm_pool_size:
+        pool = _interpreter_pool.get_pool(working_directory, _warm_pool_size)
+        result = pool.run(cmd[1], cmd[2:], RUN_TIMEOUT_SECONDS,
+                          RUN_CAPTURE_BYTES)
+    else:
+        result = _process.run_process(cmd, working_directory,
+                                      RUN_TIMEOUT_SECONDS, RUN_CAPTURE_BYTES)
+    _process.notify(cmd, result)
+    # Fail with the error subprocess.run would raise, so that both ways of
+    # running report alike. A non-zero exit is reported with the output.
+    if result.returncode is None:
+        raise subprocess.TimeoutExpired(cmd, RUN_TIMEOUT_SECONDS)
+    return result
 
-    try:
-        yield
-    finally:
-        signal.alarm(0)
-        signal.signal(signal.SIGALRM, old_hanlder)
+
+def _usage(result: _process.ProcessResult) -> str:
+    usage = f"Ran in {result.elapsed:.2f}s"
+    if result.peak_rss is not None:
+        usage += f", peak RSS {result.peak_rss / 2**20:.1f} MiB"
+    if result.returncode:
+        usage = (f"Process exited with non-zero exit status "
+                 f"{result.returncode}\n{usage}")
+    return usage
 
 
 def run_python_file(working_directory: str,
                     file_path: str,
                     args: list[str] | None = None) -> str:
+    """
+    Run a python file specified by a file path with optional args
+    (list[str]) - do not ask for them from the user.
+
+    Args:
+        working_directory(str): Path of the current working directory.
+        file_path(str): The path to the python file to run.
+        args(list[str] | None): List of strings containing args to pass to
+                                the python file that will be run.
+
+    Returns:
+        str: The STDOUT and STDERR of the run, each cut down to its first
+             and last few KB, its exit status if it failed and its time and
+             memory use, or an error message.
+    """
     try:
-        if not _is_path_allowed(file_path, working_directory):
+        sandbox = get_sandbox(working_directory)
+        full_path = sandbox.resolve(file_path)
+        if full_path is None:
             return (f'Error: Cannot execute "{file_path}" as it '
                     'is outside the permitted working directory')
-        full_path = os.path.join(working_directory, file_path)
         if not os.path.exists(full_path):
             return f'Error: File "{file_path}" not found.'
-        if not full_path.endswith(".py"):
+        if not file_path.endswith(".py"):
             return f"Error: '{file_path}' is not a Python file."
         cmd = ["python", file_path]
         if args is not None:
             cmd += args
-        with timeout(30):
-            result = subprocess.run(cmd,
-                                    capture_output=True,
-                                    text=True,
-                                    check=True,
-                                    cwd=working_directory)
-            if result.returncode != 0:
-                return f"Process exited with code {result.returncode}"
-            if not result.stdout and not result.stderr:
-                return "No output produced"
-            return f"STDOUT:\n{result.stdout}\nSTDERR:\n{result.stderr}"
+        try:
+            result = _run(working_directory, cmd)
+        finally:
+            # The script may have moved directories, added symlinks or
+            # written files.
+            sandbox.invalidate()
+            invalidate_index(working_directory)
+        if not result.stdout and not result.stderr:
+            return f"No output produced\n{_usage(result)}"
+        return (f"STDOUT:\n{result.stdout}\nSTDERR:\n{result.stderr}\n"
+                f"{_usage(result)}")
     except Exception as e:
         return f"Error: executing Python file: {e}"
@@ -0,0 +1,91 @@
+import os
+import re
+
+from functions._filepath_helpers import get_sandbox
+from functions._trigram_index import get_index
+from functions._trigram_index import required_literals
+
+DEFAULT_MAX_RESULTS = 50
+# Longest part of a matching line shown in the results.
+LINE_CHAR_LIMIT = 200
+
+
+def search_code(
+                working_directory: str,
+                query: str,
+                regex: bool = False,
+                ignore_case: bool = False,
+                path: str = ".",
+                max_results: int | None = None
+                ) -> str:
+    """
+    Searches the files in the working directory for a literal string or a
+    regular expression and returns every matching line as file:line.
+
+    Backed by a trigram index of the working directory that is built once
+    and kept up to date as files change, so only files that can contain
+    the query are scanned. Files ignored by .gitignore, binary files and
+    files over 1 MB are not searched.
+
+    Args:
+        working_directory(str): Path of the current working directory.
+        query(str): The text, or regular expression, to search for.
+        regex(bool): Treat query as a Python regular expression.
+        ignore_case(bool): Match regardless of case.
+        path(str): Only search files under this directory or file, relative
+                   to the working directory.
+        max_results(int | None): Maximum number of matching lines to
+                                 return, 50 if not provided.
+
+    Returns:
+        str: One 'file:line: text' line per match, or an error message
+             prefixed with 'Error:'.
+    """
+    try:
+        if get_sandbox(working_directory).resolve(path) is None:
+            return (f"Error: Cannot search '{path}' as it is outside the "
+                    "permitted working directory")
+        if not query:
+            return "Error: query must not be empty"
+        try:
+            compiled = re.compile(query if regex else re.escape(query),
+                                  re.IGNORECASE if ignore_case else 0)
+        except re.error as e:
+            return f"Error: invalid regular expression: {e}"
+        limit = max(1, max_results or DEFAULT_MAX_RESULTS)
+        prefix = os.path.normpath(path).replace(os.sep, "/")
+
+        index = get_index(working_directory)
+        index.refresh()
+        literals = required_literals(query) if regex else [query]
+
+        hits = []
+        more = False
+        for rel_path in index.candidates(literals):
+            if prefix != "." and not (
+                rel_path == prefix or rel_path.startswith(prefix + "/")
+            ):
+                continue
+            full_path = os.path.join(working_directory, rel_path)
+            try:
+                with open(full_path, "r", errors="replace") as f:
+                    for line_number, line in enumerate(f, start=1):
+                        if compiled.search(line):
+                            if len(hits) == limit:
+                                more = True
+                                break
+                            text = line.rstrip("\n")[:LINE_CHAR_LIMIT]
+                            hits.append(f"{rel_path}:{line_number}: {text}")
+            except OSError:
+                continue
+            if more:
+                break
+
+        if not hits:
+            return f"No matches for '{query}'"
+        if more:
+            hits.append(f"[...more than {limit} matches, narrow the query "
+                        "or the path]")
+        return "\n".join(hits)
+    except Exception as e:
+        return f"Error: {e}"
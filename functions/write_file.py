@@ -1,31 +1,31 @@
-import os
-
-from functions._filepath_helpers import _is_path_allowed
+from functions._filepath_helpers import get_sandbox
+from functions._filepath_helpers import write_atomically
+from functions._trigram_index import notify_write
 
 
 def write_file(working_directory: str, file_path: str, content: str) -> str:
     """
-    Write the `content` into the file definied by the file_path inside of the
-    working directory.
+    Write content to a file specified by the file_path, creating or
+    overwriting it.
 
     Args:
         working_directory(str): Path of the current working directory.
-        file_path(str): relative path to the file to write to inside of the
+        file_path(str): The path to the file to write to, relative to the
                         working directory.
-        content(str): The content to be written to the file.
+        content(str): Content to write to the file.
 
     Returns:
         str: String containg either an error message or success message.
     """
     try:
-        if not _is_path_allowed(file_path, working_directory):
+        full_path = get_sandbox(working_directory).resolve(file_path)
+        if full_path is None:
             return (
                     f"Error: Cannot write to '{file_path}' as it "
                     "is outside the permitted working directory"
                     )
-        full_path = os.path.join(working_directory, file_path)
-        with open(full_path, "w") as f:
-            f.write(content)
+        write_atomically(full_path, content, newline=None)
+        notify_write(working_directory, file_path)
         return (
                 f"Successfully wrote to '{file_path}' "
                 f"({len(content)} characters written)")
@@ -1,282 +1,292 @@
 import argparse
 import os
-
-from typing import Callable
-
-from dotenv import load_dotenv
-from google import genai
-from google.genai import types
-from functions.get_files_info import get_files_info
-from functions.get_file_content import get_file_content
-from functions.write_file import write_file
-from functions.run_python_file import run_python_file
-
-
-system_prompt = """
-You are a helpful AI coding agent.
-
-When a user asks a question or makes a request, make a function call plan.
-You can perform the following operations:
-
-- List files and directories
-- Read file contents
-- Execute Python files with optional arguments
-- Write or overwrite files
-
-All paths you provide should be relative to the working directory. You do not
-need to specify the working directory in your function calls as it is
-automatically injected for security reasons.
-The working directory is called calulator.
-
-Bug fixes mean that you just need to change the code that is causing the bug.
-
-If optional arguments are not needed, call the tool with an empty args list.
-Do not ask the user to supply optional args unless strictly required.
-"""
-
-functions: dict[str, Callable[..., str]] = {
-    "get_files_info": get_files_info,
-    "get_file_content": get_file_content,
-    "write_file": write_file,
-    "run_python_file": run_python_file,
-}
-
-
-def call_function(
-                  function_call_part: types.FunctionCall,
-                  verbose: bool = False
-                  ) -> types.Content:
-
-    if function_call_part.name is None:
-        return types.Content(
-                            role="tool",
-                            parts=[
-                                types.Part.from_function_response(
-                                    name="None",
-                                    response={"result": "Error: no func name"},
-                                )
-                            ],
-                        )
-
-    if verbose:
-        print(f"Calling function: {function_call_part.name}"
-              f"({function_call_part.args})")
+import sys
+
+from agent.config import DEFAULT_CONCURRENCY
+from agent.config import MAX_RETRIES
+from agent.config import MODEL_NAME
+from agent.config import SESSION_LOG_DIRECTORY
+from agent.config import WORKING_DIRECTORY
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--verbose",
+                        action="store_true",
+                        help="Print verbose output if flag is present")
+    parser.add_argument("--batch",
+                        metavar="FILE",
+                        help=("Run every line of FILE ('-' for stdin) as a "
+                              "prompt and write JSONL results to stdout"))
+    parser.add_argument("--concurrency",
+                        type=int,
+                        default=DEFAULT_CONCURRENCY,
+                        help="Maximum number of sessions to run at once")
+    parser.add_argument("--stream",
+                        action="store_true",
+                        help=("Stream responses, printing text as it arrives "
+                              "and starting tools before the response is "
+                              "complete"))
+    parser.add_argument("--warm-python",
+                        action="store_true",
+                        help=("Fork Python runs from warm interpreters "
+                              "instead of starting a fresh one each time"))
+    parser.add_argument("--working-directory",
+                        metavar="DIR",
+                        help=("Directory the agent works in, "
+                              f"{WORKING_DIRECTORY} if not given"))
+    parser.add_argument("--serve",
+                        metavar="SOCKET",
+                        help=("Run as a daemon answering prompts sent to the "
+                              "Unix socket SOCKET with --connect"))
+    parser.add_argument("--connect",
+                        metavar="SOCKET",
+                        help=("Send the prompt to the daemon on SOCKET and "
+                              "print its output"))
+    parser.add_argument("--session",
+                        metavar="NAME",
+                        help=("With --connect, start or continue the "
+                              "daemon's conversation NAME"))
+    parser.add_argument("--trace",
+                        metavar="FILE",
+                        help=("Write a span for every session, model call, "
+                              "tool call and process run to FILE and print "
+                              "a summary to stderr"))
+    parser.add_argument("--trace-format",
+                        choices=("jsonl", "chrome"),
+                        default="jsonl",
+                        help=("Format of --trace, JSON lines or Chrome "
+                              "trace events (default: jsonl)"))
+    parser.add_argument("--max-retries",
+                        type=int,
+                        default=MAX_RETRIES,
+                        help=("Retries of a model call failing with a "
+                              "transient error before giving up "
+                              f"(default: {MAX_RETRIES})"))
+    parser.add_argument("--rpm",
+                        type=float,
+                        help="Model requests per minute to stay under")
+    parser.add_argument("--tpm",
+                        type=float,
+                        help="Model tokens per minute to stay under")
+    parser.add_argument("--no-context-cache",
+                        action="store_true",
+                        help=("Send the system prompt, tools and history in "
+                              "full with every request instead of caching "
+                              "their unchanging start"))
+    parser.add_argument("--resume",
+                        metavar="SESSION",
+                        help=("Carry on the logged session SESSION, an id "
+                              f"from {SESSION_LOG_DIRECTORY}, a log file "
+                              "or 'last', from its last completed step"))
+    parser.add_argument("--no-session-log",
+                        action="store_true",
+                        help=("Do not log the session to "
+                              f"{SESSION_LOG_DIRECTORY} for --resume"))
+    parser.add_argument("--fan-out",
+                        type=int,
+                        metavar="WORKERS",
+                        help=("Split the prompt into independent subtasks "
+                              "and run up to WORKERS of them at once, each "
+                              "in its own copy of the working directory, "
+                              "then merge their changes"))
+    parser.add_argument("--model",
+                        default=MODEL_NAME,
+                        help="Gemini model to use")
+    parser.add_argument("--record",
+                        metavar="FILE",
+                        help="Append every model exchange to FILE")
+    parser.add_argument("--replay",
+                        metavar="FILE",
+                        help=("Answer from exchanges recorded with --record "
+                              "instead of calling the Gemini API"))
+    parser.add_argument("--replay-latency",
+                        type=float,
+                        default=0.0,
+                        help=("Seconds to wait before every replayed answer, "
+                              "or a negative number for the recorded "
+                              "latency"))
+    # positional arg
+    parser.add_argument("prompt",
+                        action="store",
+                        type=str,
+                        nargs="?",
+                        default="",
+                        help="Prompt to pass to the Gemini LLM")
+    return parser
+
+
+def main(argv: list[str] | None = None) -> None:
+    args = build_parser().parse_args(argv)
+
+    if (args.prompt == "" and args.batch is None and args.serve is None
+            and args.resume is None):
+        print("No prompt provided")
+        raise SystemExit(1)
+
+    if args.connect is not None:
+        # The client needs none of the agent, nor the SDK.
+        from agent.client import send_prompt
+
+        try:
+            event = send_prompt(args.connect,
+                                args.prompt,
+                                sys.stdout,
+                                working_directory=args.working_directory,
+                                session=args.session,
+                                stream=args.stream,
+                                verbose=args.verbose)
+        except OSError as e:
+            print(f"Error: cannot reach the daemon on {args.connect}: {e}")
+            raise SystemExit(1)
+        if event["event"] == "error":
+            print(event["error"])
+            raise SystemExit(1)
+        return
+
+    # The SDK takes most of a second to import, so it is only loaded once
+    # the arguments are known to be usable.
+    import asyncio
+
+    from agent.backends import GeminiBackend
+    from agent.backends import ModelBackend
+    from agent.backends import RecordingBackend
+    from agent.backends import ReplayBackend
+    from agent.daemon import AgentDaemon
+    from agent.engine import AgentEngine
+    from agent.engine import read_prompts
+    from agent.engine import write_batch_results
+    from agent.fanout import FanOut
+    from agent.session_log import find_session
+    from agent.session_log import load_session
+    from agent.session_log import new_session_path
+    from agent.session_log import SessionLog
+    from agent.tracing import Tracer
+
+    saved = None
+    if args.resume is not None:
+        log_path = find_session(args.resume)
+        if log_path is None:
+            print(f"Error: no logged session '{args.resume}'")
+            raise SystemExit(1)
+        try:
+            saved = load_session(log_path)
+        except (OSError, ValueError) as e:
+            print(f"Error: {e}")
+            raise SystemExit(1)
+
+    backend: ModelBackend
+    if args.replay is not None:
+        backend = ReplayBackend(args.replay,
+                                latency=(None if args.replay_latency < 0
+                                         else args.replay_latency))
     else:
-        print(f" - Calling function: {function_call_part.name}")
-
-    if function_call_part.args is None:
-        return types.Content(
-                            role="tool",
-                            parts=[
-                                types.Part.from_function_response(
-                                    name=function_call_part.name,
-                                    response={"result": "Error: no func args"},
-                                )
-                            ],
-                        )
-
-    args = {"working_directory": "./calculator"} | function_call_part.args
+        from dotenv import load_dotenv
+        from google import genai
+
+        load_dotenv()
+        api_key = os.environ.get("GEMINI_API_KEY")
+        if api_key is None:
+            print("No api key")
+            raise SystemExit(1)
+        from agent.prefix_cache import PrefixCachingBackend
+        from agent.ratelimit import RetryingBackend
+        from agent.ratelimit import RetryPolicy
+
+        backend = GeminiBackend(genai.Client(api_key=api_key),
+                                model=args.model)
+        if not args.no_context_cache:
+            backend = PrefixCachingBackend(backend)
+        backend = RetryingBackend(
+            backend,
+            RetryPolicy(max_retries=args.max_retries),
+            requests_per_minute=args.rpm,
+            tokens_per_minute=args.tpm,
+            max_concurrency=args.concurrency,
+        )
+    if args.record is not None:
+        backend = RecordingBackend(backend, args.record)
+    if args.warm_python:
+        from functions.run_python_file import use_warm_interpreters
+        use_warm_interpreters()
+
+    tracer = Tracer() if args.trace is not None else None
+
+    working_directory = args.working_directory or WORKING_DIRECTORY
+    if saved is not None:
+        working_directory = args.working_directory or saved.working_directory
     try:
-        res = functions[function_call_part.name](**args)
-        return types.Content(
-                            role="tool",
-                            parts=[
-                                types.Part.from_function_response(
-                                    name=function_call_part.name,
-                                    response={"result": res},
-                                )
-                            ],
-                        )
-    except KeyError:
-        return types.Content(
-                            role="tool",
-                            parts=[
-                                types.Part.from_function_response(
-                                    name=function_call_part.name,
-                                    response={"error":
-                                              "Unknown function: "
-                                              f"{function_call_part.name}"},
-                                )
-                            ],
-                        )
-
-
-parser = argparse.ArgumentParser()
-parser.add_argument("--verbose",
-                    action="store_true",
-                    help="Print verbose output if flag is present")
-# positional arg
-parser.add_argument("prompt",
-                    action="store",
-                    type=str,
-                    default="",
-                    help="Prompt to pass to the Gemini LLM")
-args = parser.parse_args()
-
-load_dotenv()
-api_key = os.environ.get("GEMINI_API_KEY")
-
-if api_key is None:
-    print("No api key")
-    raise SystemExit(1)
-if args.prompt == "":
-    print("No prompt provided")
-    raise SystemExit(1)
-
-client = genai.Client(api_key=api_key)
-user_prompt = args.prompt
-
-schema_get_files_info = types.FunctionDeclaration(
-    name="get_files_info",
-    description=("Lists files in the specified directory along with "
-                 "their sizes, constrained to the working directory."),
-    parameters=types.Schema(
-        type=types.Type.OBJECT,
-        properties={
-            "directory": types.Schema(
-                type=types.Type.STRING,
-                description=("The directory to list files from, relative to "
-                             "the working directory. If not provided, lists "
-                             "files in the working directory itself."),
-            ),
-        },
-        required=[]
-    ),
-)
-
-schema_get_file_content = types.FunctionDeclaration(
-    name="get_file_content",
-    description="Get the content of a file specified by the file path",
-    parameters=types.Schema(
-        type=types.Type.OBJECT,
-        properties={
-            "file_path": types.Schema(
-                type=types.Type.STRING,
-                description=("The file path to the file from which to"
-                             "read the contents of"),
-            ),
-        },
-        required=["file_path"]
-    )
-)
-
-schema_write_file = types.FunctionDeclaration(
-    name="write_file",
-    description="Write content to a file specified by the file_path",
-    parameters=types.Schema(
-        type=types.Type.OBJECT,
-        properties={
-            "file_path": types.Schema(
-                type=types.Type.STRING,
-                description="The path to the file to write to."
-            ),
-            "content": types.Schema(
-                type=types.Type.STRING,
-                description="Content to write to the file"
-            )
-        },
-        required=["file_path", "content"]
-    )
-)
-
-
-schema_run_python_file = types.FunctionDeclaration(
-    name="run_python_file",
-    description=("Run a python file specified by a file path with "
-                 "optional args (list[str]) - "
-                 "do not ask for them from the user"),
-    parameters=types.Schema(
-        type=types.Type.OBJECT,
-        properties={
-            "file_path": types.Schema(
-                type=types.Type.STRING,
-                description="The path to the python file to run."
-            ),
-            "args": types.Schema(
-                type=types.Type.ARRAY,
-                description=("List of strings containging args to pass to the"
-                             " python file that will be run"),
-                items=types.Schema(
-                    type=types.Type.STRING,
-                    description="Arg to pass"
-                )
-            )
-        },
-        required=["file_path"]
-    )
-)
-
-available_functions = types.Tool(
-    function_declarations=[
-        schema_get_files_info,
-        schema_get_file_content,
-        schema_run_python_file,
-        schema_write_file,
-    ]
-)
-
-messages = [
-    types.Content(role="user", parts=[types.Part(text=user_prompt)]),
-]
-model_config = types.GenerateContentConfig(tools=[available_functions],
-                                           system_instruction=system_prompt)
-
-
-for i in range(20):
-    content_resp = client.models.generate_content(model="gemini-2.0-flash-001",
-                                                  contents=messages,
-                                                  config=model_config
-                                                  )
-
-    messages.extend(
-        c.content for c in (content_resp.candidates or [])
-        if c.content is not None
-    )
-
-    if args.verbose:
-        print(f"User prompt: {user_prompt}")
-        meta = content_resp.usage_metadata
-        if meta is None:
-            print("Error getting usage data")
-        else:
-            prompt_tokens = (f"Prompt tokens: "
-                             f"{meta.prompt_token_count}")
-            resp_tokens = (f"Response tokens: "
-                           f"{meta.candidates_token_count}")
-            print(prompt_tokens)
-            print(resp_tokens)
-
-    if content_resp.function_calls:
-        for function_call_part in content_resp.function_calls:
-            function_call_result = call_function(
-                                                 function_call_part,
-                                                 args.verbose
-                                                 )
-
-            if (
-                function_call_result.parts is not None
-                and function_call_result.parts[0].function_response is not None
-            ):
-                msg = function_call_result.parts[0].function_response.response
-                print("-> "
-                      f"{msg}"
-                      )
-                part = function_call_result.parts[0]
-                function_response = part.function_response
-                if (
-                    function_response is None
-                    or function_response.response is None
-                   ):
-                    continue                
-                res = function_response.response["result"]
-                func_rec = types.Content(
-                                        role="user",
-                                        parts=[types.Part(text=res)]
-                                        )
-                messages.append(func_rec)
+        if args.serve is not None:
+            daemon = AgentDaemon(backend,
+                                 args.serve,
+                                 working_directory=working_directory,
+                                 concurrency=args.concurrency,
+                                 tracer=tracer)
+            print(f"Agent daemon listening on {args.serve}", flush=True)
+            try:
+                asyncio.run(daemon.serve_forever())
+            except KeyboardInterrupt:
+                pass
+        elif args.batch is not None:
+            engine = AgentEngine(backend,
+                                 working_directory=working_directory,
+                                 concurrency=args.concurrency,
+                                 stream=args.stream,
+                                 tracer=tracer)
+            if args.batch == "-":
+                asyncio.run(write_batch_results(engine,
+                                                read_prompts(sys.stdin),
+                                                sys.stdout))
             else:
-                raise SystemExit(2)
-    elif content_resp.text is not None:
-        print(content_resp.text)
-        # print("breaking out of loop")
-        break
+                with open(args.batch, "r") as prompt_file:
+                    asyncio.run(write_batch_results(
+                                            engine,
+                                            read_prompts(prompt_file),
+                                            sys.stdout
+                                            ))
+        elif args.fan_out is not None and saved is None:
+            fan_out = FanOut(backend,
+                             working_directory=working_directory,
+                             workers=args.fan_out,
+                             stdout=sys.stdout,
+                             tracer=tracer,
+                             stream=args.stream)
+            fanned = asyncio.run(fan_out.run(args.prompt))
+            if fanned.fanned_out:
+                print(fanned.format())
+            elif fanned.results[0].error is not None:
+                print(fanned.results[0].error)
+        else:
+            engine = AgentEngine(backend,
+                                 working_directory=working_directory,
+                                 verbose=args.verbose,
+                                 stdout=sys.stdout,
+                                 stream=args.stream,
+                                 tracer=tracer)
+            log = None
+            if saved is not None:
+                log = SessionLog(saved.path)
+            elif not args.no_session_log:
+                log = SessionLog(new_session_path())
+            if args.verbose and log is not None:
+                print(f"Session log: {log.path}")
+            try:
+                if saved is not None:
+                    result = asyncio.run(engine.resume(saved, log))
+                    if saved.final is not None:
+                        print(saved.final)
+                else:
+                    result = asyncio.run(engine.run(args.prompt, log=log))
+                if result.error is not None:
+                    print(result.error)
+            finally:
+                if log is not None:
+                    log.close()
+    finally:
+        if tracer is not None:
+            tracer.write(args.trace, args.trace_format)
+            print(tracer.summary().format(), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
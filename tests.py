@@ -1,25 +1,76 @@
+import asyncio
+import io
+import json
+import os
 import pathlib
+import shutil
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 
 import pytest
+from google.genai import errors
+from google.genai import types
 
+from benchmarks.agent_loop import run_benchmark
+from agent.backends import RecordingBackend
+from agent.backends import ReplayBackend
+from agent.cache import ToolCache
+from agent.client import send_prompt
+from agent.daemon import AgentDaemon
+from agent.dispatcher import dispatch_function_calls
+from agent.engine import AgentEngine
+from agent.engine import SessionResult
+from agent.engine import write_batch_results
+from agent.fanout import FanOut
+from agent.fake_model import CachingModel
+from agent.fake_model import FlakyBackend
+from agent.fake_model import ScriptedModel
+from agent.history import History
+from agent.prefix_cache import PrefixCachingBackend
+from agent.ratelimit import AdaptiveConcurrency
+from agent.ratelimit import RetryingBackend
+from agent.ratelimit import RetryPolicy
+from agent.ratelimit import TokenBucket
+from agent.schemas import function_declaration
+from agent.session_log import load_session
+from agent.session_log import SessionLog
+from agent.tracing import Tracer
+from agent.tools import available_functions
+from agent.tools import call_function
+from agent.workspace import changed_files
+from agent.workspace import merge3
+from agent.workspace import snapshot
+from functions._filepath_helpers import Sandbox
+from functions._line_index import line_offsets
+from functions._trigram_index import required_literals
 from functions.get_files_info import get_files_info
 from functions.get_file_content import get_file_content
 from functions.write_file import write_file
+from functions.edit_file import edit_file
 from functions.run_python_file import run_python_file
+from functions.run_python_file import use_warm_interpreters
+from functions.search_code import search_code
 
 EXPECTED_FOR_CURRENT = """
 Result for current directory:
- - tests.py: file_size=1343 bytes, is_dir=False
- - main.py: file_size=576 bytes, is_dir=False
+ - tests.py: file_size=5511 bytes, is_dir=False
+ - main.py: file_size=2006 bytes, is_dir=False
  - pkg: file_size=192 bytes, is_dir=True
  """
 
 EXPECTED_FOR_PKG = """
 Result for 'pkg' directory:
- - render.py: file_size=785 bytes, is_dir=False
+ - render.py: file_size=827 bytes, is_dir=False
  - __init__.py: file_size=0 bytes, is_dir=False
  - __pycache__: file_size=160 bytes, is_dir=True
- - calculator.py: file_size=1719 bytes, is_dir=False
+ - calculator.py: file_size=8334 bytes, is_dir=False
+ - batch.py: file_size=2524 bytes, is_dir=False
 """
 
 EXPECTED_FOR_BIN = """
@@ -51,6 +102,43 @@ def test_get_files_info(
     assert res.strip() == expected_res.strip()
 
 
+def test_get_files_info_recursive_filtered_and_paged(
+                                                tmp_path: pathlib.Path
+                                                ) -> None:
+    (tmp_path / "pkg" / "build").mkdir(parents=True)
+    (tmp_path / ".gitignore").write_text("build/\n*.log\n")
+    (tmp_path / "pkg" / ".gitignore").write_text("secret.py\n")
+    for name in ("main.py", "run.log", "pkg/a.py", "pkg/bb.py",
+                 "pkg/secret.py", "pkg/notes.txt", "pkg/build/out.py"):
+        (tmp_path / name).write_text("x" * len(name))
+    workdir = str(tmp_path)
+
+    res = get_files_info(workdir, ".", depth=3, pattern="*.py", sort="name")
+    assert res.splitlines() == [
+        "Result for current directory:",
+        " - main.py: file_size=7 bytes, is_dir=False",
+        " - pkg/a.py: file_size=8 bytes, is_dir=False",
+        " - pkg/bb.py: file_size=9 bytes, is_dir=False",
+    ]
+
+    by_size = get_files_info(workdir, ".", depth=2, pattern="*.py",
+                             sort="size")
+    assert [line.split(":")[0] for line in by_size.splitlines()[1:]] == [
+        " - pkg/bb.py", " - pkg/a.py", " - main.py"]
+
+    first = get_files_info(workdir, ".", depth=2, sort="name", page_size=4)
+    token = first.split("page_token='")[1].split("'")[0]
+    rest = get_files_info(workdir, ".", depth=2, sort="name", page_size=4,
+                          page_token=token)
+    names = [line.split(":")[0][3:] for line in
+             (first + rest).splitlines() if line.startswith(" - ")]
+    assert names == [".gitignore", "main.py", "pkg", "pkg/.gitignore",
+                     "pkg/a.py", "pkg/bb.py", "pkg/notes.txt"]
+    assert "page_token" not in rest
+    assert "Error: page_token" in get_files_info(workdir, "pkg",
+                                                 page_token=token)
+
+
 with open("./calculator/main.py", "r") as f:
     EXPECTED_MAIN_PY = f.read()
 
@@ -85,6 +173,101 @@ def test_get_file_content(
     assert res.strip() == expected_res.strip()
 
 
+def test_get_file_content_windows(tmp_path: pathlib.Path) -> None:
+    log = tmp_path / "big.log"
+    log.write_text("".join(f"line {i}\n" for i in range(1, 50_001)))
+    workdir = str(tmp_path)
+
+    assert get_file_content(workdir, "big.log", start_line=40_000,
+                            end_line=40_002) == (
+        "line 40000\nline 40001\nline 40002\n")
+    assert get_file_content(workdir, "big.log", offset=7, length=7) == (
+        "line 2\n[...File 'big.log' continues, pass offset=14 to read on "
+        f"({log.stat().st_size} bytes in total)]")
+    res = get_file_content(workdir, "big.log", start_line=49_000)
+    assert res.startswith("line 49000\n")
+    assert "pass start_line=" in res and "(50000 lines in total)" in res
+    assert "truncated at 10000 characters, pass start_line=" in (
+        get_file_content(workdir, "big.log"))
+    assert get_file_content(workdir, "big.log", offset=0,
+                            start_line=1).startswith("Error:")
+    assert get_file_content(workdir, "big.log",
+                            start_line=60_000).startswith("Error:")
+
+    # A line longer than the limit is cut with a marker saying where the
+    # rest of it starts.
+    (tmp_path / "long.txt").write_text("a\n" + "b" * 12_000 + "\nc\n")
+    res = get_file_content(workdir, "long.txt", start_line=2, end_line=2)
+    assert res == "b" * 10_000 + (
+        "[...Line 2 of 'long.txt' truncated at 10000 bytes, pass "
+        "offset=10002 to read on (12005 bytes in total)]")
+
+
+def test_line_index_is_cached_until_file_changes(
+                                            tmp_path: pathlib.Path
+                                            ) -> None:
+    path = tmp_path / "lines.txt"
+    path.write_text("a\nb\nc")
+    first = line_offsets(str(path))
+
+    assert list(first) == [0, 2, 4]
+    assert line_offsets(str(path)) is first
+    path.write_text("a\nbb\nc\nd\n")
+    assert list(line_offsets(str(path))) == [0, 2, 5, 7]
+
+
+def test_search_code_finds_lines_and_follows_writes(
+                                            tmp_path: pathlib.Path
+                                            ) -> None:
+    (tmp_path / "pkg").mkdir()
+    (tmp_path / "pkg" / "calc.py").write_text(
+        "class Calculator:\n    def evaluate(self, expression):\n")
+    (tmp_path / "main.py").write_text("calculator.evaluate(expression)\n")
+    workdir = str(tmp_path)
+
+    assert search_code(workdir, "def evaluate") == (
+        "pkg/calc.py:2:     def evaluate(self, expression):")
+    assert search_code(workdir, r"evaluate\(\w+\)", regex=True) == (
+        "main.py:1: calculator.evaluate(expression)")
+    assert search_code(workdir, "calculator", ignore_case=True,
+                       path="pkg") == "pkg/calc.py:1: class Calculator:"
+
+    write_file(workdir, "pkg/calc.py", "def evaluate_many(self):\n")
+    assert search_code(workdir, "def evaluate") == (
+        "pkg/calc.py:1: def evaluate_many(self):")
+    assert search_code(workdir, "nowhere") == "No matches for 'nowhere'"
+    assert search_code(workdir, "x", path="../").startswith("Error:")
+
+    # Files a script writes are found straight after the run.
+    (tmp_path / "gen.py").write_text(
+        "open('made.py', 'w').write('generated_' + 'marker = 1\\n')\n")
+    run_python_file(workdir, "gen.py")
+    assert search_code(workdir, "generated_marker = 1") == (
+        "made.py:1: generated_marker = 1")
+
+
+@pytest.mark.parametrize(
+    "pattern, literals",
+    [
+        ("fo{2}bar", ["bar"]),
+        ("fo{1,3}bar", ["bar"]),
+        ("fo{1,}?barbaz", ["barbaz"]),
+        ("ab{x}def", ["x}def"]),
+        (r"foo[\]x]bar", ["foo", "bar"]),
+        ("foo[^]x]arbaz", ["foo", "arbaz"]),
+    ],
+)
+def test_search_code_regex_literals(
+                                    tmp_path: pathlib.Path,
+                                    pattern: str,
+                                    literals: list[str]
+                                    ) -> None:
+    assert required_literals(pattern) == literals
+    (tmp_path / "code.py").write_text("foobarbaz = 'ab{x}def'  # foo]bar\n")
+    assert search_code(str(tmp_path), pattern, regex=True).startswith(
+        "code.py:1:")
+
+
 @pytest.mark.parametrize(
     "file_path, content, expect_error",
     [
@@ -127,6 +310,1146 @@ def test_write_file(
         assert target_path.read_text() == content
 
 
+def test_sandbox_rejects_escapes_and_follows_changes(
+        tmp_path: pathlib.Path
+        ) -> None:
+    root = tmp_path / "root"
+    (root / "pkg" / "sub").mkdir(parents=True)
+    (root / "pkg" / "a.py").touch()
+    (tmp_path / "secret.txt").touch()
+    (root / "out").symlink_to(tmp_path)
+    (root / "pkg" / "leak.txt").symlink_to(tmp_path / "secret.txt")
+    (root / "pkg" / "inside.py").symlink_to(root / "pkg" / "a.py")
+    sandbox = Sandbox(str(root))
+
+    real = str(root.resolve())
+    assert sandbox.validate_many([
+        "pkg/a.py", "pkg/sub/", ".", "pkg/../pkg/a.py", "pkg/inside.py",
+        "../secret.txt", "pkg/../../secret.txt", "/etc/passwd",
+        "out/secret.txt", "out", "pkg/leak.txt", "pkg/sub/..",
+    ]) == [
+        f"{real}/pkg/a.py", f"{real}/pkg/sub", real, f"{real}/pkg/a.py",
+        f"{real}/pkg/a.py", None, None, None, None, None, None,
+        f"{real}/pkg",
+    ]
+
+    # Tools share one sandbox per working directory; a script swapping a
+    # directory for a symlink must not leave it resolved as before.
+    assert get_file_content(str(root), "pkg/sub/secret.txt").startswith(
+        "Error: File not found")
+    (root / "swap.py").write_text(
+        "import os\n"
+        "os.rmdir('pkg/sub')\n"
+        f"os.symlink({str(tmp_path)!r}, 'pkg/sub')\n"
+    )
+    assert run_python_file(str(root), "swap.py").startswith("No output")
+    assert "outside the permitted" in get_file_content(str(root),
+                                                       "pkg/sub/secret.txt")
+
+
+def test_edit_file(tmp_path: pathlib.Path) -> None:
+    target = tmp_path / "calc.py"
+    target.write_text("def add(a, b):\n    return a - b\n\n\n"
+                      "def sub(a, b):\n    return a - b\n")
+    assert "3 matches" not in search_code(str(tmp_path), "a - b")
+
+    res = edit_file(str(tmp_path), "calc.py", blocks=(
+        "<<<<<<< SEARCH\ndef add(a, b):\n    return a - b\n=======\n"
+        "def add(a, b):\n    return a + b\n>>>>>>> REPLACE\n"
+    ))
+    assert res == "Successfully edited 'calc.py' (1 edit): line 2 changed"
+    assert target.read_text().startswith("def add(a, b):\n    return a + b")
+    assert search_code(str(tmp_path), "a + b") == "calc.py:2:     return a + b"
+
+    res = edit_file(str(tmp_path), "calc.py", diff=(
+        "--- a/calc.py\n+++ b/calc.py\n@@ -5,2 +5,3 @@\n def sub(a, b):\n"
+        "-    return a - b\n+    # subtract\n+    return a - b\n"
+    ))
+    assert res == "Successfully edited 'calc.py' (1 edit): line 6 changed"
+    assert target.read_text().endswith("    # subtract\n    return a - b\n")
+
+    # Inside a hunk "--- " and "+++ " remove and add lines, they are only
+    # file headers between hunks.
+    sql = tmp_path / "query.sql"
+    sql.write_text("SELECT 1;\n-- comment\nSELECT 2;\n")
+    res = edit_file(str(tmp_path), "query.sql", diff=(
+        "--- a/query.sql\n+++ b/query.sql\n@@ -1,3 +1,3 @@\n SELECT 1;\n"
+        "--- comment\n+++ note\n SELECT 2;\n"
+    ))
+    assert res.startswith("Successfully edited 'query.sql'")
+    assert sql.read_text() == "SELECT 1;\n++ note\nSELECT 2;\n"
+    for header in ("@@ -1,2 +1,1 @@", "@@ -1,4 +1,3 @@"):
+        res = edit_file(str(tmp_path), "query.sql", diff=(
+            f"{header}\n SELECT 1;\n-++ note\n SELECT 2;\n"))
+        assert res.startswith("Error:") and "header counts" in res
+    sql.unlink()
+
+    before = target.read_text()
+    ambiguous = edit_file(str(tmp_path), "calc.py", blocks=(
+        "<<<<<<< SEARCH\n    return\n=======\n    pass\n"
+        ">>>>>>> REPLACE\n<<<<<<< SEARCH\n(a, b)\n=======\n(x)\n"
+        ">>>>>>> REPLACE\n"
+    ))
+    assert "edit 1: search text not found" in ambiguous
+    ambiguous = edit_file(str(tmp_path), "calc.py", blocks=(
+        "<<<<<<< SEARCH\n(a, b):\n=======\n(x):\n>>>>>>> REPLACE\n"
+    ))
+    assert "matches 2 places" in ambiguous
+    assert target.read_text() == before
+    assert "exactly one" in edit_file(str(tmp_path), "calc.py")
+    assert "outside" in edit_file(str(tmp_path), "../calc.py", diff="")
+    assert [p.name for p in tmp_path.iterdir()] == ["calc.py"]
+
+    crlf = tmp_path / "crlf.txt"
+    crlf.write_bytes(b"one\r\ntwo\r\n")
+    edit_file(str(tmp_path), "crlf.txt",
+              blocks="<<<<<<< SEARCH\ntwo\n=======\n2\n>>>>>>> REPLACE")
+    assert crlf.read_bytes() == b"one\r\n2\r\n"
+
+    # A block ending in a newline matches a last line without one, and
+    # only there, even if the same text appears earlier in the file.
+    tail = tmp_path / "tail.py"
+    tail.write_text("print('x = 1')\nx = 1")
+    res = edit_file(str(tmp_path), "tail.py",
+                    blocks="<<<<<<< SEARCH\nx = 1\n=======\nx = 2\n"
+                           ">>>>>>> REPLACE\n")
+    assert res.startswith("Successfully edited 'tail.py'")
+    assert tail.read_text() == "print('x = 1')\nx = 2"
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="needs os.fork")
+def test_warm_interpreters_match_fresh_runs(tmp_path: pathlib.Path) -> None:
+    (tmp_path / "helper.py").write_text("NAME = 'helper'\n")
+    (tmp_path / "script.py").write_text(
+        "import os, stat, sys\n"
+        "from helper import NAME\n"
+        "print(NAME, sys.argv[1:], os.path.basename(os.getcwd()))\n"
+        "# Output goes to a pipe that is read as it is written.\n"
+        "print(stat.S_ISFIFO(os.fstat(1).st_mode))\n"
+        "print('oops', file=sys.stderr)\n"
+        "sys.exit(int(sys.argv[1]))\n"
+    )
+    runs = [("script.py", ["0"]), ("script.py", ["2"]), ("missing.py", []),
+            ("../script.py", [])]
+
+    cold = [run_python_file(str(tmp_path), f, a) for f, a in runs]
+    use_warm_interpreters()
+    try:
+        warm = [run_python_file(str(tmp_path), f, a) for f, a in runs]
+    finally:
+        use_warm_interpreters(0)
+
+    # The last line of a run is its time and memory use.
+    assert warm[0].startswith("STDOUT:\n") and cold[0].startswith("STDOUT:\n")
+    assert [w.rsplit("\n", 1)[0] for w in warm[:2]] == [
+        c.rsplit("\n", 1)[0] for c in cold[:2]
+    ]
+    assert warm[2:] == cold[2:]
+    assert warm[0].startswith(f"STDOUT:\nhelper ['0'] {tmp_path.name}\n"
+                              "True\n\nSTDERR:\noops\n\nRan in ")
+    # A failing run still shows what it printed.
+    assert warm[1].startswith(f"STDOUT:\nhelper ['2'] {tmp_path.name}\n"
+                              "True\n\nSTDERR:\noops\n\nProcess exited with "
+                              "non-zero exit status 2\nRan in ")
+
+
+def test_run_python_file_caps_output_and_times_out_off_main_thread(
+        tmp_path: pathlib.Path,
+        monkeypatch: pytest.MonkeyPatch
+        ) -> None:
+    (tmp_path / "loud.py").write_text(
+        "print('first'); print('x' * 1_000_000); print('last')\n"
+    )
+    (tmp_path / "slow.py").write_text("import time; time.sleep(10)\n")
+    monkeypatch.setattr("functions.run_python_file.RUN_TIMEOUT_SECONDS", 0.5)
+
+    loud = run_python_file(str(tmp_path), "loud.py")
+    assert loud.startswith("STDOUT:\nfirst\nxxx")
+    assert "bytes elided...]" in loud
+    assert "x\nlast\n\nSTDERR:\n\nRan in " in loud
+    assert "peak RSS" in loud
+    assert len(loud) < 10_000
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        slow = list(pool.map(lambda _: run_python_file(str(tmp_path),
+                                                       "slow.py"), range(2)))
+    assert time.perf_counter() - start < 5
+    assert all("timed out after 0.5 seconds" in s for s in slow)
+
+
+def test_dispatch_runs_reads_in_parallel_in_call_order() -> None:
+    barrier = threading.Barrier(3, timeout=5)
+    calls = [
+        types.FunctionCall(name="get_file_content",
+                           args={"file_path": f"{i}.py"})
+        for i in range(3)
+    ]
+
+    def call(function_call_part: types.FunctionCall) -> str:
+        # Only returns if all three reads are in flight at the same time.
+        barrier.wait()
+        return function_call_part.args["file_path"]
+
+    assert dispatch_function_calls(calls, call) == ["0.py", "1.py", "2.py"]
+
+
+def test_dispatch_orders_writes_behind_overlapping_calls() -> None:
+    events: list[str] = []
+    calls = [
+        types.FunctionCall(name="get_file_content",
+                           args={"file_path": "pkg/calculator.py"}),
+        types.FunctionCall(name="write_file",
+                           args={"file_path": "pkg/calculator.py",
+                                 "content": ""}),
+        types.FunctionCall(name="get_files_info", args={"directory": "pkg"}),
+        types.FunctionCall(name="get_file_content",
+                           args={"file_path": "main.py"}),
+    ]
+
+    def call(function_call_part: types.FunctionCall) -> str:
+        name = function_call_part.name
+        path = (function_call_part.args or {}).get("file_path")
+        if name == "get_file_content" and path == "pkg/calculator.py":
+            time.sleep(0.05)
+        events.append(f"{name}:{path}" if path == "main.py" else name)
+        return name
+
+    res = dispatch_function_calls(calls, call)
+    assert res == [c.name for c in calls]
+    # The unrelated read of main.py does not wait for the slow read, while
+    # the write waits for it and the directory listing waits for the write.
+    assert events == [
+        "get_file_content:main.py",
+        "get_file_content",
+        "write_file",
+        "get_files_info",
+    ]
+
+
+SCRIPT = {
+    "read main": [
+        [("get_file_content", {"file_path": "main.py"})],
+        "main.py prints the result of the expression",
+    ],
+    "list pkg": [
+        [("get_files_info", {"directory": "pkg"})],
+        [("get_file_content", {"file_path": "pkg/render.py"})],
+        "pkg holds the calculator and the renderer",
+    ],
+}
+
+
+def test_engine_runs_scripted_session() -> None:
+    out = io.StringIO()
+    engine = AgentEngine(ScriptedModel(SCRIPT), stdout=out)
+
+    res = asyncio.run(engine.run("list pkg"))
+
+    assert res.text == "pkg holds the calculator and the renderer"
+    assert res.iterations == 3
+    assert res.function_calls == 2
+    assert res.prompt_tokens > 0 and res.error is None
+    assert " - Calling function: get_files_info" in out.getvalue()
+
+
+def test_engine_batch_streams_jsonl_with_bounded_concurrency() -> None:
+    model = ScriptedModel(SCRIPT, latency=0.01)
+    engine = AgentEngine(model, concurrency=2)
+    prompts = ["read main", "list pkg"] * 3
+    out = io.StringIO()
+
+    asyncio.run(write_batch_results(engine, iter(prompts), out))
+
+    results = [json.loads(line) for line in out.getvalue().splitlines()]
+    assert sorted(r["index"] for r in results) == list(range(len(prompts)))
+    assert all(r["prompt"] == prompts[r["index"]] for r in results)
+    assert all(r["error"] is None for r in results)
+    assert model.max_in_flight == 2
+
+
+def test_engine_batch_runs_sessions_while_waiting_for_prompts() -> None:
+    engine = AgentEngine(ScriptedModel(SCRIPT, latency=0.01))
+    produced = threading.Event()
+
+    def prompts():
+        yield "read main"
+        # Like stdin before the producer writes its next line.
+        produced.wait(5)
+        yield "list pkg"
+
+    async def main() -> tuple[float, list[SessionResult]]:
+        start = time.perf_counter()
+        results = engine.run_batch(prompts())
+        first = await anext(results)
+        elapsed = time.perf_counter() - start
+        produced.set()
+        return elapsed, [first] + [r async for r in results]
+
+    elapsed, results = asyncio.run(main())
+
+    assert elapsed < 2
+    assert [r.prompt for r in results] == ["read main", "list pkg"]
+
+
+def _read_turn(history: History, file_path: str, content: str) -> None:
+    function_call_part = types.FunctionCall(name="get_file_content",
+                                            args={"file_path": file_path})
+    history.add_model_content(types.Content(
+        role="model", parts=[types.Part(function_call=function_call_part)]
+    ))
+    history.add_tool_results(
+        [function_call_part],
+        [types.Content(role="tool", parts=[
+            types.Part.from_function_response(name="get_file_content",
+                                              response={"result": content})
+        ])]
+    )
+
+
+def test_history_stubs_superseded_outputs() -> None:
+    history = History("fix the bug")
+    _read_turn(history, "pkg/calculator.py", "x" * 4000)
+    first = history.compact()
+    _read_turn(history, "./pkg/calculator.py", "y" * 4000)
+    second = history.compact()
+
+    assert first.tokens_saved == 0
+    assert second.outputs_stubbed == 1 and second.tokens_saved > 900
+    # Each result is sent once, as a function response, never as user text.
+    assert [c.role for c in history.messages] == [
+        "user", "model", "tool", "model", "tool"
+    ]
+    assert "superseded by turn 2" in str(history.messages[2])
+    assert "y" * 4000 in str(history.messages[4])
+
+
+def test_history_stays_within_token_budget() -> None:
+    history = History("read everything", token_budget=3000)
+    sizes = []
+    for i in range(10):
+        _read_turn(history, f"file_{i}.py", "z" * 6000)
+        history.compact()
+        sizes.append(history.token_count)
+
+    # Only the latest, still unseen, output is kept whole.
+    assert max(sizes) <= 3000
+    assert history.tokens_saved > 10_000
+    assert "z" * 6000 in str(history.messages[-1])
+
+
+def _result_text(content: types.Content) -> str:
+    assert content.parts and content.parts[0].function_response
+    return str(content.parts[0].function_response.response)
+
+
+def test_tool_cache_answers_unchanged_reads_and_invalidates_on_write(
+                                                    tmp_path: pathlib.Path
+                                                    ) -> None:
+    (tmp_path / "big.py").write_text("a" * 5000)
+    cache = ToolCache(str(tmp_path))
+    call = partial(call_function, working_directory=str(tmp_path))
+    read = types.FunctionCall(name="get_file_content",
+                              args={"file_path": "big.py"})
+    write = types.FunctionCall(name="write_file",
+                               args={"file_path": "big.py", "content": "b"})
+
+    cache.turn = 1
+    assert "a" * 5000 in _result_text(cache.call(read, call))
+    cache.turn = 2
+    assert "unchanged since turn 1" in _result_text(cache.call(read, call))
+    cache.call(write, call)
+    cache.turn = 3
+    assert "'b'" in _result_text(cache.call(read, call))
+
+    # A change made behind the tool's back is caught through mtime and size.
+    (tmp_path / "big.py").write_text("c" * 10)
+    assert "'cccccccccc'" in _result_text(cache.call(read, call))
+    assert (cache.hits, cache.misses) == (1, 3)
+
+    # Bad arguments reach the tool, which answers with an error.
+    for depth in (None, "2"):
+        listing = types.FunctionCall(name="get_files_info",
+                                     args={"depth": depth})
+        assert "Error:" in _result_text(cache.call(listing, call))
+
+
+def test_engine_serves_repeated_reads_from_cache() -> None:
+    read = ("get_file_content", {"file_path": "pkg/calculator.py"})
+    model = ScriptedModel({"read twice": [[read], [read], "same file"]})
+    engine = AgentEngine(model)
+
+    res = asyncio.run(engine.run("read twice"))
+
+    assert (res.cache_hits, res.cache_misses) == (1, 1)
+    assert res.text == "same file"
+
+
+@pytest.mark.parametrize("stream", [False, True])
+def test_tracer_records_session_spans(
+                                      tmp_path: pathlib.Path,
+                                      stream: bool
+                                      ) -> None:
+    read = ("get_file_content", {"file_path": "pkg/calculator.py"})
+    model = ScriptedModel({"trace": [
+        [read],
+        [read, ("get_file_content", {"file_path": "missing.py"})],
+        [("run_python_file", {"file_path": "tests.py"})],
+        "traced",
+    ]})
+    tracer = Tracer()
+    engine = AgentEngine(model, tracer=tracer, stream=stream)
+
+    res = asyncio.run(engine.run("trace"))
+
+    by_category: dict[str, list] = {}
+    for span in tracer.spans:
+        by_category.setdefault(span.category, []).append(span)
+    [session] = by_category["session"]
+    assert session.attrs["iterations"] == res.iterations == 4
+    assert len(by_category["model"]) == 4
+    tools = {(s.iteration, s.attrs["args_bytes"]): s
+             for s in by_category["tool"]}
+    assert len(tools) == 4
+    assert [s.name for s in by_category["tool"]].count("run_python_file") == 1
+    hits = [s for s in tools.values() if s.attrs["cache_hit"]]
+    assert [(s.iteration, s.error) for s in hits] == [(2, None)]
+    [failed] = [s for s in tools.values() if s.error is not None]
+    assert "missing.py" in failed.error and failed.iteration == 2
+    [process] = by_category["process"]
+    assert process.name == "python tests.py" and process.session == 1
+    assert process.attrs["returncode"] == 0 and process.duration > 0
+
+    summary = tracer.summary()
+    assert summary.prompt_tokens == res.prompt_tokens > 0
+    assert (summary.iterations, summary.tool_calls, summary.cache_hits,
+            summary.process_runs, summary.errors) == (4, 4, 1, 1, 1)
+    assert 0 < summary.tool_p50 <= summary.tool_p95
+    assert "4 tool call(s), 1 from cache" in summary.format()
+
+    tracer.write(str(tmp_path / "trace.jsonl"))
+    lines = (tmp_path / "trace.jsonl").read_text().splitlines()
+    assert len(lines) == len(tracer.spans)
+    assert {json.loads(line)["cat"] for line in lines} == set(by_category)
+    tracer.write(str(tmp_path / "trace.json"), "chrome")
+    events = json.loads((tmp_path / "trace.json").read_text())["traceEvents"]
+    assert events[0]["ph"] == "M" and "trace" in events[0]["args"]["name"]
+    assert all(e["dur"] >= 0 and e["pid"] == 1 for e in events[1:])
+
+
+@pytest.mark.parametrize("stream", [False, True])
+def test_retrying_backend_survives_transient_errors(stream: bool) -> None:
+    flaky = FlakyBackend(ScriptedModel(SCRIPT), failures=[429, 0, 503, 500])
+    backend = RetryingBackend(flaky, RetryPolicy(base_delay=0.001))
+    engine = AgentEngine(backend, stream=stream)
+
+    res = asyncio.run(engine.run("list pkg"))
+
+    assert res.text == "pkg holds the calculator and the renderer"
+    assert (flaky.calls, flaky.failed) == (6, 3)
+    assert (backend.retries, backend.throttled) == (3, 2)
+
+
+def test_retrying_backend_honours_retry_after() -> None:
+    flaky = FlakyBackend(ScriptedModel(SCRIPT), failures=[429],
+                         retry_after=0.2)
+    backend = RetryingBackend(flaky, RetryPolicy(base_delay=0))
+    engine = AgentEngine(backend, concurrency=2)
+
+    async def both() -> list:
+        first = asyncio.create_task(engine.run("read main"))
+        await asyncio.sleep(0.05)
+        # Starts while the first session's quota pause is on.
+        return [await first, await engine.run("list pkg")]
+
+    start = time.perf_counter()
+    first, second = asyncio.run(both())
+    elapsed = time.perf_counter() - start
+
+    assert first.error is None and second.error is None
+    assert elapsed >= 0.2
+    # The second session waited out the pause instead of failing too.
+    assert flaky.failed == 1
+
+
+def test_retrying_backend_gives_up() -> None:
+    flaky = FlakyBackend(ScriptedModel(SCRIPT), failures=[400])
+    backend = RetryingBackend(flaky, RetryPolicy(base_delay=0.001))
+    with pytest.raises(errors.ClientError):
+        asyncio.run(AgentEngine(backend).run("read main"))
+    assert flaky.calls == 1
+
+    flaky = FlakyBackend(ScriptedModel(SCRIPT), failure_rate=1.0)
+    backend = RetryingBackend(flaky, RetryPolicy(max_retries=3,
+                                                 base_delay=0.001))
+    with pytest.raises(errors.ClientError):
+        asyncio.run(AgentEngine(backend).run("read main"))
+    assert flaky.calls == 4
+
+
+def test_token_bucket_limits_rate() -> None:
+    bucket = TokenBucket(per_minute=6000, burst=1)
+
+    async def take(times: int) -> None:
+        for _ in range(times):
+            await bucket.acquire()
+
+    start = time.perf_counter()
+    asyncio.run(take(6))
+    # 100 a second after a burst of one.
+    assert time.perf_counter() - start >= 0.045
+
+    bucket.adjust(-5)
+    assert bucket.tokens <= bucket.capacity
+
+
+def test_adaptive_concurrency_backs_off_and_recovers() -> None:
+    limiter = AdaptiveConcurrency(8)
+
+    async def call(success: bool | None) -> None:
+        await limiter.acquire()
+        await limiter.release(success)
+
+    async def run() -> list[int]:
+        limits = []
+        for outcome in [False, False, None, True, True, True, True, True,
+                        True, True]:
+            await call(outcome)
+            limits.append(limiter.limit)
+        return limits
+
+    assert asyncio.run(run()) == [4, 2, 2, 2, 3, 3, 3, 4, 4, 4]
+
+
+def test_retrying_backend_recovers_concurrency_after_errors() -> None:
+    flaky = FlakyBackend(ScriptedModel(SCRIPT), failures=[429] * 4,
+                         latency=0.01)
+    backend = RetryingBackend(flaky, RetryPolicy(base_delay=0.001),
+                              max_concurrency=4)
+    engine = AgentEngine(backend, concurrency=4)
+
+    async def run() -> list:
+        return await asyncio.gather(*(engine.run("read main")
+                                      for _ in range(4)))
+
+    results = asyncio.run(run())
+
+    assert all(r.error is None for r in results)
+    assert backend.retries == 4
+    # Cut to 1 by the errors, then grown back by the successful calls.
+    assert backend.concurrency.limit == 4
+    assert backend.concurrency.in_flight == 0
+
+
+CACHE_SCRIPT = {
+    "read all": [
+        [("get_file_content", {"file_path": "pkg/calculator.py"})],
+        [("get_file_content", {"file_path": "tests.py"})],
+        [("get_file_content", {"file_path": "main.py"})],
+        "read three files",
+    ],
+    "list often": [
+        [("get_files_info", {"directory": "pkg", "page_size": size})]
+        for size in range(1, 6)
+    ] + ["listed"],
+}
+
+
+@pytest.mark.parametrize("stream", [False, True])
+def test_prefix_cache_sends_only_new_messages(stream: bool) -> None:
+    plain = CachingModel(ScriptedModel(CACHE_SCRIPT))
+    expected = asyncio.run(AgentEngine(plain, stream=stream).run("read all"))
+
+    model = CachingModel(ScriptedModel(CACHE_SCRIPT))
+    backend = PrefixCachingBackend(model, min_tokens=500)
+    engine = AgentEngine(backend, stream=stream)
+    res = asyncio.run(engine.run("read all"))
+
+    assert res.text == expected.text
+    assert res.prompt_tokens == expected.prompt_tokens
+    assert res.cached_tokens > 0 and expected.cached_tokens == 0
+    assert sum(model.tokens_sent) < 0.6 * sum(plain.tokens_sent)
+    # The configuration, then the history once it has doubled the prefix.
+    assert backend.created == model.created == 2
+    assert backend.hits == res.iterations
+
+    # Another session shares the cached configuration.
+    other = asyncio.run(engine.run("list often"))
+    assert other.text == "listed" and other.cached_tokens > 0
+    assert model.created == 2
+    assert backend.hits == res.iterations + other.iterations
+
+
+def test_prefix_cache_refreshes_and_falls_back() -> None:
+    model = CachingModel(ScriptedModel(CACHE_SCRIPT, latency=0.06))
+    backend = PrefixCachingBackend(model, ttl=0.4, min_tokens=500)
+    engine = AgentEngine(backend)
+
+    res = asyncio.run(engine.run("list often"))
+    assert res.text == "listed"
+    assert model.created == 1 and backend.refreshed > 0
+    assert model.refreshed == backend.refreshed
+
+    # Caches deleted behind the backend's back are sent in full.
+    model.caches.clear()
+    res = asyncio.run(engine.run("list often"))
+    assert res.text == "listed"
+    assert backend.fallbacks == 1 and model.created == 2
+
+
+class _SlowCachingModel(CachingModel):
+    attempts = 0
+
+    async def create_cache(self, *args: object) -> tuple[str, int]:
+        self.attempts += 1
+        await asyncio.sleep(0.1)
+        return await super().create_cache(*args)  # type: ignore[arg-type]
+
+
+@pytest.mark.parametrize("cache_min_tokens", [0, 10**6])
+def test_prefix_cache_requests_share_one_creation(
+                                                  cache_min_tokens: int
+                                                  ) -> None:
+    model = _SlowCachingModel(ScriptedModel({"hi": ["hello"]}),
+                              min_tokens=cache_min_tokens)
+    backend = PrefixCachingBackend(model, min_tokens=100)
+    contents = [types.Content(role="user", parts=[types.Part(text="hi")])]
+    config = AgentEngine(backend).config
+
+    async def ask_four() -> list[types.GenerateContentResponse]:
+        return await asyncio.gather(*(backend.generate(contents, config)
+                                      for _ in range(4)))
+
+    start = time.perf_counter()
+    responses = asyncio.run(ask_four())
+    elapsed = time.perf_counter() - start
+
+    assert [r.text for r in responses] == ["hello"] * 4
+    # One round trip for all four, whether it succeeds or not.
+    assert model.attempts == 1 and elapsed < 0.3
+    if cache_min_tokens:
+        assert backend.hits == 0 and backend.min_tokens == 200
+    else:
+        assert backend.hits == 4 and model.created == 1
+
+
+def test_prefix_cache_fallback_without_cache_support() -> None:
+    backend = PrefixCachingBackend(ScriptedModel(CACHE_SCRIPT))
+    res = asyncio.run(AgentEngine(backend).run("read all"))
+    assert res.text == "read three files" and res.cached_tokens == 0
+    assert not backend.enabled
+
+    model = CachingModel(ScriptedModel(CACHE_SCRIPT), min_tokens=10**6)
+    backend = PrefixCachingBackend(model, min_tokens=500)
+    res = asyncio.run(AgentEngine(backend).run("read all"))
+    assert res.text == "read three files" and res.cached_tokens == 0
+    assert model.created == 0 and backend.min_tokens > 500
+
+
+@pytest.mark.parametrize("stream", [False, True])
+def test_engine_resumes_logged_session(
+                                       tmp_path: pathlib.Path,
+                                       stream: bool
+                                       ) -> None:
+    (tmp_path / "count.py").write_text(
+        "with open('runs.txt', 'a') as f:\n    f.write('run\\n')\n"
+    )
+    (tmp_path / "notes.txt").write_text("notes\n")
+    script = {"work": [
+        [("run_python_file", {"file_path": "count.py"}),
+         ("get_file_content", {"file_path": "notes.txt"})],
+        [("run_python_file", {"file_path": "count.py"})],
+        "done",
+    ]}
+    path = str(tmp_path / "session.jsonl")
+    log = SessionLog(path)
+    res = asyncio.run(AgentEngine(ScriptedModel(script),
+                                  working_directory=str(tmp_path),
+                                  stream=stream).run("work", log=log))
+    log.close()
+    assert res.text == "done"
+    assert (tmp_path / "runs.txt").read_text() == "run\n" * 2
+
+    # Crash in turn 1 after the run finished but before the read did, in
+    # the middle of writing a line.
+    lines = pathlib.Path(path).read_text().splitlines(keepends=True)
+    records = [json.loads(line) for line in lines]
+    assert sorted(r["type"] for r in records) == sorted(
+        ["start", "model", "tool", "tool", "model", "tool", "model", "final"]
+    )
+    (tmp_path / "runs.txt").write_text("run\n")
+    crashed = [
+        line for line, record in zip(lines, records)
+        if record["type"] == "start" or (
+            record.get("turn") == 1
+            and record.get("call", {}).get("name") != "get_file_content"
+        )
+    ]
+    assert len(crashed) == 3
+    pathlib.Path(path).write_text("".join(crashed) + lines[-1][:10])
+
+    saved = load_session(path)
+    assert saved.prompt == "work" and len(saved.responses) == 1
+    model = ScriptedModel(script)
+    out = io.StringIO()
+    log = SessionLog(path)
+    engine = AgentEngine(model,
+                         working_directory=saved.working_directory,
+                         stdout=out,
+                         stream=stream)
+    resumed = asyncio.run(engine.resume(saved, log))
+    log.close()
+
+    assert resumed.text == "done"
+    assert (resumed.iterations, resumed.function_calls) == (3, 3)
+    # Only the unfinished read of turn 1 and what followed ran again.
+    assert (tmp_path / "runs.txt").read_text() == "run\n" * 2
+    assert model.requests == 2
+    assert "Calling function: get_file_content" in out.getvalue()
+
+    finished = load_session(path)
+    assert finished.final == "done"
+    again = asyncio.run(AgentEngine(model).resume(finished))
+    assert again.text == "done" and model.requests == 2
+
+
+@pytest.mark.parametrize(
+    "ours, theirs, expected",
+    [
+        ("A\nb\nc\nd\n", "a\nb\nc\nD\n", "A\nb\nc\nD\n"),
+        ("z\na\nb\nc\nd\n", "a\nb\nc\nd\ne\n",
+         "z\na\nb\nc\nd\ne\n"),
+        ("a\nB\nc\nd\n", "a\nB\nc\nd\n", "a\nB\nc\nd\n"),
+        ("a\nB\nc\nd\n", "a\nX\nc\nd\n", None),
+        ("a\nB\nc\nd\n", "a\nb\nC\nd\n", None),
+    ],
+)
+def test_merge3(ours: str, theirs: str, expected: str | None) -> None:
+    assert merge3("a\nb\nc\nd\n", ours, theirs) == expected
+    assert merge3("a\nb\nc\nd\n", theirs, ours) == expected
+
+
+def test_snapshot_shares_files_until_tools_change_them(
+                                                tmp_path: pathlib.Path
+                                                ) -> None:
+    source = tmp_path / "source"
+    (source / "pkg" / "__pycache__").mkdir(parents=True)
+    (source / "pkg" / "__pycache__" / "calc.pyc").write_bytes(b"\0")
+    (source / "pkg" / "calc.py").write_text("def add(a, b):\n    pass\n")
+    (source / "main.py").write_text("print(1)\n")
+    (source / "old.txt").write_text("old\n")
+    copy = tmp_path / "copy"
+
+    method = snapshot(str(source), str(copy))
+    assert method in ("reflink", "copy")
+    assert (copy / "pkg" / "calc.py").read_text().endswith("pass\n")
+    assert not (copy / "pkg" / "__pycache__").exists()
+    assert changed_files(str(source), str(copy)) == {}
+
+    edit_file(str(copy), "pkg/calc.py", blocks=(
+        "<<<<<<< SEARCH\n    pass\n=======\n    return a + b\n"
+        ">>>>>>> REPLACE\n"
+    ))
+    write_file(str(copy), "main.py", "print(2)\n")
+    write_file(str(copy), "new.txt", "new\n")
+    (copy / "old.txt").unlink()
+    # Scripts may write files in place, and the model may name a working
+    # directory of its own; neither reaches the original.
+    (copy / "pkg" / "touch.py").write_text(
+        "open('main.py', 'r+').write('print(3)')\n"
+    )
+    call_function(types.FunctionCall(name="run_python_file", args={
+        "file_path": "pkg/touch.py", "working_directory": str(source)
+    }), working_directory=str(copy))
+    (copy / "pkg" / "touch.py").unlink()
+
+    assert (source / "pkg" / "calc.py").read_text().endswith("pass\n")
+    assert (source / "main.py").read_text() == "print(1)\n"
+    assert changed_files(str(source), str(copy)) == {
+        "pkg/calc.py": b"def add(a, b):\n    return a + b\n",
+        "main.py": b"print(3)\n",
+        "new.txt": b"new\n",
+        "old.txt": None,
+    }
+
+
+CALC = "".join(f"def f{i}(x):\n    return x\n\n\n" for i in range(4))
+
+
+def _edit(name: str, new: str) -> tuple[str, dict]:
+    return ("edit_file", {"file_path": "calc.py", "blocks": (
+        f"<<<<<<< SEARCH\ndef {name}(x):\n    return x\n=======\n"
+        f"def {name}(x):\n    return {new}\n>>>>>>> REPLACE\n"
+    )})
+
+
+def test_fan_out_merges_subtasks(tmp_path: pathlib.Path) -> None:
+    work = tmp_path / "work"
+    work.mkdir()
+    (work / "calc.py").write_text(CALC)
+    model = ScriptedModel({
+        "improve calc": [[("plan_subtasks", {"subtasks": [
+            "fix f0", "fix f3", "write notes"
+        ]})]],
+        "fix f0": [[_edit("f0", "x + 1")], "fixed f0"],
+        "fix f3": [[_edit("f3", "x * 3")], "fixed f3"],
+        "write notes": [[("write_file", {"file_path": "notes.txt",
+                                         "content": "f1, f2\n"})], "noted"],
+    }, latency=0.02)
+    out = io.StringIO()
+
+    res = asyncio.run(FanOut(model, str(work), workers=3,
+                             stdout=out).run("improve calc"))
+
+    assert res.fanned_out and res.subtasks == ["fix f0", "fix f3",
+                                               "write notes"]
+    assert [r.text for r in res.results] == ["fixed f0", "fixed f3", "noted"]
+    assert sorted(res.merged) == ["calc.py", "notes.txt"]
+    assert res.conflicts == []
+    assert (work / "calc.py").read_text() == CALC.replace(
+        "f0(x):\n    return x", "f0(x):\n    return x + 1"
+    ).replace("f3(x):\n    return x", "f3(x):\n    return x * 3")
+    assert (work / "notes.txt").read_text() == "f1, f2\n"
+    assert model.max_in_flight == 3
+    assert "Merged 2 file(s)" in res.format()
+    # The copies are gone.
+    assert [p.name for p in tmp_path.iterdir()] == ["work"]
+
+
+def test_fan_out_reports_conflicts(tmp_path: pathlib.Path) -> None:
+    work = tmp_path / "work"
+    work.mkdir()
+    (work / "calc.py").write_text(CALC)
+    model = ScriptedModel({
+        "fix f1": [[("plan_subtasks", {"subtasks": ["one", "two"]})]],
+        "one": [[_edit("f1", "x + 1")]],
+        "two": [[_edit("f1", "x - 1"), _edit("f2", "2")]],
+        "small": [[("plan_subtasks", {"subtasks": ["small"]})]],
+    })
+
+    res = asyncio.run(FanOut(model, str(work)).run("fix f1"))
+
+    assert res.merged == ["calc.py"]
+    [conflict] = res.conflicts
+    assert (conflict.path, conflict.subtask) == ("calc.py", 2)
+    assert "clashes with subtask 1" in res.format()
+    assert "return x - 1" in (pathlib.Path(conflict.workspace)
+                              / "calc.py").read_text()
+    assert (work / "calc.py").read_text() == CALC.replace(
+        "f1(x):\n    return x", "f1(x):\n    return x + 1"
+    )
+    shutil.rmtree(os.path.dirname(conflict.workspace))
+
+    # A prompt that is not split runs in the working directory itself.
+    res = asyncio.run(FanOut(model, str(work)).run("small"))
+    assert not res.fanned_out and res.results[0].text == "Done."
+    assert [p.name for p in tmp_path.iterdir()] == ["work"]
+
+
+def test_replay_serves_recorded_sessions(tmp_path: pathlib.Path) -> None:
+    recording = str(tmp_path / "session.jsonl")
+    recorder = RecordingBackend(ScriptedModel(SCRIPT), recording)
+    recorded = asyncio.run(AgentEngine(recorder).run("list pkg"))
+
+    replayer = ReplayBackend(recording, latency=0.02)
+    start = time.perf_counter()
+    replayed = asyncio.run(AgentEngine(replayer).run("list pkg"))
+
+    assert time.perf_counter() - start >= 3 * 0.02
+    assert replayed == recorded
+    with pytest.raises(LookupError):
+        asyncio.run(AgentEngine(replayer).run("never recorded"))
+
+
+def test_agent_loop_benchmark_reports_phases() -> None:
+    tasks = {"explore": SCRIPT["list pkg"]}
+
+    report = run_benchmark(tasks, repeat=2)
+
+    json.dumps(report)
+    assert report["summary"]["explore"]["iterations"] == 3
+    assert report["summary"]["explore"]["completed"]
+    run = report["runs"][0]
+    assert set(run["tool_seconds"]) == {"get_files_info", "get_file_content"}
+    assert [i["iteration"] for i in run["per_iteration"]] == [1, 2, 3]
+    assert run["per_iteration"][0]["prompt_tokens"] > 0
+
+
+def test_streaming_prints_text_and_starts_tools_early(
+                                            monkeypatch: pytest.MonkeyPatch
+                                            ) -> None:
+    calls = [("get_file_content", {"file_path": f"{i}.py"}) for i in range(3)]
+    model = ScriptedModel({"stream": [calls, "all three files read"]},
+                          chunk_latency=0.02)
+    started_mid_stream = []
+
+    def fake_call_function(function_call_part: types.FunctionCall,
+                           working_directory: str) -> types.Content:
+        started_mid_stream.append(model.in_flight == 1)
+        return types.Content(role="tool", parts=[
+            types.Part.from_function_response(name="get_file_content",
+                                              response={"result": "ok"})
+        ])
+
+    monkeypatch.setattr("agent.engine.call_function", fake_call_function)
+    out = io.StringIO()
+    engine = AgentEngine(model, stream=True, stdout=out)
+
+    res = asyncio.run(engine.run("stream"))
+
+    assert res.text == "all three files read" and res.function_calls == 3
+    # Every call but the last started before the stream had finished.
+    assert started_mid_stream[:2] == [True, True]
+    assert out.getvalue().endswith("all three files read\n")
+
+
+def test_replay_streams_recorded_chunks(tmp_path: pathlib.Path) -> None:
+    recording = str(tmp_path / "stream.jsonl")
+    recorder = RecordingBackend(ScriptedModel(SCRIPT), recording)
+    recorded = asyncio.run(AgentEngine(recorder, stream=True).run("list pkg"))
+
+    replayer = ReplayBackend(recording)
+    replayed = asyncio.run(AgentEngine(replayer, stream=True).run("list pkg"))
+    unstreamed = asyncio.run(AgentEngine(replayer).run("list pkg"))
+
+    assert recorded == replayed == unstreamed
+    assert recorded.text == SCRIPT["list pkg"][-1]
+
+
+def test_tool_schemas_are_generated_from_signatures() -> None:
+    declaration = function_declaration(run_python_file)
+
+    assert declaration.name == "run_python_file"
+    assert "optional args" in (declaration.description or "")
+    params = declaration.parameters
+    assert params is not None and params.properties is not None
+    assert set(params.properties) == {"file_path", "args"}
+    assert params.required == ["file_path"]
+    assert params.properties["args"].type == types.Type.ARRAY
+    assert available_functions() is available_functions()
+    assert [d.name for d in available_functions().function_declarations
+            or []] == ["get_files_info", "get_file_content",
+                       "write_file", "edit_file", "run_python_file",
+                       "search_code"]
+
+
+def test_cli_error_paths_skip_sdk_import() -> None:
+    code = ("import sys, main\n"
+            "try:\n"
+            "    main.main([])\n"
+            "except SystemExit:\n"
+            "    pass\n"
+            "print('google.genai' in sys.modules)\n")
+    res = subprocess.run([sys.executable, "-c", code],
+                         capture_output=True, text=True)
+    assert res.stdout.splitlines() == ["No prompt provided", "False"]
+
+
+def _ask_daemon(daemon: AgentDaemon, *requests: dict) -> list:
+    """
+    Starts `daemon`, sends `requests` concurrently with send_prompt and
+    returns (output, final event) for each.
+    """
+    def ask(request: dict) -> tuple[str, dict]:
+        out = io.StringIO()
+        event = send_prompt(daemon.socket_path, out=out, **request)
+        return out.getvalue(), event
+
+    async def main() -> list:
+        await daemon.start()
+        try:
+            return await asyncio.gather(*(asyncio.to_thread(ask, r)
+                                          for r in requests))
+        finally:
+            await daemon.close()
+
+    return asyncio.run(main())
+
+
+def test_daemon_serves_concurrent_sessions(tmp_path: pathlib.Path) -> None:
+    for name in ("one", "two"):
+        (tmp_path / name).mkdir()
+        (tmp_path / name / f"{name}.py").write_text(f"print('{name}')\n")
+    model = ScriptedModel(
+        {"run it": [[("get_files_info", {})], "listed"]}, latency=0.05
+    )
+    daemon = AgentDaemon(model, str(tmp_path / "agent.sock"),
+                         concurrency=2)
+
+    (out_one, one), (out_two, two) = _ask_daemon(
+        daemon,
+        {"prompt": "run it", "session": "one", "verbose": True,
+         "working_directory": str(tmp_path / "one")},
+        {"prompt": "run it", "session": "two", "verbose": True,
+         "working_directory": str(tmp_path / "two")},
+    )
+
+    assert one["event"] == two["event"] == "result"
+    assert one["result"]["text"] == "listed"
+    assert "one.py" in out_one and "two.py" not in out_one
+    assert "two.py" in out_two and "one.py" not in out_two
+    assert model.max_in_flight == 2
+    assert not os.path.exists(daemon.socket_path)
+
+
+def test_daemon_continues_named_session(tmp_path: pathlib.Path) -> None:
+    model = ScriptedModel({"remember main.py": [
+        "noted",
+        [("get_file_content", {"file_path": "main.py"})],
+        "main.py prints the result",
+    ]})
+    daemon = AgentDaemon(model, str(tmp_path / "agent.sock"))
+
+    async def main() -> list:
+        await daemon.start()
+        try:
+            events = []
+            for prompt in ("remember main.py", "what does it do?"):
+                events.append(await asyncio.to_thread(
+                    send_prompt, daemon.socket_path, prompt, io.StringIO(),
+                    session="s"
+                ))
+            events.append(await asyncio.to_thread(
+                send_prompt, daemon.socket_path, "what does it do?",
+                io.StringIO()
+            ))
+            events.append(await asyncio.to_thread(
+                send_prompt, daemon.socket_path, "again", io.StringIO(),
+                working_directory=str(tmp_path), session="s"
+            ))
+            return events
+        finally:
+            await daemon.close()
+
+    first, follow_up, one_off, moved = asyncio.run(main())
+
+    assert first["result"]["text"] == "noted"
+    assert follow_up["result"]["text"] == "main.py prints the result"
+    assert follow_up["result"]["function_calls"] == 1
+    # Without a session the same follow-up starts a new conversation.
+    assert one_off["result"]["text"] == "Done."
+    assert moved["event"] == "error"
+    assert "session 's' works in" in moved["error"]
+    history = daemon.sessions["s"].history
+    assert history is not None
+    assert [c.role for c in history.messages].count("user") == 2
+
+
+def test_daemon_streams_output_to_client(tmp_path: pathlib.Path) -> None:
+    model = ScriptedModel({"stream": ["one two three four five"]},
+                          chunk_latency=0.01)
+    daemon = AgentDaemon(model, str(tmp_path / "agent.sock"))
+
+    [(out, event)] = _ask_daemon(daemon, {"prompt": "stream",
+                                          "stream": True})
+
+    assert event["result"]["text"] == "one two three four five"
+    assert "one two three four five" in out
+
+
+def test_daemon_rolls_back_failed_turn(tmp_path: pathlib.Path) -> None:
+    model = FlakyBackend(ScriptedModel({"remember main.py": [
+        "noted",
+        "main.py prints the result",
+    ]}), failures=[0, 400])
+    daemon = AgentDaemon(model, str(tmp_path / "agent.sock"))
+
+    async def main() -> list:
+        await daemon.start()
+        try:
+            return [await asyncio.to_thread(send_prompt, daemon.socket_path,
+                                            prompt, io.StringIO(),
+                                            session="s")
+                    for prompt in ("remember main.py", "what does it do?",
+                                   "what does it do?")]
+        finally:
+            await daemon.close()
+
+    first, failed, retried = asyncio.run(main())
+
+    assert first["result"]["text"] == "noted"
+    assert failed["event"] == "error" and "400" in failed["error"]
+    assert retried["result"]["text"] == "main.py prints the result"
+    history = daemon.sessions["s"].history
+    assert history is not None
+    assert [c.role for c in history.messages] == ["user", "model",
+                                                  "user", "model"]
+
+
+def test_daemon_evicts_sessions(tmp_path: pathlib.Path) -> None:
+    daemon = AgentDaemon(ScriptedModel({}), str(tmp_path / "agent.sock"),
+                         session_ttl=0.2, max_sessions=2)
+
+    async def ask(*names: str | None) -> list:
+        for name in names:
+            await asyncio.to_thread(send_prompt, daemon.socket_path, "hi",
+                                    io.StringIO(), session=name)
+        return list(daemon.sessions)
+
+    async def main() -> list:
+        await daemon.start()
+        try:
+            full = await ask("a", "b", "a", "c")
+            await asyncio.sleep(0.3)
+            return [full, await ask("d"), await ask(None)]
+        finally:
+            await daemon.close()
+
+    full, after_idle, one_off = asyncio.run(main())
+
+    # "b" was used least recently when "c" came.
+    assert full == ["a", "c"]
+    assert after_idle == ["d"]
+    assert one_off == ["d"]
+
+
+def test_daemon_stops_session_of_gone_client(tmp_path: pathlib.Path) -> None:
+    model = ScriptedModel({"stream": [" ".join(["word"] * 400)]},
+                          chunk_latency=0.01)
+    daemon = AgentDaemon(model, str(tmp_path / "agent.sock"))
+
+    def hang_up() -> None:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.connect(daemon.socket_path)
+            sock.sendall(json.dumps({"prompt": "stream", "session": "s",
+                                     "stream": True}).encode() + b"\n")
+            sock.recv(1)
+
+    async def main() -> float:
+        await daemon.start()
+        try:
+            start = time.perf_counter()
+            await asyncio.to_thread(hang_up)
+            while ("s" not in daemon.sessions
+                   or daemon.sessions["s"].lock.locked()):
+                await asyncio.sleep(0.01)
+            return time.perf_counter() - start
+        finally:
+            await daemon.close()
+
+    elapsed = asyncio.run(main())
+
+    # The stream takes over a second; the session ends at the next chunk.
+    assert elapsed < 0.5
+    history = daemon.sessions["s"].history
+    assert history is not None and history.messages == []
+
+
+def test_cli_connect_skips_sdk_import(tmp_path: pathlib.Path) -> None:
+    socket_path = str(tmp_path / "agent.sock")
+    code = ("import sys, main\n"
+            "try:\n"
+            f"    main.main(['--connect', {socket_path!r}, 'hi'])\n"
+            "except SystemExit:\n"
+            "    pass\n"
+            "print('google.genai' in sys.modules)\n")
+    res = subprocess.run([sys.executable, "-c", code],
+                         capture_output=True, text=True)
+    error, imported = res.stdout.splitlines()
+    assert error.startswith("Error: cannot reach the daemon on ")
+    assert imported == "False"
+
+
 if __name__ == "__main__":
     print(run_python_file("calculator", "main.py"))
     print(run_python_file("calculator", "main.py", ["3 + 5"]))